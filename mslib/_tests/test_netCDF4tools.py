@@ -25,12 +25,16 @@
     limitations under the License.
 """
 
+import gc
 import os
+import shutil
 import pytest
 import datetime
 from netCDF4 import Dataset
+from mslib import netCDF4tools
 from mslib.netCDF4tools import (identify_variable, identify_CF_lonlat,
-                                identify_vertical_axis, identify_CF_time, num2date, get_latlon_data
+                                identify_vertical_axis, identify_CF_time, num2date, get_latlon_data,
+                                standard_name_index, MFDatasetCommonDims
                                 )
 
 from mslib._tests.constants import DATA_DIR
@@ -68,6 +72,26 @@ class Test_netCDF4tools(object):
             variable = identify_variable(self.ncfile_ml, standard_name)
             assert variable[0] == short_name
 
+    def test_standard_name_index(self):
+        index = standard_name_index(self.ncfile_ml)
+        assert standard_name_index(self.ncfile_ml) is index
+        assert index["time"][1] == "time"
+        assert index["latitude"][1] == "lat"
+        assert identify_variable(self.ncfile_ml, "latitude")[1] is self.ncfile_ml.variables["lat"]
+        assert identify_variable(self.ncfile_ml, ["longitude", "latitude"])[0] == "lat"
+        assert identify_variable(self.ncfile_ml, "fnord") == (None, None)
+        with pytest.raises(IOError):
+            identify_variable(self.ncfile_ml, "fnord", check=True)
+
+    def test_standard_name_index_released(self):
+        netCDF4tools._STANDARD_NAME_INDEX.clear()
+        with Dataset(DATA_FILE_ML, 'r') as ncfile:
+            identify_variable(ncfile, "latitude")
+            assert len(netCDF4tools._STANDARD_NAME_INDEX) == 1
+        del ncfile
+        gc.collect()
+        assert len(netCDF4tools._STANDARD_NAME_INDEX) == 0
+
     def test_identify_CF_coordhybrid(self):
         lat_name, lat_var, lon_name, lon_var = identify_CF_lonlat(self.ncfile_ml)
         assert (lat_name, lon_name) == ('lat', 'lon')
@@ -131,3 +155,27 @@ class Test_netCDF4tools(object):
     def test_num2date(self):
         date = num2date(0, "hours since 2012-10-17T12:00:00.000Z", calendar='standard')
         assert date == datetime.datetime(2012, 10, 17, 12, 0)
+
+    def test_mfdataset_compatibility_cache(self, tmp_path):
+        netCDF4tools._COMPATIBLE_FILE_SETS.clear()
+        # the modification time is changed below, so work on copies of the shared test data
+        files = []
+        for filename in [DATA_FILE_PL, DATA_FILE_ML, DATA_FILE_ML.replace(".CC.", ".SFC.").replace(".ml.", ".sfc.")]:
+            files.append(os.path.join(tmp_path, os.path.basename(filename)))
+            shutil.copy(filename, files[-1])
+        file_pl, file_ml, file_sfc = files
+        with MFDatasetCommonDims([file_pl, file_sfc]) as dataset:
+            assert "air_temperature" in dataset.variables
+        assert len(netCDF4tools._COMPATIBLE_FILE_SETS) == 1
+        with MFDatasetCommonDims([file_pl, file_sfc]) as dataset:
+            assert "air_temperature" in dataset.variables
+        assert len(netCDF4tools._COMPATIBLE_FILE_SETS) == 1
+
+        stat = os.stat(file_pl)
+        os.utime(file_pl, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        MFDatasetCommonDims([file_pl, file_sfc]).close()
+        assert len(netCDF4tools._COMPATIBLE_FILE_SETS) == 2
+
+        with pytest.raises(IOError):
+            MFDatasetCommonDims([file_pl, file_ml])
+        assert len(netCDF4tools._COMPATIBLE_FILE_SETS) == 2
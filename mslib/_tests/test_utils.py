@@ -42,11 +42,55 @@ LOGGER = logging.getLogger(__name__)
 class TestParseTime(object):
     def test_parse_iso_datetime(self):
         assert utils.parse_iso_datetime("2009-05-28T16:15:00") == datetime.datetime(2009, 5, 28, 16, 15)
+        assert utils.parse_iso_datetime("2009-05-28T16:15:00Z") == datetime.datetime(2009, 5, 28, 16, 15)
+        assert utils.parse_iso_datetime("2009-05-28T18:15:00+02:00") == datetime.datetime(2009, 5, 28, 16, 15)
+        assert utils.parse_iso_datetime("20090528T161500Z") == datetime.datetime(2009, 5, 28, 16, 15)
+        assert utils.parse_iso_datetime("2009-05-28") == datetime.datetime(2009, 5, 28)
 
     def test_parse_iso_duration(self):
         assert utils.parse_iso_duration('P01W') == datetime.timedelta(days=7)
 
 
+class TestTimeExtent(object):
+    def setup(self):
+        self.start = datetime.datetime(2012, 10, 17, 12)
+        self.hour = datetime.timedelta(hours=1)
+
+    def test_runs(self):
+        extent = utils.TimeExtent([(self.start + 100 * self.hour, self.start + 100 * self.hour, None),
+                                   (self.start, self.start + 4 * self.hour, 2 * self.hour),
+                                   (self.start + 1000 * self.hour, self.start + 1000000 * self.hour, self.hour)])
+        assert len(extent) == 3 + 1 + 999001
+        assert extent[:5] == [self.start, self.start + 2 * self.hour, self.start + 4 * self.hour,
+                              self.start + 100 * self.hour, self.start + 1000 * self.hour]
+        assert extent[-1] == self.start + 1000000 * self.hour
+        assert extent.index(self.start + 1001 * self.hour) == 5
+        assert self.start + 2 * self.hour in extent
+        assert self.start + self.hour not in extent
+        assert self.start + 1000001 * self.hour not in extent
+        assert list(extent)[:4] == extent[:4]
+        with pytest.raises(IndexError):
+            extent[len(extent)]
+
+    def test_strings(self):
+        extent = utils.TimeExtent([(self.start, self.start + 12 * self.hour, 6 * self.hour)]).strings()
+        assert list(extent) == ["2012-10-17T12:00:00Z", "2012-10-17T18:00:00Z", "2012-10-18T00:00:00Z"]
+        assert extent[1] == "2012-10-17T18:00:00Z"
+        assert "2012-10-18T00:00:00Z" in extent
+        assert "2012-10-18T01:00:00Z" not in extent
+        assert "fnord" not in extent
+
+    def test_overlapping(self):
+        extent = utils.TimeExtent([(self.start, self.start + 4 * self.hour, 2 * self.hour),
+                                   (self.start + self.hour, self.start + 3 * self.hour, self.hour),
+                                   (self.start, self.start, None)])
+        assert list(extent) == [self.start + _x * self.hour for _x in range(5)]
+
+    def test_months(self):
+        extent = utils.TimeExtent([(self.start, self.start + 40 * 24 * self.hour, utils.parse_iso_duration("P1M"))])
+        assert list(extent) == [self.start, datetime.datetime(2012, 11, 17, 12)]
+
+
 class TestSettingsSave(object):
     """
     tests save_settings_qsettings and load_settings_qsettings from ./utils.py
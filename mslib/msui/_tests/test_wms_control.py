@@ -33,6 +33,7 @@ import tempfile
 import pytest
 import hashlib
 import multiprocessing
+from datetime import datetime
 from mslib.mswms.mswms import application
 from PyQt5 import QtWidgets, QtCore, QtTest
 from mslib.msui import flighttrack as ft
@@ -340,6 +341,7 @@ class Test_HSecWMSControlWidget(WMSControlWidgetSetup):
         # Check layer filter is working
         server.child(0).is_favourite = False
         self.window.multilayers.leMultiFilter.setText("No matches")
+        wait_until_signal(self.window.multilayers.filter_timer.timeout)
         assert server.isHidden()
         self.window.multilayers.remove_filter_triggered()
         assert not server.isHidden()
@@ -733,6 +735,95 @@ class TestWMSControlWidgetSetupSimple(object):
         assert [self.window.cbInitTime.itemText(i) for i in range(self.window.cbInitTime.count())] == \
             ['2012-10-16T12:00:00Z', '2012-10-17T12:00:00Z']
 
+    def test_xml_time_compact(self):
+        dimext_time_compact = """
+            <Dimension name="TIME" units="ISO8610"> </Dimension>
+            <Extent name="TIME"> 2012-10-17T12:00:00Z/2012-10-27T12:00:00Z/PT1H,2012-11-01T00:00:00Z </Extent>"""
+        testxml = self.xml.format(
+            "", self.srs_base, dimext_time_compact + self.dimext_inittime + self.dimext_elevation)
+        self.window.activate_wms(wc.MSSWebMapService(None, version='1.1.1', xml=testxml))
+        QtWidgets.QApplication.processEvents()
+        valid_times = [self.window.cbValidTime.itemText(i) for i in range(self.window.cbValidTime.count())]
+        assert len(valid_times) == 10 * 24 + 2
+        assert valid_times[:2] == ['2012-10-17T12:00:00Z', '2012-10-17T13:00:00Z']
+        assert valid_times[-2:] == ['2012-10-27T12:00:00Z', '2012-11-01T00:00:00Z']
+        layer = self.window.multilayers.get_current_layer()
+        assert datetime(2012, 10, 20, 5) in layer.allowed_valid_times
+        assert datetime(2012, 10, 30) not in layer.allowed_valid_times
+
+    def test_xml_lazy_layers(self):
+        other_layer = """
+            <Layer>
+                <Name>ecmwf_EUR_LL015.PLGeopWind01</Name>
+                <Title> Geopotential Height (m) and Horizontal Wind (m/s) </Title>
+                {}
+            </Layer>""".format(self.srs_base + self.dimext_time + self.dimext_elevation)
+        testxml = self.xml.format(
+            other_layer, self.srs_base, self.dimext_time + self.dimext_inittime + self.dimext_elevation)
+        wms = wc.MSSWebMapService(None, version='1.1.1', xml=testxml)
+        wms.url = "http://localhost/"
+        self.window.cbAutoUpdate.setCheckState(False)
+        self.window.activate_wms(wms)
+        QtWidgets.QApplication.processEvents()
+        server = self.window.multilayers.listLayers.findItems("http://localhost/", QtCore.Qt.MatchFixedString)[0]
+        other, current = server.child(0), server.child(1)
+        assert self.window.multilayers.get_current_layer() is current
+        assert current.is_parsed
+        assert not other.is_parsed
+        assert self.window.multilayers.listLayers.itemWidget(other, 1) is None
+        self.window.multilayers.multilayer_clicked(other)
+        QtWidgets.QApplication.processEvents()
+        assert other.is_parsed
+        assert other.get_levels() == ['500.0 (hPa)', '600.0 (hPa)', '700.0 (hPa)', '900.0 (hPa)']
+        assert other.get_itimes() == []
+        assert self.window.lLayerName.text().endswith("ecmwf_EUR_LL015.PLGeopWind01")
+
+    def test_xml_filter(self):
+        other_layer = """
+            <Layer>
+                <Name>ecmwf_EUR_LL015.PLGeopWind01</Name>
+                <Title> Geopotential Height (m) and Horizontal Wind (m/s) </Title>
+                <Abstract> Wind barbs on pressure levels </Abstract>
+                {}
+            </Layer>""".format(self.srs_base + self.dimext_time + self.dimext_elevation)
+        testxml = self.xml.format(
+            other_layer, self.srs_base, self.dimext_time + self.dimext_inittime + self.dimext_elevation)
+        wms = wc.MSSWebMapService(None, version='1.1.1', xml=testxml)
+        wms.url = "http://localhost/"
+        self.window.activate_wms(wms)
+        QtWidgets.QApplication.processEvents()
+        multilayers = self.window.multilayers
+        server = multilayers.listLayers.findItems("http://localhost/", QtCore.Qt.MatchFixedString)[0]
+        wind, temp = server.child(0), server.child(1)
+
+        def hidden(filter_string):
+            multilayers.filter_multilayers(filter_string)
+            return [wind.isHidden(), temp.isHidden(), server.isHidden()]
+
+        assert hidden("geop") == [False, False, False]
+        assert hidden("Geop HEIGHT") == [False, False, False]
+        assert hidden("barbs") == [False, True, False]
+        assert hidden("pltemp ecmwf_eur") == [True, False, False]
+        assert hidden("emp") == [True, True, True]
+        assert hidden("") == [False, False, False]
+
+        temp.is_favourite = True
+        multilayers.filter_favourite_toggled()
+        assert hidden("") == [True, False, False]
+        assert hidden("wind") == [True, True, True]
+        multilayers.remove_filter_triggered()
+        assert [wind.isHidden(), temp.isHidden(), server.isHidden()] == [False, False, False]
+        temp.is_favourite = False
+
+        multilayers.leMultiFilter.setText("barbs")
+        assert not temp.isHidden()
+        assert wait_until_signal(multilayers.filter_timer.timeout)
+        assert temp.isHidden()
+
+        multilayers.delete_server(server)
+        assert multilayers.layer_index.search("geop") == set()
+        assert multilayers.hidden_layers == set()
+
     def test_xml_time_multiperiod(self):
         dimext_time_period = '<Dimension name="TIME" units="ISO8610"> </Dimension> ' \
             '<Extent name="TIME"> 2010-10-17T12:00:00Z/2010-11-18T00:00:00Z/P1M, ' \
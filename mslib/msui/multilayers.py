@@ -25,13 +25,92 @@
     limitations under the License.
 """
 from PyQt5 import QtWidgets, QtCore, QtGui
+import bisect
+import functools
 import logging
+import re
 import mslib.msui.wms_control
 from mslib.msui.icons import icons
 from mslib.msui.mss_qt import ui_wms_multilayers as ui
 from mslib.utils import save_settings_qsettings, load_settings_qsettings
 
 
+@functools.lru_cache()
+def star_icon(filled):
+    """
+    Returns the icon of favourite layers or of the other ones, shared by all layers
+    """
+    return QtGui.QIcon(icons("64x64", "star_filled.png" if filled else "star_unfilled.png"))
+
+
+class LayerIndex(object):
+    """
+    Index of the words in the names, titles and abstracts of the layers. A filter
+    string matches the layers having, for each of its words, a word starting with it.
+    """
+
+    def __init__(self):
+        self.layers = {}
+        self.words = {}
+        self.sorted_words = None
+        self.cache = {}
+
+    @staticmethod
+    def split(text):
+        return set(re.findall(r"[^\W_]+", text.lower()))
+
+    def add(self, layer, *texts):
+        """
+        Adds <layer> with the words of <texts>
+        """
+        self.remove(layer)
+        words = set().union(*[self.split(_x) for _x in texts if _x])
+        self.layers[layer] = words
+        for word in words:
+            self.words.setdefault(word, set()).add(layer)
+        self.sorted_words = None
+        self.cache.clear()
+
+    def remove(self, layer):
+        """
+        Removes <layer>, if it is indexed
+        """
+        for word in self.layers.pop(layer, []):
+            self.words[word].discard(layer)
+            if not self.words[word]:
+                del self.words[word]
+        self.sorted_words = None
+        self.cache.clear()
+
+    def find(self, prefix):
+        """
+        Returns the set of layers having a word starting with <prefix>
+        """
+        if prefix not in self.cache:
+            if self.sorted_words is None:
+                self.sorted_words = sorted(self.words)
+            layers = set()
+            index = bisect.bisect_left(self.sorted_words, prefix)
+            while index < len(self.sorted_words) and self.sorted_words[index].startswith(prefix):
+                layers.update(self.words[self.sorted_words[index]])
+                index += 1
+            self.cache[prefix] = layers
+        return self.cache[prefix]
+
+    def search(self, filter_string):
+        """
+        Returns the set of layers matching <filter_string> or None if it contains no words
+        """
+        result = None
+        # long words match few layers, so start with them
+        for word in sorted(self.split(filter_string), key=len, reverse=True):
+            layers = self.find(word)
+            result = set(layers) if result is None else result & layers
+            if not result:
+                break
+        return result
+
+
 class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
     """
     Contains all layers of all loaded WMS and provides helpful methods to manage them inside a popup dialog
@@ -57,6 +136,9 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         self.height = None
         self.scale = self.logicalDpiX() / 96
         self.filter_favourite = False
+        self.layer_index = LayerIndex()
+        self.favourite_layers = set()
+        self.hidden_layers = set()
         self.carry_parameters = {"level": None, "itime": None, "vtime": None}
         self.is_linear = isinstance(dock_widget, mslib.msui.wms_control.LSecWMSControlWidget)
         self.settings = load_settings_qsettings("multilayers",
@@ -66,6 +148,7 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         self.listLayers.itemClicked.connect(self.multilayer_clicked)
         self.listLayers.itemClicked.connect(self.check_icon_clicked)
         self.listLayers.itemDoubleClicked.connect(self.multilayer_doubleclicked)
+        self.listLayers.currentItemChanged.connect(self.multilayer_selected)
         self.listLayers.setVisible(True)
 
         self.leMultiFilter.setVisible(True)
@@ -80,7 +163,12 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         self.filterRemoveAction.triggered.connect(lambda x: self.remove_filter_triggered())
         self.filterFavouriteAction.triggered.connect(lambda x: self.filter_favourite_toggled())
         self.cbMultilayering.stateChanged.connect(self.toggle_multilayering)
-        self.leMultiFilter.textChanged.connect(self.filter_multilayers)
+        # filter once typing pauses, not on every keystroke
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.filter_multilayers)
+        self.leMultiFilter.textChanged.connect(lambda text: self.filter_timer.start())
 
         self.listLayers.setColumnWidth(2, 50)
         self.listLayers.setColumnWidth(3, 50)
@@ -105,6 +193,9 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
                 widget = server.child(child_index)
                 if widget in self.layers_priority:
                     self.layers_priority.remove(widget)
+                self.layer_index.remove(widget)
+                self.favourite_layers.discard(widget)
+                self.hidden_layers.discard(widget)
 
             index = self.listLayers.indexOfTopLevelItem(server)
             self.layers.pop(server.text(0))
@@ -116,6 +207,8 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         self.leMultiFilter.setText("")
         if self.filter_favourite:
             self.filter_favourite_toggled()
+        else:
+            self.filter_multilayers()
 
     def filter_favourite_toggled(self):
         self.filter_favourite = not self.filter_favourite
@@ -166,7 +259,7 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         """
         if self.cbMultilayering.isChecked():
             active_layers = self.get_active_layers()
-            synced_layers = [layer for layer in active_layers if layer.is_synced]
+            synced_layers = self.get_active_layers(only_synced=True)
             return synced_layers[0] if synced_layers else active_layers[0] if active_layers else None
         else:
             return self.current_layer
@@ -202,36 +295,37 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
 
     def filter_multilayers(self, filter_string=None):
         """
-        Hides all multilayers that don't contain the filter_string
+        Hides all multilayers that don't match the filter_string
         Shows all multilayers that do
+        Only the items whose visibility changes are updated
         """
+        self.filter_timer.stop()
         if filter_string is None:
             filter_string = self.leMultiFilter.text()
 
+        shown = self.layer_index.search(filter_string)
+        if self.filter_favourite:
+            shown = self.favourite_layers if shown is None else shown & self.favourite_layers
+        hidden = set() if shown is None else self.layer_index.layers.keys() - shown
+        for widget in hidden ^ self.hidden_layers:
+            widget.setHidden(widget in hidden)
+        self.hidden_layers = hidden
+
+        shown_servers = None if shown is None else {widget.wms_name for widget in shown}
         for wms_name in self.layers:
             header = self.layers[wms_name]["header"]
-            wms_hits = 0
-            for child_index in range(header.childCount()):
-                widget = header.child(child_index)
-                if filter_string.lower() in widget.text(0).lower() and (
-                        not self.filter_favourite or widget.is_favourite):
-                    widget.setHidden(False)
-                    wms_hits += 1
-                else:
-                    widget.setHidden(True)
-            if wms_hits == 0 and (len(filter_string) > 0 or self.filter_favourite):
-                header.setHidden(True)
-            else:
-                header.setHidden(False)
+            is_hidden = shown_servers is not None and wms_name not in shown_servers
+            if header.isHidden() != is_hidden:
+                header.setHidden(is_hidden)
 
         self.filterRemoveAction.setVisible(self.filter_favourite or len(filter_string) > 0)
 
-    def get_multilayer_common_options(self, additional_layer=None):
+    def get_multilayer_common_options(self, additional_layer=None, layers=None):
         """
         Return the common option for levels, init_times, valid_times and CRS
-        for all synchronised layers and the additional provided one
+        for all synchronised layers, or the given <layers>, and the additional provided one
         """
-        layers = self.get_active_layers(only_synced=True)
+        layers = list(layers) if layers is not None else self.get_active_layers(only_synced=True)
         if additional_layer:
             layers.append(additional_layer)
 
@@ -325,6 +419,7 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
             widget.wms_name = wms.url
             if layerobj.abstract:
                 widget.setToolTip(0, layerobj.abstract)
+            self.layer_index.add(widget, name, layerobj.abstract)
             if self.cbMultilayering.isChecked():
                 widget.setCheckState(0, QtCore.Qt.Unchecked)
 
@@ -344,29 +439,41 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
 
                 color.clicked.connect(lambda: color_changed(widget))
 
-            if widget.style:
-                style = QtWidgets.QComboBox()
-                style.setFixedHeight(self.height)
-                style.setFixedWidth(200)
-                style.addItems(widget.styles)
-                style.setCurrentIndex(style.findText(widget.style))
-
-                def style_changed(layer):
-                    layer.style = self.listLayers.itemWidget(layer, 1).currentText()
-                    layer.style_changed()
-                    self.multilayer_clicked(layer)
-                    self.dock_widget.auto_update()
-
-                style.currentIndexChanged.connect(lambda: style_changed(widget))
-                self.listLayers.setItemWidget(widget, 1, style)
-
             size = QtCore.QSize()
             size.setHeight(self.height)
             widget.setSizeHint(0, size)
 
             self.layers[wms.url][name] = widget
             self.current_layer = widget
+            self.threads += 1
             self.listLayers.setCurrentItem(widget)
+            self.threads -= 1
+
+    def add_style_widget(self, layer):
+        """
+        Adds the combobox to select the style of <layer>, once it is parsed
+        """
+        style = QtWidgets.QComboBox()
+        style.setFixedHeight(self.height)
+        style.setFixedWidth(200)
+        style.addItems(layer.styles)
+        style.setCurrentIndex(style.findText(layer.style))
+
+        def style_changed(layer):
+            layer.style = self.listLayers.itemWidget(layer, 1).currentText()
+            layer.style_changed()
+            self.multilayer_clicked(layer)
+            self.dock_widget.auto_update()
+
+        style.currentIndexChanged.connect(lambda: style_changed(layer))
+        self.listLayers.setItemWidget(layer, 1, style)
+
+    def multilayer_selected(self, item):
+        """
+        Parses the layer becoming the current item, so that its style can be chosen
+        """
+        if self.threads == 0 and isinstance(item, Layer):
+            item.parse()
 
     def multilayer_clicked(self, item):
         """
@@ -464,23 +571,33 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
         can be synchronised or not
         """
         self.threads += 1
+        active_layers = self.get_active_layers()
+        synced_layers = self.get_active_layers(only_synced=True)
+        common_options = self.get_multilayer_common_options(layers=synced_layers) if active_layers else None
         for wms_name in self.layers:
             header = self.layers[wms_name]["header"]
             for child_index in range(header.childCount()):
                 layer = header.child(child_index)
-                is_active = self.is_sync_possible(layer) or not (layer.itimes or layer.vtimes or layer.levels)
+                # without active layers, all are enabled and need not be parsed
+                is_active = not active_layers or \
+                    self.is_sync_possible(layer, active_layers, synced_layers, common_options) or \
+                    not (layer.itimes or layer.vtimes or layer.levels)
                 layer.setDisabled(not is_active)
         self.threads -= 1
 
-    def is_sync_possible(self, layer):
+    def is_sync_possible(self, layer, active_layers=None, synced_layers=None, common_options=None):
         """
-        Returns whether the passed layer can be synchronised with all other synchronised layers
+        Returns whether the passed layer can be synchronised with all other synchronised layers.
+        The active and synchronised layers and their common options may be passed if known.
         """
-        if len(self.get_active_layers()) == 0:
+        if active_layers is None:
+            active_layers = self.get_active_layers()
+        if len(active_layers) == 0:
             return True
 
-        levels, itimes, vtimes, crs = self.get_multilayer_common_options(layer)
-        levels_before, itimes_before, vtimes_before, crs_before = self.get_multilayer_common_options()
+        levels, itimes, vtimes, crs = self.get_multilayer_common_options(layer, layers=synced_layers)
+        levels_before, itimes_before, vtimes_before, crs_before = \
+            common_options or self.get_multilayer_common_options(layers=synced_layers)
 
         return (len(levels) > 0 or (len(levels_before) == 0 and len(layer.levels) == 0)) and \
                (len(itimes) > 0 or (len(itimes_before) == 0 and len(layer.itimes) == 0)) and \
@@ -512,15 +629,67 @@ class Multilayers(QtWidgets.QDialog, ui.Ui_MultilayersDialog):
 
 
 class Layer(QtWidgets.QTreeWidgetItem):
+    """
+    Layer of a WMS in the multilayer list. Its dimensions, levels, times and
+    styles are parsed when the layer is selected or one of them is needed
+    first, as servers may offer thousands of layers.
+    """
+
     def __init__(self, header, parent, layerobj, name=None, is_empty=False):
         super().__init__(header)
         self.parent = parent
         self.header = header
         self.layerobj = layerobj
-        self.dimensions = {}
-        self.extents = {}
         self.setText(0, name if name else "")
 
+        self.is_synced = False
+        self.is_active_unsynced = False
+        self._is_favourite = False
+        self.is_parsed = False
+
+        if is_empty:
+            self.parse()
+        else:
+            self.is_favourite = str(self) in self.parent.settings["favourites"]
+            self.show_favourite()
+            if str(self) in self.parent.settings["saved_colors"]:
+                self.color = self.parent.settings["saved_colors"][str(self)]
+            else:
+                self.color = "#00aaff"
+
+    # items are equal only to themselves, so they may be kept in sets
+    __hash__ = object.__hash__
+
+    @property
+    def is_favourite(self):
+        return self._is_favourite
+
+    @is_favourite.setter
+    def is_favourite(self, value):
+        self._is_favourite = value
+        if self.header is not None:
+            if value:
+                self.parent.favourite_layers.add(self)
+            else:
+                self.parent.favourite_layers.discard(self)
+
+    def __getattr__(self, name):
+        # only called for attributes not set yet, i.e. the parsed ones of an unparsed layer
+        if name.startswith("__") or self.__dict__.get("is_parsed", True):
+            raise AttributeError(name)
+        self.parse()
+        return getattr(self, name)
+
+    def parse(self):
+        """
+        Parses the values of the layer object, if not done yet.
+        """
+        if self.is_parsed:
+            return
+        self.is_parsed = True
+        self.dimensions = {}
+        self.extents = {}
+        self.allowed_crs = []
         self.levels = []
         self.level = None
         self.itimes = []
@@ -533,22 +702,15 @@ class Layer(QtWidgets.QTreeWidgetItem):
         self.allowed_valid_times = []
         self.styles = []
         self.style = None
-        self.is_synced = False
-        self.is_active_unsynced = False
-        self.is_favourite = False
 
-        if not is_empty:
+        if self.layerobj is not None:
             self._parse_layerobj()
             self._parse_levels()
             self._parse_itimes()
             self._parse_vtimes()
             self._parse_styles()
-            self.is_favourite = str(self) in self.parent.settings["favourites"]
-            self.show_favourite()
-            if str(self) in self.parent.settings["saved_colors"]:
-                self.color = self.parent.settings["saved_colors"][str(self)]
-            else:
-                self.color = "#00aaff"
+            if self.style and self.header is not None:
+                self.parent.add_style_widget(self)
 
     def _parse_layerobj(self):
         """
@@ -586,8 +748,8 @@ class Layer(QtWidgets.QTreeWidgetItem):
         if len(init_time_names) > 0:
             self.itime_name = init_time_names[0]
             values = self.extents[self.itime_name]["values"]
-            self.allowed_init_times = sorted(self.parent.dock_widget.parse_time_extent(values))
-            self.itimes = [_time.isoformat() + "Z" for _time in self.allowed_init_times]
+            self.allowed_init_times = self.parent.dock_widget.parse_time_extent(values)
+            self.itimes = self.allowed_init_times.strings()
             if len(self.allowed_init_times) == 0:
                 msg = "cannot determine init time format"
                 logging.error(msg)
@@ -608,8 +770,8 @@ class Layer(QtWidgets.QTreeWidgetItem):
         if len(valid_time_names) > 0:
             self.vtime_name = valid_time_names[0]
             values = self.extents[self.vtime_name]["values"]
-            self.allowed_valid_times = sorted(self.parent.dock_widget.parse_time_extent(values))
-            self.vtimes = [_time.isoformat() + "Z" for _time in self.allowed_valid_times]
+            self.allowed_valid_times = self.parent.dock_widget.parse_time_extent(values)
+            self.vtimes = self.allowed_valid_times.strings()
             if len(self.allowed_valid_times) == 0:
                 msg = "cannot determine init time format"
                 logging.error(msg)
@@ -757,11 +919,7 @@ class Layer(QtWidgets.QTreeWidgetItem):
         """
         Shows a filled star icon if this layer is a favourite layer or an unfilled one if not
         """
-        if self.is_favourite:
-            icon = QtGui.QIcon(icons("64x64", "star_filled.png"))
-        else:
-            icon = QtGui.QIcon(icons("64x64", "star_unfilled.png"))
-        self.setIcon(0, icon)
+        self.setIcon(0, star_icon(self.is_favourite))
 
     def style_changed(self):
         """
@@ -50,7 +50,8 @@ from mslib.msui.mss_qt import ui_wms_dockwidget as ui
 from mslib.msui.mss_qt import ui_wms_password_dialog as ui_pw
 from mslib.msui import wms_capabilities
 from mslib.msui import constants
-from mslib.utils import parse_iso_datetime, parse_iso_duration, load_settings_qsettings, save_settings_qsettings, Worker
+from mslib.utils import parse_iso_datetime, parse_iso_duration, load_settings_qsettings, save_settings_qsettings, \
+    Worker, TimeExtent
 from mslib.ogcwms import openURL, removeXMLNamespace
 from mslib.msui.multilayers import Multilayers, Layer
 
@@ -810,7 +811,11 @@ class WMSControlWidget(QtWidgets.QWidget, ui.Ui_WMSDockWidget):
         return None
 
     def parse_time_extent(self, values):
-        times = []
+        """
+        Returns the TimeExtent of the times and intervals "start/end/period" in
+        <values>. Intervals are not expanded, so that long ones are cheap.
+        """
+        runs = []
         for time_item in [i.strip() for i in values]:
             try:
                 list_desc = time_item.split("/")
@@ -822,19 +827,20 @@ class WMSControlWidget(QtWidgets.QWidget, ui.Ui_WMSDockWidget):
                     else:
                         end_time = parse_iso_datetime(list_desc[1])
                     delta = parse_iso_duration(list_desc[2])
-                    while time_val <= end_time:
-                        times.append(time_val)
-                        time_val += delta
+                    if time_val + delta <= time_val:
+                        raise ValueError("period is not positive.")
+                    runs.append((time_val, end_time, delta))
 
                 elif len(list_desc) == 1:
-                    times.append(parse_iso_datetime(time_item))
+                    time_val = parse_iso_datetime(time_item)
+                    runs.append((time_val, time_val, None))
                 else:
                     raise ValueError("value has incorrect number of entries.")
 
             except Exception as ex:
                 logging.debug("Wildcard Exception %s - %s.", type(ex), ex)
                 logging.error("Can't understand time string '%s'. Please check the implementation.", time_item)
-        return times
+        return TimeExtent(runs)
 
     def disable_ui(self):
         self.disable_cbInitTime_elements()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.benchmark
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+
+import fs
+import netCDF4
+import pytest
+
+import mslib.mswms.benchmark as benchmark
+from mslib.mswms.demodata import DataFiles
+
+
+class TestBenchmark(object):
+    def test_parse_config(self):
+        assert benchmark.parse_config("0.5:30") == {"name": "0.5:30", "resolution": 0.5, "num_levels": 30}
+        assert benchmark.parse_config("1") == {"name": "1", "resolution": 1., "num_levels": None}
+
+    def test_valid_times(self):
+        assert benchmark.VALID_TIMES[0] == "2012-10-17T12:00:00Z"
+        assert benchmark.VALID_TIMES[2] == "2012-10-18T00:00:00Z"
+        assert benchmark.VALID_TIMES[-1] == "2012-10-19T00:00:00Z"
+
+    def test_summarize(self):
+        result = benchmark.summarize([5., 1., 2., 3.], 1)
+        assert result["cold"] == 5.
+        assert result["p50"] == pytest.approx(2.)
+        assert result["throughput"] == pytest.approx(0.5)
+        assert result["errors"] == 1
+
+    def test_compare(self):
+        reference = {"configs": {"1": {"peak_rss_bytes": 100, "workloads": {"getmap": {"p50": 1.}}}}}
+        result = {"configs": {"1": {"peak_rss_bytes": 100, "workloads": {"getmap": {"p50": 1.5}}}}}
+        assert benchmark.compare(result, reference) == 1
+        assert benchmark.compare(reference, reference) == 0
+
+    def test_create_data_resolution(self, tmpdir):
+        examples = DataFiles(data_fs=fs.open_fs(str(tmpdir)))
+        examples.create_data(resolution=2, num_levels=5)
+        filename = os.path.join(str(tmpdir), "20121017_12_ecmwf_forecast.T.EUR_LL015.036.ml.nc")
+        with netCDF4.Dataset(filename) as ncfile:
+            assert ncfile.variables["air_temperature"].shape == (7, 5, 20, 50)
@@ -27,11 +27,16 @@
 """
 
 import os
+import shutil
+import sys
+import time
 from datetime import datetime
 
 import mock
+import pytest
 
-from mslib.mswms.dataaccess import DefaultDataAccess, CachedDataAccess
+from mslib.mswms.dataaccess import DefaultDataAccess, CachedDataAccess, WatchModificationDataAccess
+from mslib.mswms.watcher import ALL, PollingWatcher, create_watcher, filesystem_type, restart_watchers
 from mslib._tests.constants import DATA_DIR
 
 
@@ -142,3 +147,130 @@ class Test_DefaultDataAccessNoInit(object):
     def test_get_init_times(self):
         all_init_times = self.dut.get_init_times()
         assert all_init_times == [None]
+
+
+class Test_WatchModificationDataAccess(object):
+    def setup(self):
+        self.args = ("air_temperature", "pl", datetime(2012, 10, 17, 12, 0), datetime(2012, 10, 17, 18, 0))
+        self.filename = "20121017_12_ecmwf_forecast.PRESSURE_LEVELS.EUR_LL015.036.pl.nc"
+
+    def _touch(self, path):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_stat_mode(self, tmp_path):
+        shutil.copy(os.path.join(DATA_DIR, self.filename), tmp_path)
+        dut = WatchModificationDataAccess(str(tmp_path), "EUR_LL015")
+        dut.setup()
+        assert dut.get_filename(*self.args) == self.filename
+        self._touch(os.path.join(tmp_path, self.filename))
+        dut._parse_file = mock.MagicMock(wraps=dut._parse_file)
+        assert dut.get_filename(*self.args) == self.filename
+        dut._parse_file.assert_called_once_with(self.filename)
+
+    def test_poll_mode(self, tmp_path):
+        shutil.copy(os.path.join(DATA_DIR, self.filename), tmp_path)
+        dut = WatchModificationDataAccess(str(tmp_path), "EUR_LL015", watch="poll", poll_interval=3600)
+        dut.setup()
+        try:
+            with mock.patch("os.path.getmtime") as getmtime:
+                assert dut.get_filename(*self.args) == self.filename
+                assert not dut.is_reload_required([os.path.join(tmp_path, self.filename)])
+                dut.setup()
+                getmtime.assert_not_called()
+
+            self._touch(os.path.join(tmp_path, self.filename))
+            dut._watcher.poll()
+            dut._parse_file = mock.MagicMock(wraps=dut._parse_file)
+            assert dut.is_reload_required([os.path.join(tmp_path, self.filename)])
+            dut._parse_file.assert_called_once_with(self.filename)
+            assert dut.get_filename(*self.args) == self.filename
+
+            os.remove(os.path.join(tmp_path, self.filename))
+            dut._watcher.poll()
+            with pytest.raises(ValueError):
+                dut.get_filename(*self.args)
+        finally:
+            dut._watcher.stop()
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+    @pytest.mark.parametrize("mode", ["poll", "auto"])
+    def test_watcher_after_fork(self, tmp_path, mode):
+        watcher = create_watcher(str(tmp_path), mode=mode, interval=0.1)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                # not running in the child until restarted, then considering all files as changed
+                ok = not watcher._thread.is_alive()
+                restart_watchers()
+                ok = (ok and watcher._thread is not None and watcher._thread.is_alive() and
+                      watcher.changed(["fnord.nc"]) and watcher.changes_since(0)[0] == {ALL})
+                if ok:
+                    with open(os.path.join(tmp_path, "child.nc"), "w") as fid:
+                        fid.write("fnord")
+                    for _ in range(50):
+                        if watcher.changed(["child.nc"]):
+                            break
+                        time.sleep(0.1)
+                    ok = watcher.changed(["child.nc"])
+                os._exit(0 if ok else 1)
+            _, status = os.waitpid(pid, 0)
+            assert status == 0
+            assert not watcher.changed(["fnord.nc"], watcher.sequence)
+        finally:
+            watcher.stop()
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+    def test_inotify_watcher(self, tmp_path):
+        watcher = create_watcher(str(tmp_path), mode="inotify")
+        try:
+            with open(os.path.join(tmp_path, "fnord.nc"), "w") as fid:
+                fid.write("fnord")
+            for _ in range(50):
+                if watcher.changed(["fnord.nc"]):
+                    break
+                time.sleep(0.1)
+            assert watcher.changed(["fnord.nc"])
+            assert not watcher.changed(["other.nc"])
+            changes, sequence = watcher.changes_since(0)
+            assert changes == {"fnord.nc"}
+            assert not watcher.changed(["fnord.nc"], sequence)
+        finally:
+            watcher.stop()
+
+    def test_filesystem_type(self, tmp_path):
+        mounts = tmp_path / "mounts"
+        mounts.write_text("/dev/sda1 / ext4 rw 0 0\n"
+                          "server:/export /data nfs4 rw 0 0\n"
+                          "//server/share /data/my\\040share cifs rw 0 0\n")
+        assert filesystem_type("/home", str(mounts)) == "ext4"
+        assert filesystem_type("/data", str(mounts)) == "nfs4"
+        assert filesystem_type("/data/ecmwf", str(mounts)) == "nfs4"
+        assert filesystem_type("/data/my share/ecmwf", str(mounts)) == "cifs"
+        assert filesystem_type("/datasets", str(mounts)) == "ext4"
+        assert filesystem_type("/", str(tmp_path / "missing")) is None
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+    def test_watcher_network_filesystem(self, tmp_path):
+        with mock.patch("mslib.mswms.watcher.filesystem_type", return_value="nfs"):
+            watcher = create_watcher(str(tmp_path), mode="auto")
+        try:
+            assert isinstance(watcher, PollingWatcher)
+        finally:
+            watcher.stop()
+
+    def test_watcher_consumers(self, tmp_path):
+        watcher = create_watcher(str(tmp_path), mode="poll", interval=3600)
+        try:
+            first = second = watcher.sequence
+            with open(os.path.join(tmp_path, "fnord.nc"), "w") as fid:
+                fid.write("fnord")
+            watcher.poll()
+            changes, first = watcher.changes_since(first)
+            assert changes == {"fnord.nc"}
+            assert not watcher.changed(["fnord.nc"], first)
+            # the changes are not consumed for others
+            assert watcher.changed(["fnord.nc"], second)
+            assert watcher.changes_since(second) == ({"fnord.nc"}, first)
+        finally:
+            watcher.stop()
@@ -28,6 +28,8 @@
 
 from past.builtins import basestring
 
+import os
+import fs
 import numpy as np
 from mslib._tests.constants import SERVER_CONFIG_FS, DATA_FS, ROOT_FS, SERVER_CONFIG_FILE
 import mslib.mswms.demodata as demodata
@@ -60,6 +62,22 @@ class TestDemodata(object):
         assert len(data.shape) == 4
         assert all(_x == _y for _x, _y in zip(data.shape, (2, 3, 4, 5)))
 
+    def test_generate_2d_data(self):
+        ntimes, nlats, nlons, ilev = 3, 4, 5, 2
+        xarr = np.linspace(0., 10. + (ilev / 3.), nlons)
+        yarr = np.linspace(0., 5. + (ilev / 3.), nlats)
+        tarr = np.linspace(0, 2., ntimes)
+        datax = xarr[np.newaxis, np.newaxis, :] + tarr[:, np.newaxis, np.newaxis]
+        datay = yarr[np.newaxis, :, np.newaxis] - tarr[:, np.newaxis, np.newaxis]
+        expected = 10 + 2 * (np.sin(datax) + np.cos(datay)) / 2
+        assert np.allclose(demodata._generate_3d_data(ntimes, nlats, nlons, 10, 2, ilev=ilev), expected)
+        assert np.allclose(demodata._generate_2d_data(1, ntimes, nlats, nlons, 10, 2, ilev=ilev), expected[1])
+
+    def test_create_data_processes(self, tmpdir):
+        examples = demodata.DataFiles(data_fs=fs.open_fs(str(tmpdir)))
+        examples.create_data(resolution=5, num_levels=3, processes=2)
+        assert len(os.listdir(str(tmpdir))) == 23
+
     def test_generate_surface(self):
         data, unit = demodata.generate_surface("atmosphere_boundary_layer_thickness", 2, 4, 5)
         assert isinstance(data, np.ndarray)
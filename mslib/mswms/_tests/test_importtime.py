@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_importtime
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module tracks the time needed to import the WMS server.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import subprocess
+import sys
+
+import mslib
+
+# seconds, generous to allow for slow CI machines; about 1.5 s are usual
+IMPORT_TIME_BUDGET = 4.
+# modules to be imported only when plotting or generating the gallery
+HEAVY_MODULES = ["matplotlib.pyplot", "mpl_toolkits.basemap", "metpy", "scipy.interpolate",
+                 "mslib.mswms.mpl_hsec_styles", "mslib.mswms.mpl_vsec_styles", "mslib.mswms.mpl_lsec_styles",
+                 "PIL", "chameleon", "isodate"]
+
+SETTINGS = """
+data = {}
+register_horizontal_layers = [("mslib.mswms.mpl_hsec_styles.HS_MSLPStyle_01", ["ecmwf_EUR_LL015"])]
+register_vertical_layers = [("mslib.mswms.mpl_vsec_styles.VS_CloudsStyle_01", ["ecmwf_EUR_LL015"])]
+register_linear_layers = [("mslib.mswms.mpl_lsec_styles.LS_DefaultStyle", "air_temperature", ["ecmwf_EUR_LL015"])]
+"""
+
+
+def import_times(module, path):
+    """
+    Returns the cumulative import times in seconds of all modules imported by
+    importing <module> as reported by "python -X importtime".
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([path, os.path.dirname(os.path.dirname(mslib.__file__))])
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=path, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+class Test_ImportTime(object):
+    def test_wms_import(self, tmpdir):
+        tmpdir.join("mss_wms_settings.py").write(SETTINGS)
+        times = import_times("mslib.mswms.wms", str(tmpdir))
+        assert "mslib.mswms.wms" in times
+        assert [_x for _x in HEAVY_MODULES if _x in times] == []
+        assert times["mslib.mswms.wms"] < IMPORT_TIME_BUDGET, times["mslib.mswms.wms"]
+
+    def test_wms_import_without_settings(self, tmpdir):
+        # the dummy configuration of the server is used
+        times = import_times("mslib.mswms.wms", str(tmpdir))
+        assert "mslib.mswms.wms" in times
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_metrics
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.metrics
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from mslib.mswms.metrics import MetricsRegistry, Histogram
+
+
+class Test_Metrics(object):
+    def setup(self):
+        self.metrics = MetricsRegistry()
+
+    def test_histogram(self):
+        hist = Histogram(buckets=(1, 2))
+        for value in (0.5, 1.5, 1.7, 3):
+            hist.observe(value)
+        assert hist.count == 4
+        assert hist.cumulative() == [(1, 1), (2, 3), (float("inf"), 4)]
+
+    def test_spans_are_summed_per_request(self):
+        with self.metrics.request_scope("getvsec", "ds.layer", "style"):
+            for _ in range(3):
+                with self.metrics.span("read"):
+                    pass
+        hists = self.metrics._histograms
+        assert hists[("getvsec", "ds.layer", "style", "read")].count == 1
+        assert hists[("getvsec", "ds.layer", "style", "total")].count == 1
+
+    def test_span_without_request(self):
+        with self.metrics.span("read"):
+            pass
+        assert self.metrics._histograms[("", "", "", "read")].count == 1
+
+    def test_render(self):
+        self.metrics.register_gauge("open_datasets", lambda: 3, "open datasets")
+        self.metrics.cache_access("basemap", True)
+        self.metrics.cache_access("basemap", False)
+        self.metrics.cache_access("basemap", True)
+        with self.metrics.request_scope("getmap", 'ds."layer"', None):
+            with self.metrics.span("contour"):
+                pass
+        text = self.metrics.render()
+        assert 'mswms_phase_seconds_count{request="getmap",layer="ds.\\"layer\\"",style="",phase="contour"} 1' in text
+        assert 'le="+Inf"' in text
+        assert 'mswms_cache_requests_total{cache="basemap",result="hit"} 2.0' in text
+        assert "open_datasets 3" in text
+        self.metrics.reset()
+        assert "mswms_phase_seconds_count" not in self.metrics.render()
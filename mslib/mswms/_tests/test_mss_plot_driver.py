@@ -34,12 +34,20 @@ import sys
 from PIL import Image
 from xml.etree import ElementTree
 import io
+import shutil
+import time
+import mock
+import netCDF4
+import numpy as np
+from mslib.mswms.dataaccess import WatchModificationDataAccess
 from mslib.mswms.mss_plot_driver import VerticalSectionDriver, HorizontalSectionDriver, LinearSectionDriver
 import mss_wms_settings
 import mslib.mswms.mpl_vsec_styles as mpl_vsec_styles
 import mslib.mswms.mpl_hsec_styles as mpl_hsec_styles
 import mslib.mswms.mpl_lsec_styles as mpl_lsec_styles
 import mslib.mswms.gallery_builder
+import mslib.mswms.mpl_hsec
+from mslib._tests.constants import DATA_DIR
 
 
 def is_image_transparent(img):
@@ -297,11 +305,126 @@ class Test_HSec(object):
         img = self.plot(mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec), crs=crs, bbox=bbox_meter)
         assert img is not None
 
+    def test_figure_pool_reuse(self):
+        plot_object = mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec)
+        img1 = self.plot(plot_object, noframe=True, transparent=True)
+        self.plot(mpl_hsec_styles.HS_TemperatureStyle_PL_01(driver=self.hsec), level=300)
+        img2 = self.plot(plot_object, noframe=True, transparent=True)
+        assert img1 == img2
+
+    def test_grid_cache(self):
+        mslib.mswms.mpl_hsec.GRID_CACHE.clear()
+        plot_object = mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec)
+        bbox = [-200, 20, -100, 70]
+        img1 = self.plot(plot_object, bbox=bbox)
+        assert len(mslib.mswms.mpl_hsec.GRID_CACHE) == 1
+        img2 = self.plot(plot_object, bbox=bbox)
+        assert len(mslib.mswms.mpl_hsec.GRID_CACHE) == 1
+        assert img1 == img2
+        self.plot(plot_object, bbox=bbox, noframe=True)
+        assert len(mslib.mswms.mpl_hsec.GRID_CACHE) == 2
+
+    def test_decimation(self):
+        plot_object = mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec)
+        self.hsec.set_plot_parameters(plot_object=plot_object, bbox=[-180, -90, 180, 90], crs="EPSG:4326",
+                                      init_time=self.init_time, valid_time=self.valid_time, style="default",
+                                      figsize=(20, 15), noframe=True)
+        assert self.hsec.plot() is not None
+        assert len(plot_object.lats) < len(self.hsec.lat_data) / 2
+        assert plot_object.resolution == pytest.approx(plot_object.lats[1] - plot_object.lats[0])
+        plot_object._decimate = False
+        assert self.hsec.plot() is not None
+        assert len(plot_object.lats) == len(self.hsec.lat_data)
+
+    @pytest.mark.parametrize("use_cache", [False, True])
+    def test_plot_frames(self, use_cache):
+        plot_object = mpl_hsec_styles.HS_TemperatureStyle_PL_01(driver=self.hsec)
+        valid_times = [datetime(2012, 10, 17, 12), datetime(2012, 10, 17, 18), datetime(2012, 10, 18, 0)]
+        images = []
+        for valid_time in valid_times:
+            self.valid_time = valid_time
+            images.append(self.plot(plot_object, level=300, noframe=True))
+        dataset = self.hsec.dataset
+        with mock.patch.object(mss_wms_settings, "basemap_use_cache", use_cache, create=True), \
+                mock.patch.dict(mslib.mswms.mpl_hsec.BASEMAP_CACHE, clear=True):
+            assert self.hsec.plot_frames(valid_times) == images
+            assert len(mslib.mswms.mpl_hsec.BASEMAP_CACHE) == (1 if use_cache else 0)
+        assert self.hsec.dataset is dataset
+        assert self.hsec.fc_time == valid_times[-1]
+
+    def test_plot_tiles(self):
+        plot_object = mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec)
+        self.hsec.set_plot_parameters(plot_object=plot_object, bbox=self.bbox, crs="EPSG:4326",
+                                      init_time=self.init_time, valid_time=self.valid_time, style="default",
+                                      figsize=(800, 600), noframe=True)
+        img = self.hsec.plot()
+        with mock.patch.object(mss_wms_settings, "tile_render_min_pixels", 1000, create=True), \
+                mock.patch.object(mss_wms_settings, "tile_render_workers", 3, create=True), \
+                mock.patch.object(self.hsec, "plot_tiles", wraps=self.hsec.plot_tiles) as plot_tiles:
+            tiled = self.hsec.plot()
+        assert plot_tiles.call_count == 1
+        with Image.open(io.BytesIO(img)) as image, Image.open(io.BytesIO(tiled)) as tiled_image:
+            assert image.size == tiled_image.size == (800, 600)
+            image = np.asarray(image.convert("RGB"), dtype=int)
+            tiled_image = np.asarray(tiled_image.convert("RGB"), dtype=int)
+        # dashed lines crossing a seam may start their pattern anew
+        assert (abs(image - tiled_image).max(axis=2) > 32).mean() < 0.02
+        # processes not done in time are terminated and the plot is drawn at once
+        with mock.patch.object(mss_wms_settings, "tile_render_min_pixels", 1000, create=True), \
+                mock.patch.object(mss_wms_settings, "tile_render_timeout", 0, create=True):
+            assert self.hsec.plot() == img
+
     @pytest.mark.parametrize("crs", ["EPSG:12345678", "FNORD", "MSS:lagranto"])
     def test_invalid_crs_codes(self, crs):
         with pytest.raises(ValueError):
             self.plot(mpl_hsec_styles.HS_MSLPStyle_01(driver=self.hsec), crs=crs)
 
+    @pytest.mark.parametrize("watch", [None, "poll", pytest.param("inotify", marks=pytest.mark.skipif(
+        not sys.platform.startswith("linux"), reason="inotify is only available on Linux"))])
+    def test_reload_modified_data(self, tmp_path, watch):
+        filename = "20121017_12_ecmwf_forecast.PRESSURE_LEVELS.EUR_LL015.036.pl.nc"
+        path = os.path.join(tmp_path, filename)
+        shutil.copy(os.path.join(DATA_DIR, filename), path)
+        data = WatchModificationDataAccess(str(tmp_path), "EUR_LL015", watch=watch, poll_interval=3600)
+        data.setup()
+        try:
+            # a second driver sharing the data access, as the drivers of the server do
+            other = HorizontalSectionDriver(data)
+            other_plot_object = mpl_hsec_styles.HS_TemperatureStyle_PL_01(driver=other)
+
+            def plot_other():
+                other.set_plot_parameters(plot_object=other_plot_object, bbox=self.bbox, level=300, crs="EPSG:4326",
+                                          init_time=self.init_time, valid_time=self.valid_time, show=False)
+                return other.plot()
+
+            plot_other()
+            self.hsec = HorizontalSectionDriver(data)
+            plot_object = mpl_hsec_styles.HS_TemperatureStyle_PL_01(driver=self.hsec)
+            self.plot(plot_object, level=300)
+            temperature = self.hsec.data_vars["air_temperature"][:]
+
+            replacement = os.path.join(tmp_path, "replacement")
+            shutil.copy(path, replacement)
+            with netCDF4.Dataset(replacement, "a") as dataset:
+                dataset.variables["air_temperature"][:] *= 2
+            stat = os.stat(path)
+            os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            os.replace(replacement, path)
+            if watch == "poll":
+                data._watcher.poll()
+            elif watch == "inotify":
+                for _ in range(50):
+                    if data._watcher.changed([filename], data._sequence):
+                        break
+                    time.sleep(0.1)
+            self.plot(plot_object, level=300)
+            assert np.allclose(self.hsec.data_vars["air_temperature"][:], 2 * temperature)
+            plot_other()
+            assert np.allclose(other.data_vars["air_temperature"][:], 2 * temperature)
+        finally:
+            if data._watcher is not None:
+                data._watcher.stop()
+
     def test_repeated_locations(self):
         p1 = [45.00, 8.]
         p2 = [50.00, 12.]
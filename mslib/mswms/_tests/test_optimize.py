@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_optimize
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.optimize
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import shutil
+
+import netCDF4
+import numpy as np
+import pytest
+
+from mslib.mswms.optimize import compare_entries, file_entry, optimize_files
+from mslib._tests.constants import DATA_DIR
+
+
+FILENAME = "20121017_12_ecmwf_forecast.PRESSURE_LEVELS.EUR_LL015.036.pl.nc"
+
+
+@pytest.mark.parametrize("layout, kwargs", [
+    ("hsec", {}), ("vsec", {"tile": 16}), ("hsec", {"zlib": True, "float32": True})])
+def test_optimize_files(tmp_path, layout, kwargs):
+    shutil.copy(os.path.join(DATA_DIR, FILENAME), tmp_path)
+    output = os.path.join(tmp_path, "optimized")
+    results = optimize_files(str(tmp_path), domain_id="EUR_LL015", output=output, layout=layout, **kwargs)
+    assert [_x[0] for _x in results] == [FILENAME]
+    assert os.listdir(output) == [FILENAME]
+    assert compare_entries(file_entry(os.path.join(output, FILENAME)),
+                           file_entry(os.path.join(tmp_path, FILENAME))) == []
+
+    with netCDF4.Dataset(os.path.join(tmp_path, FILENAME)) as src, \
+            netCDF4.Dataset(os.path.join(output, FILENAME)) as dst:
+        assert dst.data_model == "NETCDF4_CLASSIC"
+        var = dst.variables["air_temperature"]
+        if layout == "hsec":
+            assert var.chunking() == [1, 1] + list(var.shape[-2:])
+        else:
+            assert var.chunking() == [1, var.shape[1], 16, 16]
+        assert var.filters()["zlib"] == kwargs.get("zlib", False)
+        assert var.dtype == src.variables["air_temperature"].dtype
+        assert np.allclose(var[:], src.variables["air_temperature"][:])
+
+
+def test_optimize_files_in_place(tmp_path):
+    shutil.copy(os.path.join(DATA_DIR, FILENAME), tmp_path)
+    reference = file_entry(os.path.join(tmp_path, FILENAME))
+    results = optimize_files(str(tmp_path), zlib=True)
+    assert len(results) == 1
+    assert os.listdir(tmp_path) == [FILENAME]
+    assert compare_entries(file_entry(os.path.join(tmp_path, FILENAME)), reference) == []
+
+
+def test_compare_entries():
+    sfc = FILENAME.replace("PRESSURE_LEVELS", "SFC").replace(".pl.", ".sfc.")
+    differences = compare_entries(file_entry(os.path.join(DATA_DIR, FILENAME)), file_entry(os.path.join(DATA_DIR, sfc)))
+    assert "vert_type" in differences
+    assert "standard_names" in differences
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_overviews
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.overviews
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import shutil
+from datetime import datetime
+
+import netCDF4
+import numpy as np
+import pytest
+
+from mslib.mswms import mpl_hsec_styles
+from mslib.mswms.dataaccess import DefaultDataAccess
+from mslib.mswms.mss_plot_driver import HorizontalSectionDriver
+from mslib.mswms.overviews import create_overviews, overview_filename, overview_source, parse_overview_filename
+from mslib._tests.constants import DATA_DIR
+
+
+def test_overview_filename():
+    name = "20121017_12_ecmwf_forecast.PRESSURE_LEVELS.EUR_LL015.036.pl.nc"
+    overview = overview_filename(name, 4)
+    assert overview == "20121017_12_ecmwf_forecast.PRESSURE_LEVELS.EUR_LL015.036.pl.ovr4.nc"
+    assert parse_overview_filename(overview) == (name, 4)
+    assert parse_overview_filename(name) is None
+    assert overview_source(overview) == name
+    assert overview_source(name) == name
+
+
+class Test_Overviews(object):
+    def setup(self):
+        self.init_time = datetime(2012, 10, 17, 12)
+        self.valid_time = datetime(2012, 10, 17, 12)
+
+    def _copy_data(self, root_path, suffixes):
+        for filename in os.listdir(DATA_DIR):
+            if "EUR_LL015" in filename and filename.endswith(suffixes):
+                shutil.copy(os.path.join(DATA_DIR, filename), root_path)
+        return DefaultDataAccess(str(root_path), "EUR_LL015")
+
+    def test_create_overviews(self, tmp_path):
+        data = self._copy_data(tmp_path, (".pl.nc",))
+        written = create_overviews(data, factors=[2, 4])
+        assert len(written) == 2 * len(data.get_all_datafiles())
+        assert create_overviews(data, factors=[2, 4]) == []
+
+        filename = data.get_all_datafiles()[0]
+        with netCDF4.Dataset(os.path.join(tmp_path, filename)) as src, \
+                netCDF4.Dataset(os.path.join(tmp_path, overview_filename(filename, 2))) as dst:
+            assert dst.mss_overview_factor == 2
+            assert len(dst.dimensions["lat"]) == -(-len(src.dimensions["lat"]) // 2)
+            assert len(dst.dimensions["lon"]) == -(-len(src.dimensions["lon"]) // 2)
+            assert dst.variables["lat"][0] == pytest.approx(src.variables["lat"][:2].mean())
+            assert np.allclose(dst.variables["air_temperature"][0, 0, 0, 0],
+                               src.variables["air_temperature"][0, 0, :2, :2].mean())
+
+        data.setup()
+        assert all(".ovr" not in _x for _x in data.get_all_datafiles())
+        filenames = [os.path.join(tmp_path, filename)]
+        assert data.get_overview_filenames(filenames, 0.5) == filenames
+        assert data.get_overview_filenames(filenames, 2.5) == [
+            os.path.join(tmp_path, overview_filename(filename, 2))]
+        assert data.get_overview_filenames(filenames, 100) == [
+            os.path.join(tmp_path, overview_filename(filename, 4))]
+
+    def test_hsec_uses_overviews(self, tmp_path):
+        data = self._copy_data(tmp_path, (".pl.nc", ".sfc.nc"))
+        create_overviews(data, factors=[2])
+        data.setup()
+        hsec = HorizontalSectionDriver(data)
+        plot_object = mpl_hsec_styles.HS_MSLPStyle_01(driver=hsec)
+
+        hsec.set_plot_parameters(plot_object=plot_object, bbox=[-180, -90, 180, 90], crs="EPSG:4326",
+                                 init_time=self.init_time, valid_time=self.valid_time, style="default",
+                                 figsize=(40, 30), noframe=True)
+        assert all(".ovr2." in _x for _x in hsec.filenames)
+        assert hsec.plot() is not None
+
+        hsec.set_plot_parameters(plot_object=plot_object, bbox=[-22.5, 27.5, 55, 62.5], crs="EPSG:4326",
+                                 init_time=self.init_time, valid_time=self.valid_time, style="default")
+        assert all(".ovr" not in _x for _x in hsec.filenames)
+        assert hsec.plot() is not None
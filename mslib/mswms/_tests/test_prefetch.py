@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_prefetch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.prefetch
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import threading
+import time
+
+from multidict import CIMultiDict
+
+from mslib.mswms.prefetch import Prefetcher
+from mslib.mswms.singleflight import SingleFlight
+
+
+class Test_Prefetcher(object):
+    def setup(self):
+        self.rendered = []
+        self.render_event = None
+
+    def teardown(self):
+        self.prefetcher.stop()
+
+    def render(self, query, mode):
+        if self.render_event is not None:
+            self.render_event.wait()
+        self.rendered.append((int(query["TIME"]), int(query["ELEVATION"])))
+        return b"image" * 10, "image/png"
+
+    @staticmethod
+    def neighbours(query, mode):
+        step, level = int(query["TIME"]), int(query["ELEVATION"])
+        return {"time+1": CIMultiDict(TIME=str(step + 1), ELEVATION=str(level)),
+                "time-1": CIMultiDict(TIME=str(step - 1), ELEVATION=str(level)),
+                "level+1": CIMultiDict(TIME=str(step), ELEVATION=str(level + 1)),
+                "level-1": CIMultiDict(TIME=str(step), ELEVATION=str(level - 1))}
+
+    def make_prefetcher(self, **kwargs):
+        arguments = dict(enabled=True, interval=0, idle_delay=0, count=2)
+        arguments.update(kwargs)
+        self.prefetcher = Prefetcher(self.render, self.neighbours, **arguments)
+        return self.prefetcher
+
+    def request(self, step, level, client="client"):
+        """
+        Emulates a request as processed by the WMS application.
+        """
+        query = CIMultiDict(TIME=str(step), ELEVATION=str(level))
+        with self.prefetcher.request():
+            result = self.prefetcher.get(SingleFlight.key(query, "getmap"))
+            if result is None:
+                result = (b"image" * 10, "image/png")
+        self.prefetcher.observe(client, query, "getmap")
+        return result
+
+    def test_disabled(self):
+        prefetcher = self.make_prefetcher(enabled=False)
+        self.request(10, 5)
+        assert prefetcher.join(1)
+        assert self.rendered == []
+        assert prefetcher._thread is None
+
+    def test_prefetch(self):
+        prefetcher = self.make_prefetcher()
+        self.request(10, 5)
+        assert prefetcher.join(5)
+        # without history, the first directions are fetched
+        assert self.rendered == [(11, 5), (9, 5)]
+        key = SingleFlight.key(CIMultiDict(TIME="11", ELEVATION="5"), "getmap")
+        assert prefetcher.get(key) == (b"image" * 10, "image/png")
+
+    def test_version(self):
+        versions = {}
+        prefetcher = self.make_prefetcher(version=lambda query, mode: versions.get(query["TIME"], 1))
+        self.request(10, 5)
+        assert prefetcher.join(5)
+        query = CIMultiDict(TIME="11", ELEVATION="5")
+        key = SingleFlight.key(query, "getmap")
+        assert prefetcher.get(key, query, "getmap") == (b"image" * 10, "image/png")
+        # responses rendered from modified data are discarded
+        versions["11"] = 2
+        assert prefetcher.get(key, query, "getmap") is None
+        assert key not in prefetcher._cache
+        # unversioned responses are not cached
+        versions["12"] = None
+        self.request(11, 5)
+        assert prefetcher.join(5)
+        assert (12, 5) in self.rendered
+        assert SingleFlight.key(CIMultiDict(TIME="12", ELEVATION="5"), "getmap") not in prefetcher._cache
+
+    def test_learning(self):
+        prefetcher = self.make_prefetcher()
+        for level in range(5, 10):
+            self.request(10, level)
+            assert prefetcher.join(5)
+        assert prefetcher.ranking() == ["level+1"]
+        del self.rendered[:]
+        self.request(20, 1)
+        assert prefetcher.join(5)
+        assert self.rendered == [(20, 2)]
+
+    def test_clients(self):
+        prefetcher = self.make_prefetcher(count=1)
+        # alternating clients do not disturb the observed sequences
+        for step in range(10, 15):
+            self.request(step, 1, client="a")
+            self.request(step, 9, client="b")
+        assert prefetcher.join(5)
+        assert prefetcher.ranking() == ["time+1"]
+
+    def test_memory_budget(self):
+        prefetcher = self.make_prefetcher(max_bytes=len(b"image" * 10) * 3)
+        for step in range(10, 40, 5):
+            self.request(step, 5)
+            assert prefetcher.join(5)
+        assert len(self.rendered) == 12
+        assert len(prefetcher._cache) == 3
+        assert prefetcher._cache_bytes <= prefetcher.max_bytes
+
+    def test_idle(self):
+        prefetcher = self.make_prefetcher(idle_delay=0.5)
+        self.request(10, 5)
+        with prefetcher.request():
+            time.sleep(0.7)
+            # no renders while a request is processed
+            assert self.rendered == []
+        assert prefetcher.join(5)
+        assert len(self.rendered) == 2
+
+    def test_request_during_render(self):
+        prefetcher = self.make_prefetcher(count=1)
+        self.render_event = threading.Event()
+        self.request(10, 5)
+        time.sleep(0.2)
+        assert prefetcher._rendering
+        # requests do not wait for a running prefetch render
+        start = time.monotonic()
+        self.request(20, 5)
+        assert time.monotonic() - start < 1
+        self.render_event.set()
+        assert prefetcher.join(5)
+
+    def test_cancel(self):
+        prefetcher = self.make_prefetcher(count=4)
+        self.render_event = threading.Event()
+        self.request(10, 5)
+        time.sleep(0.2)
+        prefetcher.cancel()
+        self.render_event.set()
+        assert prefetcher.join(5)
+        # only the render already started is finished
+        assert self.rendered == [(11, 5)]
+
+    def test_new_request_replaces_pending(self):
+        prefetcher = self.make_prefetcher(count=4)
+        self.render_event = threading.Event()
+        self.request(10, 5)
+        time.sleep(0.2)
+        thread = threading.Thread(target=self.request, args=(30, 5))
+        thread.start()
+        time.sleep(0.2)
+        self.render_event.set()
+        thread.join()
+        assert prefetcher.join(5)
+        assert self.rendered[0] == (11, 5)
+        assert (9, 5) not in self.rendered
+        assert (31, 5) in self.rendered
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_profiling
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.profiling
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import pstats
+
+import mock
+
+import mslib.mswms.mswms as mswms
+import mslib.mswms.wms
+from mslib.mswms.profiling import RequestProfiler
+from mslib._tests.utils import callback_ok_xml
+
+
+class Test_RequestProfiler(object):
+    def test_disabled(self):
+        profiler = RequestProfiler(sample_rate=1, admin_users=["admin"])
+        assert not profiler.is_selected({"PROFILE": "true"}, "admin")
+
+    def test_admin_switch(self, tmpdir):
+        profiler = RequestProfiler(directory=str(tmpdir), admin_users=["admin"])
+        assert profiler.is_selected({"PROFILE": "true"}, "admin")
+        assert not profiler.is_selected({"PROFILE": "true"}, "someone")
+        assert not profiler.is_selected({"PROFILE": "true"})
+        assert not profiler.is_selected({}, "admin")
+
+    def test_sampling(self, tmpdir):
+        profiler = RequestProfiler(directory=str(tmpdir), sample_rate=3)
+        selected = [profiler.is_selected({"LAYERS": _x}) for _x in "abcabc"]
+        assert selected == [False, False, True, False, False, True]
+        assert not profiler.is_selected({"LAYERS": "a"})
+
+    def test_profile(self, tmpdir):
+        profiler = RequestProfiler(directory=str(tmpdir), sample_rate=1)
+        with profiler.profile({"LAYERS": "ds.layer"}, "getmap") as name:
+            sum(range(1000))
+        assert name.endswith(".pstats")
+        assert "_getmap_ds.layer_" in name
+        stats = pstats.Stats(os.path.join(str(tmpdir), name))
+        assert stats.total_calls > 0
+        assert os.path.exists(os.path.join(str(tmpdir), name[:-7] + ".json"))
+
+    def test_wms_request(self, tmpdir):
+        query = ('layers=ecmwf_EUR_LL015.LS_HV01&styles=&srs=LINE%3A1&format=text%2Fxml&'
+                 'request=GetMap&dim_init_time=2012-10-17T12%3A00%3A00Z&'
+                 'version=1.1.1&bbox=201&time=2012-10-17T12%3A00%3A00Z&'
+                 'exceptions=application%2Fvnd.ogc.se_xml&path=52.78%2C-8.93%2C25000%2C48.08%2C11.28%2C25000')
+        with mock.patch.object(mslib.mswms.wms.profiler, "directory", str(tmpdir)), \
+                mock.patch.object(mslib.mswms.wms.profiler, "sample_rate", 1):
+            result = mswms.application.test_client().get(f"/?{query}")
+        callback_ok_xml(result.status, result.headers)
+        assert os.path.exists(os.path.join(str(tmpdir), result.headers["X-MSS-Profile"]))
+        # requests answered without rendering are not profiled
+        with mock.patch.object(mslib.mswms.wms.profiler, "directory", str(tmpdir)), \
+                mock.patch.object(mslib.mswms.wms.profiler, "sample_rate", 1), \
+                mock.patch.object(mslib.mswms.wms.prefetcher, "get", return_value=(result.data, "text/xml")):
+            result = mswms.application.test_client().get(f"/?{query}")
+        callback_ok_xml(result.status, result.headers)
+        assert "X-MSS-Profile" not in result.headers
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_sharedcache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.sharedcache
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import sys
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import mss_wms_settings
+import mslib.mswms.mss_plot_driver
+import mslib.mswms.mpl_hsec_styles as mpl_hsec_styles
+from mslib.mswms.mss_plot_driver import HorizontalSectionDriver
+from mslib.mswms.sharedcache import SharedFieldCache
+
+
+@pytest.mark.skipif(not hasattr(os, "fork") or sys.platform == "darwin",
+                    reason="requires POSIX shared memory and fork")
+class Test_SharedFieldCache(object):
+    def setup(self):
+        self.loads = 0
+
+    def teardown(self):
+        self.cache.clear()
+
+    def make_cache(self, tmpdir, max_bytes=10 ** 6):
+        self.cache = SharedFieldCache(max_bytes, str(tmpdir))
+        return self.cache
+
+    def load(self, value):
+        def _load():
+            self.loads += 1
+            return value
+        return _load
+
+    def test_hit(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        value = np.arange(12.).reshape(3, 4)
+        first = cache.get(("a", 1), self.load(value))
+        second = cache.get(("a", 1), self.load(value))
+        assert self.loads == 1
+        assert (first == value).all() and (second == value).all()
+        assert not second.flags.writeable
+        with pytest.raises(ValueError):
+            second[0, 0] = 1
+
+    def test_masked(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        value = np.ma.masked_less(np.arange(6, dtype=np.float32).reshape(2, 3), 2)
+        cache.get("masked", self.load(value))
+        result = SharedFieldCache(10 ** 6, str(tmpdir)).get("masked", self.load(None))
+        assert self.loads == 1
+        assert isinstance(result, np.ma.MaskedArray)
+        assert result.dtype == np.float32
+        assert (result.mask == value.mask).all()
+        assert (result.compressed() == value.compressed()).all()
+
+    def test_eviction(self, tmpdir):
+        value = np.zeros(100)
+        cache = self.make_cache(tmpdir, max_bytes=2 * value.nbytes)
+        for key in ["a", "b", "c"]:
+            cache.get(key, self.load(value))
+        assert self.loads == 3
+        cache.get("c", self.load(value))
+        cache.get("b", self.load(value))
+        assert self.loads == 3
+        cache.get("a", self.load(value))
+        assert self.loads == 4
+
+    def test_lookup(self, tmpdir):
+        value = np.zeros(100)
+        cache = self.make_cache(tmpdir, max_bytes=2 * value.nbytes)
+        index = os.path.join(str(tmpdir), "index.json")
+        cache.get("a", self.load(value))
+        cache.get("b", self.load(value))
+        stat = os.stat(index)
+        # hits do not rewrite the index, but still count for the eviction
+        cache.get("a", self.load(value))
+        assert os.stat(index).st_mtime_ns == stat.st_mtime_ns
+        assert os.stat(index).st_ino == stat.st_ino
+        cache.get("c", self.load(value))
+        cache.get("a", self.load(value))
+        assert self.loads == 3
+        cache.get("b", self.load(value))
+        assert self.loads == 4
+
+    def test_too_large(self, tmpdir):
+        value = np.zeros(100)
+        cache = self.make_cache(tmpdir, max_bytes=value.nbytes - 1)
+        assert cache.get("a", self.load(value)) is value
+        assert cache.get("a", self.load(value)) is value
+        assert self.loads == 2
+
+    def test_disabled(self, tmpdir):
+        cache = self.make_cache(tmpdir, max_bytes=0)
+        value = np.zeros(3)
+        assert cache.get("a", self.load(value)) is value
+        assert not os.path.exists(os.path.join(str(tmpdir), "index.json"))
+
+    def test_processes(self, tmpdir):
+        cache = self.make_cache(tmpdir)
+        value = np.arange(10.)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                SharedFieldCache(10 ** 6, str(tmpdir)).get("field", lambda: value)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        result = cache.get("field", self.load(None))
+        assert self.loads == 0
+        assert (result == value).all()
+
+    def test_plot(self, tmpdir):
+        cache = self.make_cache(tmpdir, max_bytes=10 ** 8)
+        data = mss_wms_settings.data["ecmwf_EUR_LL015"]
+        data.setup()
+        with mock.patch.object(mslib.mswms.mss_plot_driver, "FIELD_CACHE", cache):
+            images = []
+            for _ in range(2):
+                driver = HorizontalSectionDriver(data)
+                driver.set_plot_parameters(
+                    plot_object=mpl_hsec_styles.HS_TemperatureStyle_PL_01(driver=driver),
+                    bbox=[-22.5, 27.5, 55, 62.5], level=300, crs="EPSG:4326",
+                    init_time=datetime(2012, 10, 17, 12), valid_time=datetime(2012, 10, 17, 12),
+                    style="default", noframe=True, show=False)
+                images.append(driver.plot())
+                assert driver.files_key is not None
+        assert images[0] == images[1]
+        with open(os.path.join(str(tmpdir), "index.json")) as fid:
+            assert fid.read() != "{}"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms._tests.test_singleflight
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module provides pytest functions to tests mswms.singleflight
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+from multidict import CIMultiDict
+
+from mslib.mswms.singleflight import SingleFlight
+
+
+class Test_SingleFlight(object):
+    def setup(self):
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def render(self, result=(b"image", "image/png")):
+        with self.calls_lock:
+            self.calls += 1
+        time.sleep(0.3)
+        return result
+
+    def run_concurrently(self, coalescers, key, count=4, func=None):
+        results = [None] * count
+        errors = []
+
+        def target(index):
+            try:
+                results[index] = coalescers[index % len(coalescers)].do(key, func or self.render)
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=target, args=(_x,)) for _x in range(count)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_key(self):
+        key = SingleFlight.key(CIMultiDict([("LAYERS", "a"), ("time", "t")]), "getmap")
+        assert key == SingleFlight.key(CIMultiDict([("TIME", "t"), ("layers", "a"), ("PROFILE", "true")]), "getmap")
+        assert key != SingleFlight.key(CIMultiDict([("LAYERS", "a"), ("time", "t2")]), "getmap")
+        assert key != SingleFlight.key(CIMultiDict([("LAYERS", "a"), ("time", "t")]), "getvsec")
+
+    def test_threads(self):
+        results, errors = self.run_concurrently([SingleFlight()], "key")
+        assert errors == []
+        assert results == [(b"image", "image/png")] * 4
+        assert self.calls == 1
+        self.run_concurrently([SingleFlight()], "key", count=1)
+        assert self.calls == 2
+
+    def test_disabled(self):
+        self.run_concurrently([SingleFlight(enabled=False)], "key")
+        assert self.calls == 4
+
+    def test_errors(self):
+        def fail():
+            self.render()
+            raise ValueError("fnord")
+        results, errors = self.run_concurrently([SingleFlight()], "key", func=fail)
+        assert len(errors) == 4
+        assert self.calls == 1
+
+    @pytest.mark.skipif(sys.platform.startswith("win"), reason="requires fcntl")
+    @pytest.mark.parametrize("result", [(b"image", "image/png"), ("<xml/>", "text/xml")])
+    def test_lock_directory(self, tmpdir, result):
+        coalescers = [SingleFlight(lock_directory=str(tmpdir)) for _ in range(2)]
+        results, errors = self.run_concurrently(coalescers, "key", count=2, func=lambda: self.render(result))
+        assert errors == []
+        assert results == [result] * 2
+        assert self.calls == 1
+        assert tmpdir.listdir("*.lock") == []
+
+    @pytest.mark.skipif(sys.platform.startswith("win"), reason="requires fcntl")
+    def test_lock_directory_cleanup(self, tmpdir):
+        coalescer = SingleFlight(lock_directory=str(tmpdir), max_age=60)
+        for key in ["a", "b"]:
+            coalescer.do(key, lambda: (b"image", "image/png"))
+        tmpdir.join("c.lock").write("")
+        assert sorted(_x.basename for _x in tmpdir.listdir()) == ["a.result", "b.result", "c.lock"]
+        for path in tmpdir.listdir():
+            os.utime(str(path), (time.time() - 3600,) * 2)
+        # cleaned up at most once in max_age
+        coalescer._cleanup()
+        assert len(tmpdir.listdir()) == 3
+        coalescer._last_cleanup -= 60
+        coalescer._cleanup()
+        assert tmpdir.listdir() == []
@@ -1,5 +1,8 @@
+import numpy as np
+import pytest
+
 from mslib.utils import UR
-from mslib.mswms.utils import Targets
+from mslib.mswms.utils import Targets, FigurePool, block_average
 
 
 def test_targets():
@@ -12,3 +15,51 @@ def test_targets():
         Targets.get_range(standard_name)
         Targets.UNITS[standard_name]
         Targets.TITLES[standard_name]
+
+
+def test_block_average():
+    data = np.arange(20.).reshape(4, 5)
+    data[0, 0] = np.nan
+    result = block_average(data, (2, 2))
+    assert result.shape == (2, 3)
+    assert result[0, 0] == pytest.approx((1 + 5 + 6) / 3)
+    assert result[0, 2] == pytest.approx((4 + 9) / 2)
+    assert result[1, 1] == pytest.approx((12 + 13 + 17 + 18) / 4)
+    assert block_average(np.ma.masked_all((2, 2)), (2, 2)).mask.all()
+    assert np.allclose(block_average(np.arange(5.), (2,)), [0.5, 2.5, 4])
+
+
+def test_figure_pool():
+    pool = FigurePool(size=1)
+    fig = pool.acquire((4, 3))
+    fig.add_axes([0, 0, 1, 1])
+    fig.patch.set_alpha(0.)
+    pool.release(fig)
+    assert pool.acquire((4, 3)) is fig
+    assert len(fig.axes) == 0
+    assert fig.patch.get_alpha() is None
+    assert pool.acquire((4, 3)) is not fig
+    assert pool.acquire((4, 2)) is not fig
+
+    pool = FigurePool(size=0)
+    fig = pool.acquire((4, 3))
+    pool.release(fig)
+    assert pool.acquire((4, 3)) is not fig
+
+
+def test_figure_pool_bound():
+    pool = FigurePool(size=2, max_figures=3)
+    figures = [pool.acquire((4, height)) for height in range(1, 5)]
+    # a missing size does not create an entry
+    assert pool.acquire((5, 5)) is not None
+    assert len(pool._figures) == 0
+    for fig in figures:
+        pool.release(fig)
+    # the least recently released figure is evicted
+    assert [_x[0] for _x in pool._figures] == [(4, 2), (4, 3), (4, 4)]
+    assert pool.acquire((4, 1)) is not figures[0]
+    assert pool.acquire((4, 2)) is figures[1]
+    pool.release(figures[1])
+    pool.release(pool.acquire((4, 1)))
+    assert [_x[0] for _x in pool._figures] == [(4, 4), (4, 2), (4, 1)]
+    assert pool._count == 3
@@ -26,15 +26,22 @@
     limitations under the License.
 """
 
+import gc
+import io
+import json
 import os
+import zipfile
+from datetime import datetime, timedelta
 from shutil import move
 
 import mock
 from nco import Nco
+from PIL import Image
 import pytest
 
 import mslib.mswms.wms
 import mslib.mswms.gallery_builder
+import mslib.mswms.prefetch
 import mslib.mswms.mswms as mswms
 from importlib import reload
 from mslib._tests.utils import callback_ok_image, callback_ok_xml, callback_ok_html, callback_404_plain
@@ -375,6 +382,204 @@ class Test_WMS(object):
         result = self.client.get('/?{}'.format(environ["QUERY_STRING"]))
         callback_ok_xml(result.status, result.headers)
 
+    def test_metrics(self):
+        environ = {
+            'wsgi.url_scheme': 'http',
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost:8081',
+            'QUERY_STRING':
+                'layers=ecmwf_EUR_LL015.LS_HV01&styles=&srs=LINE%3A1&format=text%2Fxml&'
+                'request=GetMap&dim_init_time=2012-10-17T12%3A00%3A00Z&'
+                'version=1.1.1&bbox=201&time=2012-10-17T12%3A00%3A00Z&'
+                'exceptions=application%2Fvnd.ogc.se_xml&path=52.78%2C-8.93%2C25000%2C48.08%2C11.28%2C25000'}
+
+        self.client = mswms.application.test_client()
+        result = self.client.get('/?{}'.format(environ["QUERY_STRING"]))
+        callback_ok_xml(result.status, result.headers)
+        result = self.client.get('/metrics')
+        assert result.status == "200 OK"
+        assert result.headers["Content-type"].startswith("text/plain")
+        text = result.data.decode("utf-8")
+        for phase in ("open", "read", "interpolate", "prepare", "total"):
+            assert f'layer="ecmwf_EUR_LL015.LS_HV01",style="",phase="{phase}"' in text
+        assert "mswms_open_datasets" in text
+        assert 'mswms_cache_requests_total{cache="dataset"' in text
+
+    def test_parse_time_values(self):
+        available = [datetime(2012, 10, 17, 12) + timedelta(hours=6 * _x) for _x in range(4)]
+        assert mslib.mswms.wms.parse_time_values("2012-10-17T12:00:00Z,2012-10-17T06:00:00Z") == [
+            datetime(2012, 10, 17, 6), datetime(2012, 10, 17, 12)]
+        assert mslib.mswms.wms.parse_time_values(
+            "2012-10-17T12:00:00Z/2012-10-18T00:00:00Z", available) == available[:3]
+        assert mslib.mswms.wms.parse_time_values(
+            "2012-10-17T12:00:00Z/2012-10-18T00:00:00Z/PT12H,2012-10-18T06:00:00Z") == available[::2] + available[3:]
+        for value in ("2012-10-17T12:00:00Z/2012-10-18T00:00:00Z/PT0H", "2012-10-17T12:00:00Z/a/b/c", "fnord"):
+            with pytest.raises(ValueError):
+                mslib.mswms.wms.parse_time_values(value)
+
+    def test_format_time_extent(self):
+        times = [datetime(2012, 10, 17, 12) + timedelta(hours=6 * _x) for _x in range(5)]
+        assert mslib.mswms.wms.format_time_extent(times[:2]) == "2012-10-17T12:00:00Z,2012-10-17T18:00:00Z"
+        assert mslib.mswms.wms.format_time_extent(times[::-1]) == "2012-10-17T12:00:00Z/2012-10-18T12:00:00Z/PT6H"
+        assert mslib.mswms.wms.format_time_extent(times[:3] + [datetime(2012, 10, 19), datetime(2012, 10, 20),
+                                                               datetime(2012, 10, 21, 12)]) == \
+            "2012-10-17T12:00:00Z/2012-10-18T00:00:00Z/PT6H,2012-10-19T00:00:00Z,2012-10-20T00:00:00Z," \
+            "2012-10-21T12:00:00Z"
+        assert mslib.mswms.wms.format_time_extent(times[:3], compact=False) == \
+            "2012-10-17T12:00:00Z,2012-10-17T18:00:00Z,2012-10-18T00:00:00Z"
+
+    def test_get_capabilities_time_extent(self):
+        self.client = mswms.application.test_client()
+        result = self.client.get('/?request=GetCapabilities&service=WMS&version=1.3.0')
+        text = result.data.decode("utf-8")
+        assert 'name="TIME" units="ISO8601">2012-10-17T12:00:00Z/' in text
+        with mock.patch.object(mslib.mswms.wms.mss_wms_settings, "compact_time_extents", False, create=True):
+            result = self.client.get('/?request=GetCapabilities&service=WMS&version=1.3.0')
+        assert "/PT" not in result.data.decode("utf-8")
+
+    def test_produce_animation(self):
+        query_string = (
+            'layers=ecmwf_EUR_LL015.PLDiv01&styles=&elevation=200&srs=EPSG%3A4326&request=GetMap&height=376&'
+            'dim_init_time=2012-10-17T12%3A00%3A00Z&width=479&version=1.1.1&bbox=-50.0%2C20.0%2C20.0%2C75.0')
+        self.client = mswms.application.test_client()
+        result = self.client.get(
+            '/?{}&format=image%2Fpng&time=2012-10-17T12%3A00%3A00Z%2F2012-10-18T00%3A00%3A00Z'.format(query_string))
+        callback_ok_image(result.status, result.headers)
+        with Image.open(io.BytesIO(result.data)) as image:
+            assert image.n_frames == 3
+
+        result = self.client.get(
+            '/?{}&format=image%2Fwebp&time=2012-10-17T12%3A00%3A00Z%2C2012-10-18T00%3A00%3A00Z'.format(query_string))
+        assert result.headers["Content-Type"] == "image/webp"
+        with Image.open(io.BytesIO(result.data)) as image:
+            assert image.n_frames == 2
+
+        result = self.client.get(
+            '/?{}&format=application%2Fzip&time=2012-10-17T12%3A00%3A00Z%2F2012-10-18T00%3A00%3A00Z%2FPT12H'.format(
+                query_string))
+        assert result.headers["Content-Type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(result.data)) as archive:
+            assert archive.namelist() == ["000_20121017T120000Z.png", "001_20121018T000000Z.png"]
+
+        for value in ("2012-10-17T12%3A00%3A00Z%2F2012-10-18T00%3A00%3A00Z%2FPT1H",
+                      "2012-10-17T13%3A00%3A00Z%2F2012-10-17T14%3A00%3A00Z"):
+            result = self.client.get('/?{}&format=image%2Fpng&time={}'.format(query_string, value))
+            assert result.data.count(b"ServiceExceptionReport") > 0, result
+        result = self.client.get('/?{}&format=image%2Fwebp&time=2012-10-17T12%3A00%3A00Z'.format(query_string))
+        assert result.data.count(b"ServiceExceptionReport") > 0, result
+
+    def test_get_feature_info(self):
+        query_string = (
+            'request=GetFeatureInfo&service=WMS&version=1.1.1&query_layers=ecmwf_EUR_LL015.PLDiv01&'
+            'dim_init_time=2012-10-17T12%3A00%3A00Z&info_format=application%2Fjson')
+        self.client = mswms.application.test_client()
+        result = self.client.get('/?{}&lat=50&lon=10&elevation=200&time=2012-10-17T12%3A00%3A00Z'.format(query_string))
+        assert result.status == "200 OK"
+        assert result.headers["Content-Type"] == "application/json"
+        info = json.loads(result.data)["ecmwf_EUR_LL015.PLDiv01"]
+        assert info["times"] == ["2012-10-17T12:00:00Z"]
+        assert info["grid_lat"] == pytest.approx(50, abs=1) and info["grid_lon"] == pytest.approx(10, abs=1)
+        field = info["fields"]["geopotential_height"]
+        assert field["levels"] == [200] and field["level_units"] == "hPa"
+        assert len(field["values"]) == 1 and 10000 < field["values"][0] < 13000
+
+        # time series and column, position given by pixel
+        result = self.client.get(
+            '/?{}&srs=EPSG%3A4326&bbox=-50%2C20%2C20%2C75&width=70&height=55&x=60&y=25'.format(query_string))
+        info = json.loads(result.data)["ecmwf_EUR_LL015.PLDiv01"]
+        assert info["lat"] == pytest.approx(49.5) and info["lon"] == pytest.approx(10.5)
+        assert len(info["times"]) > 1
+        field = info["fields"]["geopotential_height"]
+        assert len(field["values"]) == len(info["times"])
+        assert all(len(_x) == len(field["levels"]) for _x in field["values"])
+
+        result = self.client.get('/?{}&lat=50&lon=10&elevation=201'.format(query_string))
+        assert result.data.count(b"ServiceExceptionReport") > 0, result
+        result = self.client.get('/?{}'.format(query_string))
+        assert result.data.count(b"ServiceExceptionReport") > 0, result
+
+    def test_conditional_requests(self):
+        query_string = (
+            'layers=ecmwf_EUR_LL015.PLDiv01&styles=&elevation=200&crs=EPSG%3A4326&format=image%2Fpng&'
+            'request=GetMap&bgcolor=0xFFFFFF&height=376&dim_init_time=2012-10-17T12%3A00%3A00Z&width=479&'
+            'version=1.3.0&bbox=20.0%2C-50.0%2C75.0%2C20.0&time=2012-10-17T12%3A00%3A00Z&'
+            'exceptions=XML&transparent=FALSE')
+        self.client = mswms.application.test_client()
+        result = self.client.get('/?{}'.format(query_string))
+        callback_ok_image(result.status, result.headers)
+        etag, last_modified = result.headers["ETag"], result.headers["Last-Modified"]
+        assert etag.startswith('"')
+        assert result.headers["Cache-Control"] == "max-age=0"
+
+        for headers in ({"If-None-Match": etag}, {"If-Modified-Since": last_modified}):
+            result = self.client.get('/?{}'.format(query_string), headers=headers)
+            assert result.status == "304 NOT MODIFIED"
+            assert result.data == b""
+            assert result.headers["ETag"] == etag
+        result = self.client.get('/?{}'.format(query_string), headers={"If-None-Match": '"fnord"'})
+        callback_ok_image(result.status, result.headers)
+
+        # the ETag depends on the normalized request
+        result = self.client.get('/?{}'.format(query_string.replace("bgcolor=0xFFFFFF&", "")) + "&BGCOLOR=0xFFFFFF")
+        assert result.headers["ETag"] == etag
+        result = self.client.get('/?{}'.format(query_string.replace("elevation=200", "elevation=300")))
+        assert result.headers["ETag"] != etag
+
+        result = self.client.get('/?{}'.format(query_string.replace("time=2012", "time=a2012")))
+        assert "ETag" not in result.headers
+
+    def test_conditional_requests_configuration(self, tmp_path):
+        query_string = (
+            'layers=ecmwf_EUR_LL015.PLDiv01&styles=&elevation=200&crs=EPSG%3A4326&format=image%2Fpng&'
+            'request=GetMap&height=376&dim_init_time=2012-10-17T12%3A00%3A00Z&width=479&'
+            'version=1.3.0&bbox=20.0%2C-50.0%2C75.0%2C20.0&time=2012-10-17T12%3A00%3A00Z')
+        settings_file = tmp_path / "mss_wms_settings.py"
+        settings_file.write_text("")
+        self.client = mswms.application.test_client()
+        with mock.patch.object(mslib.mswms.wms.mss_wms_settings, "__file__", str(settings_file)):
+            etag = self.client.get('/?{}'.format(query_string)).headers["ETag"]
+            assert self.client.get('/?{}'.format(query_string)).headers["ETag"] == etag
+            # a changed configuration may change the plots
+            stat = os.stat(settings_file)
+            os.utime(settings_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            result = self.client.get('/?{}'.format(query_string), headers={"If-None-Match": etag})
+            callback_ok_image(result.status, result.headers)
+            assert result.headers["ETag"] != etag
+
+    def test_prefetch(self):
+        query_string = (
+            'layers=ecmwf_EUR_LL015.PLDiv01&styles=&elevation=200&crs=EPSG%3A4326&format=image%2Fpng&'
+            'request=GetMap&height=376&dim_init_time=2012-10-17T12%3A00%3A00Z&width=479&'
+            'version=1.3.0&bbox=20.0%2C-50.0%2C75.0%2C20.0&time=2012-10-17T12%3A00%3A00Z')
+        server = mslib.mswms.wms.server
+        query = mslib.mswms.wms.CIMultiDict(
+            mslib.mswms.wms.urllib.parse.parse_qsl(query_string, keep_blank_values=True))
+        neighbours = server.get_neighbour_queries(query, "getmap")
+        assert sorted(neighbours) == ["level+1", "level-1", "time+1"]
+        assert neighbours["time+1"]["TIME"] == "2012-10-17T18:00:00Z"
+        assert neighbours["level+1"]["ELEVATION"] == "250.0"
+        assert neighbours["level-1"]["ELEVATION"] == "150.0"
+        query["TIME"] = "2012-10-17T12:00:00Z/2012-10-18T00:00:00Z"
+        assert server.get_neighbour_queries(query, "getmap") == {}
+
+        prefetcher = mslib.mswms.prefetch.Prefetcher(
+            mslib.mswms.wms._prefetch_render, server.get_neighbour_queries, enabled=True, count=1, interval=0,
+            idle_delay=0, version=mslib.mswms.wms._prefetch_version)
+        self.client = mswms.application.test_client()
+        with mock.patch.object(mslib.mswms.wms, "prefetcher", prefetcher):
+            result = self.client.get('/?{}'.format(query_string))
+            callback_ok_image(result.status, result.headers)
+            assert prefetcher.join(60)
+            # rendered by a server of its own, which does not share the plot drivers
+            assert mslib.mswms.wms.prefetch_server not in (None, server)
+            with mock.patch.object(server, "produce_plot", wraps=server.produce_plot) as produce_plot:
+                result = self.client.get(
+                    '/?{}'.format(query_string.replace("&time=2012-10-17T12", "&time=2012-10-17T18")))
+                callback_ok_image(result.status, result.headers)
+                assert produce_plot.call_count == 0
+                assert result.data == prefetcher.get(
+                    mslib.mswms.wms.coalescer.key(neighbours["time+1"], "getmap"), neighbours["time+1"], "getmap")[0]
+            prefetcher.stop()
+
     def test_import_error(self):
         with mock.patch.dict("sys.modules", {"mss_wms_settings": None, "mss_wms_auth": None}):
             reload(mslib.mswms.wms)
@@ -384,6 +589,53 @@ class Test_WMS(object):
         assert mslib.mswms.wms.mss_wms_settings.__file__ is not None
         assert mslib.mswms.wms.mss_wms_auth.__file__ is not None
 
+    def test_deferred_setup(self):
+        server = mslib.mswms.wms.WMSServer()
+        assert "hsec_layer_registry" not in server.__dict__
+        # scraping the metrics does not set up the server
+        with mock.patch.object(mslib.mswms.wms, "server", server):
+            assert mslib.mswms.wms._open_datasets() == 0
+        assert "hsec_drivers" not in server.__dict__
+        assert len(server.hsec_layer_registry) > 0
+        assert "hsec_drivers" in server.__dict__
+
+        layer = "mslib.mswms.mpl_hsec_styles.HS_MSLPStyle_01"
+        assert mslib.mswms.wms.resolve_layer_class(layer).__name__ == "HS_MSLPStyle_01"
+        dataset = next(iter(server.hsec_drivers))
+        server.register_hsec_layer([dataset], layer)
+        assert "MSLP" in server.hsec_layer_registry[dataset]
+        with pytest.raises(AttributeError):
+            server.unknown_attribute
+
+    def test_preload(self):
+        query_string = (
+            "layers=ecmwf_EUR_LL015.PLDiv01&styles=&elevation=200&srs=EPSG%3A4326&format=image%2Fpng&"
+            "request=GetMap&height=376&dim_init_time=2012-10-17T12%3A00%3A00Z&width=479&"
+            "version=1.1.1&bbox=-50.0%2C20.0%2C20.0%2C75.0&time=2012-10-17T12%3A00%3A00Z")
+        server = mslib.mswms.wms.server
+        with mock.patch.object(server, "produce_plot", wraps=server.produce_plot) as produce_plot, \
+                mock.patch.object(mslib.mswms.wms, "_PRELOAD_PID", None), \
+                mock.patch("os.register_at_fork", create=True) as register_at_fork:
+            try:
+                mslib.mswms.wms.preload(["?service=WMS&request=GetCapabilities&version=1.3.0", query_string])
+                assert gc.get_freeze_count() > 0
+            finally:
+                gc.unfreeze()
+            assert mslib.mswms.wms._PRELOAD_PID == os.getpid()
+        produce_plot.assert_called_once()
+        assert produce_plot.call_args[0][0]["layers"] == "ecmwf_EUR_LL015.PLDiv01"
+        assert all(driver.dataset is None for driver in server.hsec_drivers.values())
+        register_at_fork.assert_called_once_with(after_in_child=mslib.mswms.wms._after_fork_of_preloaded)
+
+    @pytest.mark.parametrize("parent, restarted", [(100, True), (200, False)])
+    def test_after_fork_of_preloaded(self, parent, restarted):
+        # only the workers forked by the preloaded process restart the file watchers
+        with mock.patch.object(mslib.mswms.wms, "_PRELOAD_PID", 100), \
+                mock.patch("os.getppid", return_value=parent), \
+                mock.patch("mslib.mswms.wms.restart_watchers") as restart_watchers:
+            mslib.mswms.wms._after_fork_of_preloaded()
+        assert restart_watchers.called == restarted
+
     def test_files_changed(self):
         def do_test():
             environ = {
@@ -442,8 +694,9 @@ class Test_WMS(object):
         mslib.mswms.wms.server.generate_gallery(generate_code=False, plot_list=linear_plots)
         assert not os.path.exists(os.path.join(tempdir, "code"))
 
-        file = os.path.join(tempdir, "plots", os.listdir(os.path.join(tempdir, "plots"))[0])
-        file2 = os.path.join(tempdir, "plots", os.listdir(os.path.join(tempdir, "plots"))[1])
+        plots = sorted(_x for _x in os.listdir(os.path.join(tempdir, "plots")) if _x.endswith(".png"))
+        file = os.path.join(tempdir, "plots", plots[0])
+        file2 = os.path.join(tempdir, "plots", plots[1])
         modified_at = os.path.getmtime(file2)
         os.remove(file)
         assert not os.path.exists(file)
@@ -452,6 +705,19 @@ class Test_WMS(object):
         assert os.path.exists(file)
         assert modified_at == os.path.getmtime(file2)
 
+        # plots whose key changed are regenerated, by several processes if requested
+        manifest = mslib.mswms.gallery_builder.load_manifest(tempdir)
+        assert sorted(manifest) == plots
+        assert all(manifest[_x]["seconds"] >= 0 for _x in plots)
+        manifest[plots[1]]["key"] = "outdated"
+        mslib.mswms.gallery_builder.save_manifest(tempdir, manifest)
+        modified_at = os.path.getmtime(file)
+        mslib.mswms.wms.server.generate_gallery(create=True, plot_list=linear_plots, workers=2)
+        assert modified_at == os.path.getmtime(file)
+        assert modified_at != os.path.getmtime(file2)
+        assert mslib.mswms.gallery_builder.load_manifest(tempdir)[plots[1]]["key"] != "outdated"
+        modified_at = os.path.getmtime(file2)
+
         mslib.mswms.wms.server.generate_gallery(clear=True, create=True, plot_list=linear_plots)
         assert modified_at != os.path.getmtime(file2)
 
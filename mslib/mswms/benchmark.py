@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.benchmark
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Reproducible performance benchmark for the MSS WMS server.
+
+    For every configured grid resolution and level count a demodata set and a
+    server configuration are generated into a temporary directory. A separate
+    python process then drives WMSServer.produce_plot and
+    WMSServer.get_capabilities with representative GetMap, GetVSec, GetLSec
+    and GetCapabilities requests, so that imports, caches and the peak memory
+    are measured per configuration. Latency percentiles, throughput and peak
+    memory are written as JSON which can be compared across commits:
+
+        mswms_benchmark -c 1:14 0.5:30 -o new.json --compare old.json
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import fs
+import numpy as np
+
+from mslib import __version__
+from mslib.mswms.demodata import DataFiles
+
+
+INIT_TIME = "2012-10-17T12:00:00Z"
+VALID_TIMES = [f"2012-10-{17 + (12 + _x) // 24}T{(12 + _x) % 24:02d}:00:00Z" for _x in range(0, 37, 6)]
+
+# name, request, query parameters. TIME is cycled through VALID_TIMES.
+WORKLOADS = [
+    ("getcapabilities", "getcapabilities", {
+        "request": "GetCapabilities", "service": "WMS", "version": "1.1.1"}),
+    ("getmap", "getmap", {
+        "layers": "ecmwf_EUR_LL015.PLTemp01", "styles": "", "elevation": "300", "srs": "EPSG:4326",
+        "format": "image/png", "request": "GetMap", "width": "800", "height": "600", "version": "1.1.1",
+        "bbox": "-50,30,50,70", "dim_init_time": INIT_TIME, "transparent": "FALSE"}),
+    ("getvsec", "getvsec", {
+        "layers": "ecmwf_EUR_LL015.VS_HV01", "styles": "", "srs": "VERT:LOGP", "format": "image/png",
+        "request": "GetVSec", "width": "800", "height": "300", "version": "1.1.1", "bbox": "201,1050,10,100",
+        "dim_init_time": INIT_TIME, "path": "52.78,-8.93,48.08,11.28,40,30", "transparent": "FALSE"}),
+    ("getlsec", "getlsec", {
+        "layers": "ecmwf_EUR_LL015.LS_HV01", "styles": "", "srs": "LINE:1", "format": "text/xml",
+        "request": "GetLSec", "version": "1.1.1", "bbox": "201", "dim_init_time": INIT_TIME,
+        "path": "52.78,-8.93,25000,48.08,11.28,25000"}),
+]
+
+
+def parse_config(text):
+    """
+    Parses a configuration given as "<resolution in degree>[:<number of levels>]".
+    """
+    resolution, _, num_levels = text.partition(":")
+    return {"name": text, "resolution": float(resolution),
+            "num_levels": int(num_levels) if num_levels else None}
+
+
+def peak_memory():
+    """
+    Returns the peak resident set size of this process in bytes.
+    """
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def summarize(latencies, errors):
+    """
+    Computes statistics of a list of request durations in seconds. The first
+    (cold) request is reported separately.
+    """
+    warm = np.asarray(latencies[1:] if len(latencies) > 1 else latencies)
+    return {
+        "n": len(latencies),
+        "errors": errors,
+        "cold": latencies[0],
+        "mean": float(warm.mean()),
+        "p50": float(np.percentile(warm, 50)),
+        "p90": float(np.percentile(warm, 90)),
+        "p99": float(np.percentile(warm, 99)),
+        "throughput": float(len(warm) / warm.sum()) if warm.sum() > 0 else None,
+    }
+
+
+def run_workloads(repeat, workloads=None):
+    """
+    Drives the WMS server configured by the mss_wms_settings in the python
+    path. Must be called in a fresh process.
+    """
+    # prevent the debug logging setup of the wms module
+    logging.basicConfig(level=logging.WARNING)
+    from multidict import CIMultiDict
+
+    start = time.perf_counter()
+    from mslib.mswms.wms import server
+    results = {"startup": time.perf_counter() - start, "workloads": {}}
+
+    # request the available pressure level closest to the one of the workload
+    elevations = np.asarray(server.hsec_drivers["ecmwf_EUR_LL015"].get_elevations("pl"), dtype=float)
+
+    for name, mode, params in WORKLOADS:
+        if workloads and name not in workloads:
+            continue
+        latencies, errors = [], 0
+        for index in range(repeat):
+            query = CIMultiDict(params)
+            if "elevation" in params:
+                elevation = elevations[np.abs(elevations - float(params["elevation"])).argmin()]
+                query["elevation"] = str(elevation)
+            if mode != "getcapabilities":
+                query["time"] = VALID_TIMES[index % len(VALID_TIMES)]
+            start = time.perf_counter()
+            if mode == "getcapabilities":
+                _, return_format = server.get_capabilities(query, "http://localhost/")
+                expected = "text/xml"
+            else:
+                _, return_format = server.produce_plot(query, mode)
+                expected = params["format"]
+            latencies.append(time.perf_counter() - start)
+            if return_format != expected:
+                errors += 1
+        results["workloads"][name] = summarize(latencies, errors)
+    results["peak_rss_bytes"] = peak_memory()
+    return results
+
+
+def benchmark_config(config, repeat, workloads, workdir, processes=1):
+    """
+    Generates the data for one configuration and runs the workloads on it in a
+    separate process.
+    """
+    root = os.path.join(workdir, config["name"].replace(":", "_"))
+    os.makedirs(os.path.join(root, "data"))
+    examples = DataFiles(data_fs=fs.open_fs(os.path.join(root, "data")), server_config_fs=fs.open_fs(root))
+    examples.create_server_config(detailed_information=True)
+    start = time.perf_counter()
+    examples.create_data(resolution=config["resolution"], num_levels=config["num_levels"], processes=processes)
+    generation = time.perf_counter() - start
+    data_size = sum(os.path.getsize(os.path.join(root, "data", _x)) for _x in os.listdir(os.path.join(root, "data")))
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root] + [_x for _x in [env.get("PYTHONPATH")] if _x])
+    command = [sys.executable, "-m", "mslib.mswms.benchmark", "--run", "--repeat", str(repeat)]
+    if workloads:
+        command += ["--workloads"] + workloads
+    output = subprocess.run(command, env=env, cwd=root, check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output.decode("utf-8").strip().split("\n")[-1])
+    result.update({"resolution": config["resolution"], "num_levels": config["num_levels"],
+                   "generation_seconds": generation, "data_size_bytes": data_size})
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__), check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, reference, threshold=0.1):
+    """
+    Prints the relative change of the median latencies and peak memory of
+    <result> with respect to <reference>. Returns the number of regressions
+    larger than <threshold>.
+    """
+    regressions = 0
+    print(f"{'config':>12} {'workload':>16} {'old p50':>10} {'new p50':>10} {'change':>8}")
+    for name, config in result["configs"].items():
+        if name not in reference["configs"]:
+            continue
+        old_config = reference["configs"][name]
+        rows = [(workload, old_config["workloads"][workload]["p50"], values["p50"])
+                for workload, values in config["workloads"].items() if workload in old_config["workloads"]]
+        rows.append(("peak_rss", old_config["peak_rss_bytes"], config["peak_rss_bytes"]))
+        for workload, old, new in rows:
+            change = (new - old) / old if old else 0.
+            flag = ""
+            if change > threshold:
+                regressions += 1
+                flag = " !"
+            print(f"{name:>12} {workload:>16} {old:10.4g} {new:10.4g} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the MSS WMS server based on demodata.")
+    parser.add_argument("-v", "--version", help="show version", action="store_true", default=False)
+    parser.add_argument("-c", "--configs", nargs="+", default=["1:14", "0.5:30"],
+                        help="grid configurations as <resolution in degree>[:<number of levels>]")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="number of requests per workload")
+    parser.add_argument("-w", "--workloads", nargs="+", choices=[_x[0] for _x in WORKLOADS],
+                        help="restrict the benchmark to these workloads")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="number of processes used to generate the data")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slow-down reported as regression by --compare")
+    parser.add_argument("--keep", help="keep the generated data in this directory")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.version:
+        print("***********************************************************************")
+        print("\n            Mission Support System (mss)\n")
+        print("***********************************************************************")
+        print("Documentation: http://mss.rtfd.io")
+        print("Version:", __version__)
+        sys.exit()
+
+    if args.run:
+        print(json.dumps(run_workloads(args.repeat, args.workloads)))
+        return
+
+    result = {
+        "version": __version__,
+        "revision": git_revision(),
+        "date": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "configs": {},
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.keep if args.keep else tmpdir
+        for config in [parse_config(_x) for _x in args.configs]:
+            logging.info("benchmarking configuration '%s'", config["name"])
+            result["configs"][config["name"]] = benchmark_config(
+                config, args.repeat, args.workloads, workdir, args.processes)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as fid:
+            fid.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as fid:
+            reference = json.load(fid)
+        if compare(result, reference, args.threshold) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
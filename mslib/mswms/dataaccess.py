@@ -35,6 +35,8 @@ import numpy as np
 import pint
 
 from mslib import netCDF4tools
+from mslib.mswms.overviews import overview_source, parse_overview_filename
+from mslib.mswms.watcher import ALL, create_watcher
 from mslib.utils import UR
 
 
@@ -117,6 +119,14 @@ class NWPDataAccess(metaclass=ABCMeta):
         """
         pass
 
+    def get_file_versions(self, filenames):
+        """
+        Returns the versions of <filenames> as known to this instance. Users of
+        the files, e.g. plot drivers, compare them to those of the files they
+        opened, as another user may already have caused the reload of a file.
+        """
+        return None
+
     @abstractmethod
     def _determine_filename(self, variable, vartype, init_time, valid_time):
         """
@@ -132,6 +142,14 @@ class NWPDataAccess(metaclass=ABCMeta):
         """
         return self._root_path
 
+    def get_overview_filenames(self, filenames, grid_spacing):
+        """
+        Returns the names of files that may be used instead of <filenames> if
+        a grid spacing of <grid_spacing> degree is sufficient. The default
+        implementation does not support overviews.
+        """
+        return filenames
+
     def uses_inittime_dimension(self):
         """
         Return whether this data set supports multiple init times
@@ -213,6 +231,8 @@ class DefaultDataAccess(NWPDataAccess):
         self._filetree = None
         self._mfDatasetArgsDict = {"skip_dim_check": skip_dim_check}
         self._file_cache = {}
+        self._overviews = {}
+        self._elevations = {"sfc": {"filename": None, "levels": [], "units": None}}
 
     def _determine_filename(self, variable, vartype, init_time, valid_time, reload=True):
         """
@@ -235,6 +255,13 @@ class DefaultDataAccess(NWPDataAccess):
     def is_reload_required(self, filenames):
         return False
 
+    def get_file_versions(self, filenames):
+        """
+        Returns the modification times of <filenames> (or of the files of
+        overviews) of the last setup.
+        """
+        return [self._file_cache.get(overview_source(os.path.basename(_x)), (None,))[0] for _x in filenames]
+
     def _parse_file(self, filename):
         elevations = {"filename": filename, "levels": [], "units": None}
         with netCDF4.Dataset(os.path.join(self._root_path, filename)) as dataset:
@@ -250,6 +277,7 @@ class DefaultDataAccess(NWPDataAccess):
                 valid_times = [None]
             lat_name, lat_var, lon_name, lon_var = netCDF4tools.identify_CF_lonlat(dataset)
             vert_name, vert_var, _, _, vert_type = netCDF4tools.identify_vertical_axis(dataset)
+            grid_spacing = max([np.abs(np.diff(_x[:])).max() for _x in (lat_var, lon_var) if len(_x) > 1] + [0])
 
             if len(time_var.dimensions) != 1 or time_var.dimensions[0] != time_name:
                 raise IOError("Problem with time coordinate variable")
@@ -303,7 +331,8 @@ class DefaultDataAccess(NWPDataAccess):
             "elevations": elevations,
             "init_time": init_time,
             "valid_times": valid_times,
-            "standard_names": standard_names
+            "standard_names": standard_names,
+            "grid_spacing": float(grid_spacing),
         }
 
     def _add_to_filetree(self, filename, content):
@@ -330,10 +359,18 @@ class DefaultDataAccess(NWPDataAccess):
                 else:
                     var_leaf[valid_time] = filename
 
+    def _get_mtime(self, filename):
+        """
+        Returns the modification time of the file <filename> in the data directory.
+        """
+        return os.path.getmtime(os.path.join(self._root_path, filename))
+
     def setup(self):
         # Get a list of the available data files.
-        self._available_files = [
+        filenames = [
             _filename for _filename in sorted(os.listdir(self._root_path)) if self._domain_id in _filename]
+        self._available_files = [
+            _filename for _filename in filenames if parse_overview_filename(_filename) is None]
         logging.info("Files identified for domain '%s': %s",
                      self._domain_id, self._available_files)
 
@@ -346,7 +383,7 @@ class DefaultDataAccess(NWPDataAccess):
 
         # Build the tree structure.
         for filename in self._available_files:
-            mtime = os.path.getmtime(os.path.join(self._root_path, filename))
+            mtime = self._get_mtime(filename)
             if (filename in self._file_cache) and (mtime == self._file_cache[filename][0]):
                 logging.info("Using cached candidate '%s'", filename)
                 content = self._file_cache[filename][1]
@@ -374,6 +411,37 @@ class DefaultDataAccess(NWPDataAccess):
                     self._elevations[content["vert_type"]] = content["elevations"]
             self._add_to_filetree(filename, content)
 
+        # Register the overviews that are at least as recent as their file.
+        self._overviews = {}
+        for filename in filenames:
+            parsed = parse_overview_filename(filename)
+            if parsed is None or parsed[0] not in self._file_cache:
+                continue
+            source, factor = parsed
+            if self._get_mtime(filename) < self._get_mtime(source):
+                logging.warning("Ignoring outdated overview '%s'", filename)
+                continue
+            self._overviews.setdefault(source, {})[factor] = filename
+
+    def get_overview_filenames(self, filenames, grid_spacing):
+        """
+        Returns the overviews of <filenames> with the largest common factor that
+        keeps the grid spacing below <grid_spacing> degree, or <filenames>.
+        """
+        factors = None
+        for filename in filenames:
+            basename = os.path.basename(filename)
+            if basename not in self._file_cache:
+                return filenames
+            spacing = self._file_cache[basename][1]["grid_spacing"]
+            available = {_x for _x in self._overviews.get(basename, {}) if spacing * _x <= grid_spacing}
+            factors = available if factors is None else factors & available
+        if not factors:
+            return filenames
+        factor = max(factors)
+        logging.debug("using overviews of factor %s", factor)
+        return [os.path.join(os.path.dirname(_x), self._overviews[os.path.basename(_x)][factor]) for _x in filenames]
+
     def get_init_times(self):
         """
         Returns a list of available forecast init times (base times).
@@ -432,10 +500,50 @@ CachedDataAccess = DefaultDataAccess
 class WatchModificationDataAccess(DefaultDataAccess):
     """
     Subclass to CachedDataAccess that constantly watches for modified netCDF files.
-    Imposes a heavy performance cost. It is mostly thought for use when setting up
-    a server in contrast to operation use.
+
+    By default, the modification time of each file is checked on every access,
+    which imposes a heavy performance cost, in particular on network file
+    systems. It is mostly thought for use when setting up a server in contrast
+    to operation use. With <watch> set to "auto", "inotify" or "poll", changes are
+    instead collected in the background (see mslib.mswms.watcher) and checked
+    in memory; only changed files are examined again.
     """
 
+    def __init__(self, rootpath, domain_id, skip_dim_check=[], watch=None, poll_interval=5., **kwargs):
+        """
+        watch: None to check modification times on access, otherwise the mode of the watcher
+        poll_interval: seconds between two scans of the directory by a polling watcher
+        """
+        DefaultDataAccess.__init__(self, rootpath, domain_id, skip_dim_check=skip_dim_check, **kwargs)
+        self._watch = watch
+        self._poll_interval = poll_interval
+        self._watcher = None
+        # sequence number of the last change of the watcher considered by setup()
+        self._sequence = 0
+        self._changed_files = set()
+
+    def setup(self):
+        if self._watch is not None:
+            if self._watcher is None:
+                self._watcher = create_watcher(self._root_path, mode=self._watch, interval=self._poll_interval)
+                self._changed_files, self._sequence = {ALL}, self._watcher.sequence
+            else:
+                self._changed_files, self._sequence = self._watcher.changes_since(self._sequence)
+        try:
+            DefaultDataAccess.setup(self)
+        finally:
+            self._changed_files = set()
+
+    def _get_mtime(self, filename):
+        """
+        Returns the cached modification time for files that did not change
+        according to the watcher.
+        """
+        if (self._watcher is not None and ALL not in self._changed_files and
+                filename not in self._changed_files and filename in self._file_cache):
+            return self._file_cache[filename][0]
+        return DefaultDataAccess._get_mtime(self, filename)
+
     def _determine_filename(self, variable, vartype, init_time, valid_time, reload=True):
         """
         Determines the name of the data file that contains
@@ -445,6 +553,10 @@ class WatchModificationDataAccess(DefaultDataAccess):
         assert self._filetree is not None, "filetree is None. Forgot to call setup()?"
         try:
             filename = self._filetree[vartype][init_time][variable][valid_time]
+            if self._watcher is not None:
+                if not self._watcher.changed([filename], self._sequence):
+                    return filename
+                raise KeyError
             mtime = os.path.getmtime(os.path.join(self._root_path, filename))
             if filename in self._file_cache and mtime == self._file_cache[filename][0]:
                 return filename
@@ -452,16 +564,22 @@ class WatchModificationDataAccess(DefaultDataAccess):
         except (KeyError, OSError) as ex:
             if reload:
                 self.setup()
-                self._determine_filename(self, variable, vartype, init_time, valid_time, reload=False)
+                return self._determine_filename(variable, vartype, init_time, valid_time, reload=False)
             else:
                 logging.error("Could not identify filename. %s %s %s %s %s %s",
                               variable, vartype, init_time, valid_time, type(ex), ex)
                 raise ValueError(f"variable type {vartype} not available for variable {variable}")
 
     def is_reload_required(self, filenames):
+        if self._watcher is not None:
+            basenames = [os.path.basename(_x) for _x in filenames]
+            if not self._watcher.changed(basenames + [overview_source(_x) for _x in basenames], self._sequence):
+                return False
+            self.setup()
+            return True
         try:
             for filename in filenames:
-                basename = os.path.basename(filename)
+                basename = overview_source(os.path.basename(filename))
                 if basename not in self._file_cache:
                     raise OSError
                 fullname = os.path.join(self._root_path, basename)
@@ -27,6 +27,7 @@
 """
 
 import argparse
+import multiprocessing
 import os
 import sys
 import netCDF4 as nc
@@ -767,12 +768,20 @@ def get_profile(coordinate, levels, standard_name):
 
 
 def _generate_3d_data(ntimes, nlats, nlons, mean, std, ilev=0):
+    return np.asarray([_generate_2d_data(itime, ntimes, nlats, nlons, mean, std, ilev=ilev)
+                       for itime in range(ntimes)])
+
+
+def _generate_2d_data(itime, ntimes, nlats, nlons, mean, std, ilev=0):
+    """
+    Generates the horizontal field of time step <itime>. The field is separable in
+    longitude and latitude, so that the trigonometric functions are only evaluated
+    along the axes.
+    """
     xarr = np.linspace(0., 10. + (ilev / 3.), nlons)
     yarr = np.linspace(0., 5. + (ilev / 3.), nlats)
-    tarr = np.linspace(0, 2., ntimes)
-    datax = xarr[np.newaxis, np.newaxis, :] + tarr[:, np.newaxis, np.newaxis]
-    datay = yarr[np.newaxis, :, np.newaxis] - tarr[:, np.newaxis, np.newaxis]
-    return mean + std * (np.sin(datax) + np.cos(datay)) / 2
+    time = np.linspace(0, 2., ntimes)[itime]
+    return mean + std * (np.sin(xarr + time)[np.newaxis, :] + np.cos(yarr - time)[:, np.newaxis]) / 2
 
 
 def _generate_4d_data(ntimes, nlats, nlons, means, stds):
@@ -1143,32 +1152,56 @@ from mslib.mswms.demodata import (data, epsg_to_mpl_basemap_table,
             raise RuntimeError
 
         for standard_name in variables:
-            newvar = ecmwf.createVariable(standard_name, 'f4', dims)
+            # one chunk per horizontal field, which is written (and read for GetMap) in one go
+            chunksizes = (1,) * (len(dims) - 2) + (nlats, nlons)
+            newvar = ecmwf.createVariable(standard_name, 'f4', dims, chunksizes=chunksizes)
             newvar.standard_name = standard_name
             if len(dimvals) == 4:
-                test_data, unit = generate_field(coordinate, levels, standard_name, ntimes, nlats, nlons)
+                means, stds = get_profile(coordinate, levels, standard_name)
+                unit = _PROFILES[standard_name]["unit"]
             elif coordinate is None:
-                test_data, unit = generate_surface(standard_name, ntimes, nlats, nlons)
+                means, stds = _SURFACE[standard_name]["data"][0:1].T
+                unit = _SURFACE[standard_name]["unit"]
             else:
-                test_data, unit = generate_field(coordinate[0], [coordinate[1]], standard_name, ntimes, nlats, nlons)
-                test_data = test_data[:, 0, :, :]
+                means, stds = get_profile(coordinate[0], [coordinate[1]], standard_name)
+                unit = _PROFILES[standard_name]["unit"]
             newvar.units = unit
-            newvar[:] = test_data
+            # The field is written one horizontal slab at a time to keep the
+            # memory footprint independent of the number of times and levels.
+            for itime in range(ntimes):
+                for ilev, (mean, std) in enumerate(zip(means, stds)):
+                    test_data = _correct_data(
+                        standard_name, unit, _generate_2d_data(itime, ntimes, nlats, nlons, mean, std, ilev=ilev))
+                    if len(dimvals) == 4:
+                        newvar[itime, ilev, :, :] = test_data
+                    else:
+                        newvar[itime, :, :] = test_data
             newvar.grid_mapping = 'LatLon_Projection'
             newvar.missing_value = float('nan')
 
         ecmwf.close()
 
-    def create_data(self):
+    def create_data(self, resolution=1, num_levels=None, processes=1):
         """
         Method to generate all required model data for testing purposes.
+
+        :param resolution: horizontal grid spacing in degree
+        :param num_levels: number of pressure and model levels, the default set of levels is used if None
+        :param processes: number of processes generating files in parallel
         """
-        times, lats, lons = np.arange(0, 39, 6), np.arange(70, 30, -1), np.arange(-50, 50)
+        times = np.arange(0, 39, 6)
+        lats, lons = np.arange(70, 30, -resolution), np.arange(-50, 50, resolution)
+        if num_levels is None:
+            pressure_levels = np.array([30, 50, 70, 100, 150, 200, 250, 300, 400, 500, 600, 700, 800, 900])
+            model_levels = np.arange(0, 18)
+        else:
+            pressure_levels = np.geomspace(30, 900, num_levels)
+            model_levels = np.linspace(0, 17, num_levels)
 
+        files = []
         for coordinate, label, levtype, coord_levels, variables in (
                 ("air_pressure", "PRESSURE_LEVELS", "pl",
-                 ("atmosphere_pressure_coordinate",
-                  np.array([30, 50, 70, 100, 150, 200, 250, 300, 400, 500, 600, 700, 800, 900])),
+                 ("atmosphere_pressure_coordinate", pressure_levels),
                  ["air_potential_temperature", "air_pressure", "air_temperature",
                   "eastward_wind", "ertel_potential_vorticity", "geopotential_height",
                   "northward_wind", "specific_humidity", "lagrangian_tendency_of_air_pressure", "divergence_of_wind",
@@ -1186,9 +1219,9 @@ from mslib.mswms.demodata import (data, epsg_to_mpl_basemap_table,
                 ("air_potential_temperature", "THETA_LEVELS", "tl",
                  ("atmosphere_potential_temperature_coordinate", np.arange(300, 460, 20)),
                  ["air_pressure", "ertel_potential_vorticity", "mole_fraction_of_ozone_in_air"])):
-            self.generate_file(
+            files.append((
                 coordinate, label, levtype,
-                (("time", times), coord_levels, ("latitude", lats), ("longitude", lons)), variables)
+                (("time", times), coord_levels, ("latitude", lats), ("longitude", lons)), variables))
 
         for varname, standard_name in (
                 ("P_derived", "air_pressure"),
@@ -1207,20 +1240,36 @@ from mslib.mswms.demodata import (data, epsg_to_mpl_basemap_table,
                 ("THETA", "air_potential_temperature"),
                 ("O3", "mole_fraction_of_ozone_in_air"),
                 ("DIV", "divergence_of_wind")):
-            self.generate_file(
+            files.append((
                 "hybrid", varname, "ml",
-                (("time", times), ("hybrid", np.arange(0, 18)), ("latitude", lats), ("longitude", lons)),
-                [standard_name])
+                (("time", times), ("hybrid", model_levels), ("latitude", lats), ("longitude", lons)),
+                [standard_name]))
 
-        self.generate_file(
+        files.append((
             None, "SFC", "sfc", (("time", times), ("latitude", lats), ("longitude", lons)),
             [_x for _x in _SURFACE.keys() if _x not in [
-                "vertically_integrated_probability_of_wcb_occurrence", "solar_elevation_angle"]])
-        self.generate_file(
+                "vertically_integrated_probability_of_wcb_occurrence", "solar_elevation_angle"]]))
+        files.append((
             None, "ProbWCB_LAGRANTO_derived", "sfc", (("time", times), ("latitude", lats), ("longitude", lons)),
-            ["vertically_integrated_probability_of_wcb_occurrence"])
-        self.generate_file(
-            None, "SEA", "sfc", (("time", times), ("latitude", lats), ("longitude", lons)), ["solar_elevation_angle"])
+            ["vertically_integrated_probability_of_wcb_occurrence"]))
+        files.append((
+            None, "SEA", "sfc", (("time", times), ("latitude", lats), ("longitude", lons)), ["solar_elevation_angle"]))
+
+        if processes > 1:
+            # the large multi-variable files first for a better load balance
+            files.sort(key=lambda _x: -len(_x[4]) * (len(_x[3][1][1]) if len(_x[3]) == 4 else 1))
+            with multiprocessing.Pool(processes) as pool:
+                pool.starmap(_generate_file, [(self.data_fs.root_path,) + _x for _x in files], chunksize=1)
+        else:
+            for args in files:
+                self.generate_file(*args)
+
+
+def _generate_file(root_path, *args):
+    """
+    Helper for generating files in worker processes, see DataFiles.generate_file
+    """
+    DataFiles(data_fs=fs.open_fs(root_path)).generate_file(*args)
 
 
 def main():
@@ -1231,6 +1280,12 @@ def main():
     parser.add_argument("-v", "--version", help="show version", action="store_true", default=False)
     parser.add_argument("-s", "--seed", help="creates demodata for the mswms server",
                         action="store_true", default=False)
+    parser.add_argument("-r", "--resolution", help="horizontal grid spacing of the demodata in degree",
+                        type=float, default=1)
+    parser.add_argument("-l", "--levels", help="number of pressure and model levels of the demodata",
+                        type=int, default=None)
+    parser.add_argument("-p", "--processes", help="number of processes used to create the demodata",
+                        type=int, default=1)
     args = parser.parse_args()
     if args.version:
         print("***********************************************************************")
@@ -1247,7 +1302,7 @@ def main():
         examples = DataFiles(data_fs=fs.open_fs("~/mss/testdata"),
                              server_config_fs=fs.open_fs("~/mss"))
         examples.create_server_config(detailed_information=True)
-        examples.create_data()
+        examples.create_data(resolution=args.resolution, num_levels=args.levels, processes=args.processes)
         print("\nTo use this setup you need the mss_wms_settings.py in your python path e.g. \nexport PYTHONPATH=~/mss")
 
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.featureinfo
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Extraction of the values of data fields at a point for GetFeatureInfo
+    requests.
+
+    Instead of opening the data of every requested valid time through a plot
+    driver, each required data file is opened once and the column at the grid
+    point nearest to the requested position is read for all requested times
+    contained in the file in a single (strided) read. For data sets storing
+    all forecast steps of a run in one file, a time series is thus obtained
+    with one read per data field.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+from collections import OrderedDict
+
+import netCDF4
+import numpy as np
+
+from mslib import netCDF4tools
+from mslib.mswms.metrics import span
+
+
+def format_time(time):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def time_indices(indices):
+    """
+    Returns a slice for evenly spaced <indices>, so that they are read in one
+    strided access, and the list of indices otherwise.
+    """
+    if len(indices) == 1:
+        return slice(indices[0], indices[0] + 1)
+    steps = np.diff(indices)
+    if steps[0] > 0 and (steps == steps[0]).all():
+        return slice(indices[0], indices[-1] + 1, int(steps[0]))
+    return list(indices)
+
+
+def to_list(values):
+    """
+    Converts <values> to (nested) lists with None for missing values.
+    """
+    values = np.ma.masked_invalid(np.ma.asarray(values, dtype=float))
+    return values.tolist(None)
+
+
+def get_feature_info(data_access, plot_object, lat, lon, init_time, valid_times, level=None):
+    """
+    Returns the values of the data fields required by <plot_object> at the
+    grid point nearest to <lat>/<lon> for all <valid_times> as dictionary.
+
+    For fields with a vertical dimension, the value at the level nearest to
+    <level> is returned, or the whole column if <level> is None.
+    """
+    lon = ((lon + 180) % 360) - 180
+
+    # Determine which times of which fields are to be read from which file.
+    requests = OrderedDict()
+    for vartype, variable, _ in plot_object.required_datafields:
+        for valid_time in valid_times:
+            filename = data_access.get_filename(variable, vartype, init_time, valid_time, fullpath=True)
+            requests.setdefault(filename, OrderedDict()).setdefault((vartype, variable), []).append(valid_time)
+
+    result = OrderedDict([
+        ("lat", lat), ("lon", lon),
+        ("init_time", format_time(init_time) if init_time is not None else None),
+        ("times", [format_time(_x) for _x in valid_times]),
+        ("fields", OrderedDict())])
+    columns = {}
+    for filename, fields in requests.items():
+        logging.debug("reading point data from '%s'", filename)
+        with netCDF4.Dataset(filename) as dataset:
+            _, time_var = netCDF4tools.identify_CF_time(dataset)
+            times = list(netCDF4tools.num2date(time_var[:], time_var.units))
+            lat_data, lon_data, _ = netCDF4tools.get_latlon_data(dataset, autoreverse=False)
+            lat_index = int(np.abs(lat_data - lat).argmin())
+            lon_index = int(np.abs(((lon_data - lon + 180) % 360) - 180).argmin())
+            result.setdefault("grid_lat", float(lat_data[lat_index]))
+            result.setdefault("grid_lon", float(lon_data[lon_index]))
+            _, vert_var, _, vert_units, _ = netCDF4tools.identify_vertical_axis(dataset)
+
+            for (vartype, variable), field_times in fields.items():
+                _, var = netCDF4tools.identify_variable(dataset, variable, check=True)
+                try:
+                    indices, field_times = zip(*sorted((times.index(_x), _x) for _x in field_times))
+                except ValueError:
+                    raise ValueError(f"Valid times {field_times} are not available in '{filename}'.")
+                index = [time_indices(indices)]
+                levels = None
+                if len(var.shape) == 4:
+                    if vert_var is None:
+                        raise IOError(f"No vertical axis found for '{variable}' in '{filename}'.")
+                    vert_data = vert_var[:]
+                    if level is None:
+                        index.append(slice(None))
+                        levels = vert_data
+                    else:
+                        level_index = int(np.abs(vert_data - level).argmin())
+                        if abs(vert_data[level_index] - level) > 1e-3 * np.abs(np.diff(vert_data).mean()):
+                            raise ValueError("Requested elevation not available.")
+                        index.append(level_index)
+                        levels = vert_data[level_index:level_index + 1]
+                with span("read"):
+                    values = var[tuple(index + [lat_index, lon_index])]
+                column = columns.setdefault(variable, {})
+                column.update(zip(field_times, values))
+                if variable not in result["fields"]:
+                    result["fields"][variable] = OrderedDict([
+                        ("vartype", vartype),
+                        ("units", getattr(var, "units", None)),
+                        ("levels", to_list(levels) if levels is not None else None),
+                        ("level_units", vert_units if levels is not None else None)])
+
+    for variable, field in result["fields"].items():
+        field["values"] = [to_list(columns[variable][_x]) for _x in valid_times]
+    return result
@@ -24,14 +24,12 @@
 """
 
 import os
-from PIL import Image
 import io
+import hashlib
+import json
 import logging
-from matplotlib import pyplot as plt
 import defusedxml.ElementTree as etree
 import inspect
-from mslib.mswms.mpl_vsec import AbstractVerticalSectionStyle
-from mslib.mswms.mpl_lsec import AbstractLinearSectionStyle
 
 STATIC_LOCATION = ""
 try:
@@ -475,10 +473,49 @@ Make sure you have the required datafields ({', '.join(f'`{field[1]}`'for field
                 py.write(source)
 
 
+def plot_key(plot_object, filenames, parameters):
+    """
+    Returns a hash of the source code of the plot class and its base classes, of
+    the modification times of the data files and of the render parameters. A
+    plot needs to be regenerated if its key changes.
+    """
+    key = hashlib.sha1(repr(sorted(parameters.items())).encode("utf-8"))
+    for cls in type(plot_object).__mro__:
+        try:
+            key.update(inspect.getsource(cls).encode("utf-8"))
+        except (OSError, TypeError):
+            key.update(cls.__qualname__.encode("utf-8"))
+    for filename in sorted(set(filenames)):
+        key.update(f"{filename} {os.stat(filename).st_mtime_ns}".encode("utf-8"))
+    return key.hexdigest()
+
+
+def load_manifest(location):
+    """
+    Returns the manifest of the gallery plots in <location>, which maps the plot
+    file names to their key, the time of their generation and the seconds it took.
+    """
+    try:
+        with open(os.path.join(location, "plots", "manifest.json")) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(location, manifest):
+    if not os.path.exists(os.path.join(location, "plots")):
+        os.makedirs(os.path.join(location, "plots"))
+    with open(os.path.join(location, "plots", "manifest.json"), "w") as fid:
+        json.dump(manifest, fid, indent=1, sort_keys=True)
+
+
 def create_linear_plot(xml, file_location):
     """
     Draws a plot of the linear .xml output
     """
+    # Import here as pyplot is slow to import and only needed for the gallery
+    from matplotlib import pyplot as plt
+
     data = xml.find("Data")
     values = [float(value) for value in data.text.split(",")]
     unit = data.attrib["unit"]
@@ -497,6 +534,10 @@ def add_image(plot, plot_object, generate_code=False, sphinx=False, url_prefix="
     """
     # Import here due to some circular import issue if imported too soon
     from mslib.index import SCRIPT_NAME
+    # Import here as the style modules are slow to import and only needed for the gallery
+    from mslib.mswms.mpl_vsec import AbstractVerticalSectionStyle
+    from mslib.mswms.mpl_lsec import AbstractLinearSectionStyle
+    from PIL import Image
 
     if not os.path.exists(STATIC_LOCATION) and not sphinx:
         os.mkdir(STATIC_LOCATION)
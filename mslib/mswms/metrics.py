@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.metrics
+    ~~~~~~~~~~~~~~~~~~~
+
+    Lightweight timing spans and counters for the MSS WMS server.
+
+    Phases of a request (opening files, reading data, interpolation, preparing
+    data fields, rendering and encoding the image) are timed with span() and
+    aggregated into histograms per request type, layer, style and phase. The
+    collected values are rendered in the Prometheus text exposition format by
+    the /metrics endpoint of the WMS server.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+PHASE_METRIC = "mswms_phase_seconds"
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed durations.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns (upper bound, cumulative count) pairs including the +Inf bucket.
+        """
+        result, total = [], 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    Thread safe collection of timing histograms, counters and gauges.
+
+    Spans entered while a request scope is active on the same thread are summed
+    up per phase and recorded once when the scope ends, so that a phase which
+    is executed for several variables yields a single observation per request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def after_fork(self):
+        """
+        Replaces the lock in a forked process, as another thread of the parent
+        may have held it while forking.
+        """
+        self._lock = threading.Lock()
+
+    def _scope(self):
+        return getattr(self._local, "scope", None)
+
+    def observe(self, phase, seconds, request="", layer="", style=""):
+        key = (request, layer, style, phase)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def request_scope(self, request, layer, style):
+        """
+        Labels all spans of the current thread with request type, layer and style
+        and records the total time spent within the scope as phase "total".
+        """
+        outer = self._scope()
+        scope = {"labels": (request, layer, style or ""), "phases": defaultdict(float)}
+        self._local.scope = scope
+        start = time.perf_counter()
+        try:
+            yield scope
+        finally:
+            scope["phases"]["total"] = time.perf_counter() - start
+            self._local.scope = outer
+            for phase, seconds in scope["phases"].items():
+                self.observe(phase, seconds, *scope["labels"])
+            self.inc("mswms_requests_total", request=request, layer=layer)
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """
+        Times the enclosed block as <phase>.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            scope = self._scope()
+            if scope is not None:
+                scope["phases"][phase] += elapsed
+            else:
+                self.observe(phase, elapsed)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def cache_access(self, cache, hit):
+        """
+        Counts a hit or miss of the named cache.
+        """
+        self.inc("mswms_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def register_gauge(self, name, func, documentation=""):
+        """
+        Registers a callable that returns the current value of gauge <name>.
+        """
+        self._gauges[name] = (func, documentation)
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            histograms = {key: (hist.cumulative(), hist.sum, hist.count)
+                          for key, hist in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines.append(f"# HELP {PHASE_METRIC} Time spent per request phase, layer and style.")
+        lines.append(f"# TYPE {PHASE_METRIC} histogram")
+        for (request, layer, style, phase), (buckets, total, count) in sorted(histograms.items()):
+            labels = _format_labels(request=request, layer=layer, style=style, phase=phase)
+            for bound, value in buckets:
+                bucket_labels = _format_labels(request=request, layer=layer, style=style, phase=phase,
+                                               le="+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{PHASE_METRIC}_bucket{bucket_labels} {value}")
+            lines.append(f"{PHASE_METRIC}_sum{labels} {total!r}")
+            lines.append(f"{PHASE_METRIC}_count{labels} {count}")
+
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(**dict(labels))} {value!r}")
+
+        for name, (func, documentation) in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception as ex:
+                logging.debug("gauge '%s' failed: %s %s", name, type(ex), ex)
+                continue
+            if documentation:
+                lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(**labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+METRICS = MetricsRegistry()
+span = METRICS.span
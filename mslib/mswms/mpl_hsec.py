@@ -29,25 +29,40 @@
 # style definitions should be put in mpl_hsec_styles.py
 
 
+import collections
+import hashlib
 import io
 import logging
+import threading
 from abc import abstractmethod
 import mss_wms_settings
 
 import matplotlib as mpl
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 import mpl_toolkits.basemap as basemap
 import mpl_toolkits.axes_grid1
 import numpy as np
 import PIL.Image
 
 from mslib.mswms import mss_2D_sections
+from mslib.mswms.metrics import METRICS, span
 from mslib.utils import get_projection_params, convert_to
-from mslib.mswms.utils import make_cbar_labels_readable
+from mslib.mswms.utils import make_cbar_labels_readable, block_average, FIGURE_POOL
 
 
 BASEMAP_CACHE = {}
 BASEMAP_REQUESTS = []
+GRID_CACHE = collections.OrderedDict()
+# guards the caches above, as plots may be drawn by several threads, e.g. of a threaded WSGI server
+CACHE_LOCK = threading.Lock()
+
+
+def after_fork():
+    """
+    Replaces the lock of the caches in a forked process, as another thread of
+    the parent may have held it while forking.
+    """
+    global CACHE_LOCK
+    CACHE_LOCK = threading.Lock()
 
 
 class AbstractHorizontalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
@@ -77,7 +92,7 @@ class AbstractHorizontalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
                 contour, cax=axins1, orientation="vertical",
                 ticks=tick_levels, extend=extend, format=cb_format)
             axins1.yaxis.set_ticks_position(tick_position)
-            make_cbar_labels_readable(self.fig, axins1)
+            make_cbar_labels_readable(self.fig, axins1, height=self.fig_height)
 
 
 class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
@@ -88,6 +103,7 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
     name = "BASEMAP"
     title = "Matplotlib basemap"
     _plot_countries = True  # set to False in derived class to disable country plotting
+    _decimate = True  # set to False in derived class to always plot data on the native grid
 
     def _plot_style(self):
         """
@@ -225,9 +241,14 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
                       proj_params=None,
                       valid_time=None, init_time=None, style=None,
                       resolution=-1, noframe=False, show=False,
-                      transparent=False):
+                      transparent=False, window=None):
         """
         EPSG overrides proj_params!
+
+        For frameless plots, <window> (left, top, width, height) selects the
+        pixels of the figure of size <figsize> to be drawn, which are returned
+        as RGBA array instead of an image. This allows a large figure to be
+        drawn in tiles that seamlessly fit together, see encode_image.
         """
         if proj_params is None:
             proj_params = {"projection": "cyl"}
@@ -264,16 +285,28 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
 
         # Derive additional data fields and make the plot.
         logging.debug("preparing additional data fields..")
-        self._prepare_datafields()
+        with span("prepare"):
+            self._prepare_datafields()
 
         logging.debug("creating figure..")
+        pixels = figsize
         dpi = 80
         figsize = (figsize[0] / dpi), (figsize[1] / dpi)
         facecolor = "white"
-        fig = mpl.figure.Figure(figsize=figsize, dpi=dpi, facecolor=facecolor)
+        if window is not None and not noframe:
+            raise ValueError("Only frameless plots can be drawn in tiles.")
+        if window is None:
+            fig = FIGURE_POOL.acquire(figsize, dpi=dpi, facecolor=facecolor)
+        else:
+            fig = FIGURE_POOL.acquire((window[2] / dpi, window[3] / dpi), dpi=dpi, facecolor=facecolor)
         logging.debug("\twith frame and legends" if not noframe else
                       "\twithout frame")
-        if noframe:
+        if window is not None:
+            # place the axes of the whole figure such that the window is visible
+            left, top, width, height = window
+            ax = fig.add_axes([-left / width, (top + height - pixels[1]) / height,
+                               pixels[0] / width, pixels[1] / height])
+        elif noframe:
             ax = fig.add_axes([0.0, 0.0, 1.0, 1.0])
         else:
             ax = fig.add_axes([0.05, 0.05, 0.9, 0.88])
@@ -322,30 +355,37 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
             pass
         else:
             raise ValueError(f"bbox_units '{bbox_units}' not known.")
-        if basemap_use_cache and key in BASEMAP_CACHE:
-            bm = basemap.Basemap(resolution=None, **bm_params)
-            (bm.resolution, bm.coastsegs, bm.coastpolygontypes, bm.coastpolygons,
-             bm.coastsegs, bm.landpolygons, bm.lakepolygons, bm.cntrysegs) = BASEMAP_CACHE[key]
-            logging.debug("Loaded '%s' from basemap cache", key)
-        else:
-            bm = basemap.Basemap(resolution='l', **bm_params)
-            # read in countries manually, as those are laoded only on demand
-            bm.cntrysegs, _ = bm._readboundarydata("countries")
-            if basemap_use_cache:
-                BASEMAP_CACHE[key] = (bm.resolution, bm.coastsegs, bm.coastpolygontypes, bm.coastpolygons,
-                                      bm.coastsegs, bm.landpolygons, bm.lakepolygons, bm.cntrysegs)
+        cached = None
+        if basemap_use_cache:
+            with CACHE_LOCK:
+                METRICS.cache_access("basemap", key in BASEMAP_CACHE)
+                cached = BASEMAP_CACHE.get(key)
+        with span("basemap"):
+            if cached is not None:
+                bm = basemap.Basemap(resolution=None, **bm_params)
+                (bm.resolution, bm.coastsegs, bm.coastpolygontypes, bm.coastpolygons,
+                 bm.coastsegs, bm.landpolygons, bm.lakepolygons, bm.cntrysegs) = cached
+                logging.debug("Loaded '%s' from basemap cache", key)
+            else:
+                bm = basemap.Basemap(resolution='l', **bm_params)
+                # read in countries manually, as those are laoded only on demand
+                bm.cntrysegs, _ = bm._readboundarydata("countries")
         if basemap_use_cache:
-            BASEMAP_REQUESTS.append(key)
-            BASEMAP_REQUESTS[:] = BASEMAP_REQUESTS[-basemap_request_size:]
-
-            if len(BASEMAP_CACHE) > basemap_cache_size:
-                useful = {}
-                for idx, key in enumerate(BASEMAP_REQUESTS):
-                    useful[key] = useful.get(key, 0) + idx
-                least_useful = sorted([(value, key) for key, value in useful.items()])[:-basemap_cache_size]
-                for _, key in least_useful:
-                    del BASEMAP_CACHE[key]
-                    BASEMAP_REQUESTS[:] = [_x for _x in BASEMAP_REQUESTS if key != _x]
+            with CACHE_LOCK:
+                if cached is None:
+                    BASEMAP_CACHE[key] = (bm.resolution, bm.coastsegs, bm.coastpolygontypes, bm.coastpolygons,
+                                          bm.coastsegs, bm.landpolygons, bm.lakepolygons, bm.cntrysegs)
+                BASEMAP_REQUESTS.append(key)
+                BASEMAP_REQUESTS[:] = BASEMAP_REQUESTS[-basemap_request_size:]
+
+                if len(BASEMAP_CACHE) > basemap_cache_size:
+                    useful = {}
+                    for idx, key in enumerate(BASEMAP_REQUESTS):
+                        useful[key] = useful.get(key, 0) + idx
+                    least_useful = sorted([(value, key) for key, value in useful.items()])[:-basemap_cache_size]
+                    for _, key in least_useful:
+                        del BASEMAP_CACHE[key]
+                        BASEMAP_REQUESTS[:] = [_x for _x in BASEMAP_REQUESTS if key != _x]
 
         if self._plot_countries:
             # Set up the map appearance.
@@ -365,24 +405,38 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
 
         self.bm = bm  # !! BETTER PASS EVERYTHING AS PARAMETERS?
         self.fig = fig
-        self.shift_data()
-        self.mask_data()
-        self.lonmesh, self.latmesh = bm(*np.meshgrid(self.lons, self.lats))
-        self._plot_style()
+        # labels are sized by the height of the whole figure, also when drawing a tile of it
+        self.fig_height = pixels[1] if window is not None else None
+        with span("contour"):
+            self._decimate_data(pixels)
+            self._set_grid(repr((proj_params, bbox, bbox_units, noframe, figsize)))
+            self.shift_data()
+            self.mask_data()
+            self._plot_style()
 
         # Set transparency for the output image.
         if transparent:
             fig.patch.set_alpha(0.)
 
-        # Return the image as png embedded in a StringIO stream.
-        canvas = FigureCanvas(fig)
-        output = io.BytesIO()
-        canvas.print_png(output)
+        # Draw the figure into an RGBA array.
+        canvas = fig.canvas
+        with span("render"):
+            canvas.draw()
+            image = np.array(canvas.buffer_rgba())
 
         if show:
             logging.debug("saving figure to mpl_hsec.png ..")
             canvas.print_png("mpl_hsec.png")
+        FIGURE_POOL.release(fig)
+        if window is not None:
+            return image
+        return self.encode_image(image, transparent)
 
+    @staticmethod
+    def encode_image(image, transparent=False, facecolor="white"):
+        """
+        Encodes the RGBA array <image> as png.
+        """
         # Convert the image to an 8bit palette image with a significantly
         # smaller file size (~factor 4, from RGBA to one 8bit value, plus the
         # space to store the palette colours).
@@ -391,44 +445,106 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
         # requested, the figure face colour is stored as the "transparent"
         # colour in the image. This works in most cases, but might lead to
         # visible artefacts in some cases.
-        logging.debug("converting image to indexed palette.")
-        # Read the above stored png into a PIL image and create an adaptive
-        # colour palette.
-        output.seek(0)  # necessary for PIL.Image.open()
-        palette_img = PIL.Image.open(output).convert(mode="RGB").convert("P", palette=PIL.Image.ADAPTIVE)
-        output = io.BytesIO()
-        if not transparent:
-            logging.debug("saving figure as non-transparent PNG.")
-            palette_img.save(output, format="PNG")  # using optimize=True doesn't change much
-        else:
-            # If the image has a transparent background, we need to find the
-            # index of the background colour in the palette. See the
-            # documentation for PIL's ImagePalette module
-            # (http://www.pythonware.com/library/pil/handbook/imagepalette.htm). The
-            # idea is to create a 256 pixel image with the same colour palette
-            # as the original image and use it as a lookup-table. Converting the
-            # lut image back to RGB gives us a list of all colours in the
-            # palette. (Why doesn't PIL provide a method to directly access the
-            # colours in a palette??)
-            lut = palette_img.resize((256, 1))
-            lut.putdata(list(range(256)))
-            lut = [c[1] for c in lut.convert("RGB").getcolors()]
-            facecolor_rgb = list(mpl.colors.hex2color(mpl.colors.cnames[facecolor]))
-            for i in [0, 1, 2]:
-                facecolor_rgb[i] = int(facecolor_rgb[i] * 255)
-            try:
-                facecolor_index = lut.index(tuple(facecolor_rgb))
-                logging.debug("saving figure as transparent PNG with transparency index %s.", facecolor_index)
-                palette_img.save(output, format="PNG", transparency=facecolor_index)
-            except ValueError:
-                logging.debug("transparency requested but not possible, saving non-transparent instead")
-                palette_img.save(output, format="PNG")
+        with span("encode"):
+            logging.debug("converting image to indexed palette.")
+            # Create an adaptive colour palette from the drawn image.
+            palette_img = PIL.Image.fromarray(image).convert(mode="RGB").convert(
+                "P", palette=PIL.Image.ADAPTIVE)
+            output = io.BytesIO()
+            if not transparent:
+                logging.debug("saving figure as non-transparent PNG.")
+                palette_img.save(output, format="PNG")  # using optimize=True doesn't change much
+            else:
+                # If the image has a transparent background, we need to find the
+                # index of the background colour in the palette. See the
+                # documentation for PIL's ImagePalette module
+                # (http://www.pythonware.com/library/pil/handbook/imagepalette.htm). The
+                # idea is to create a 256 pixel image with the same colour palette
+                # as the original image and use it as a lookup-table. Converting the
+                # lut image back to RGB gives us a list of all colours in the
+                # palette. (Why doesn't PIL provide a method to directly access the
+                # colours in a palette??)
+                lut = palette_img.resize((256, 1))
+                lut.putdata(list(range(256)))
+                lut = [c[1] for c in lut.convert("RGB").getcolors()]
+                facecolor_rgb = list(mpl.colors.hex2color(mpl.colors.cnames[facecolor]))
+                for i in [0, 1, 2]:
+                    facecolor_rgb[i] = int(facecolor_rgb[i] * 255)
+                try:
+                    facecolor_index = lut.index(tuple(facecolor_rgb))
+                    logging.debug("saving figure as transparent PNG with transparency index %s.", facecolor_index)
+                    palette_img.save(output, format="PNG", transparency=facecolor_index)
+                except ValueError:
+                    logging.debug("transparency requested but not possible, saving non-transparent instead")
+                    palette_img.save(output, format="PNG")
 
         logging.debug("returning figure..")
         return output.getvalue()
 
-    def shift_data(self):
-        """Shift the data fields such that the longitudes are in the range
+    def _decimation_factors(self, pixels):
+        """
+        Returns the number of grid points in latitude and longitude direction
+        that may be averaged such that about two grid points per pixel of the
+        map remain.
+        """
+        if len(self.lats) < 2 or len(self.lons) < 2:
+            return 1, 1
+        dlat, dlon = np.abs(np.diff(self.lats)), np.abs(np.diff(self.lons))
+        if not (np.allclose(dlat, dlat[0], rtol=1e-3) and np.allclose(dlon, dlon[0], rtol=1e-3)):
+            return 1, 1
+        pixel_size = min((self.bm.urcrnrx - self.bm.llcrnrx) / pixels[0],
+                         (self.bm.urcrnry - self.bm.llcrnry) / pixels[1])
+        if self.bm.projection != "cyl":
+            # convert meters to degrees of latitude. This overestimates the size
+            # of a degree of longitude and thus stays on the safe side.
+            pixel_size /= 111195.
+        return max(1, int(pixel_size / (2 * dlat[0]))), max(1, int(pixel_size / (2 * dlon[0])))
+
+    def _decimate_data(self, pixels):
+        """
+        Block-averages the data fields and coordinates of grids that are much
+        finer than the pixels of the map, as contouring cost scales with the
+        number of grid points. <pixels> is the image size.
+        """
+        if not self._decimate or not getattr(mss_wms_settings, "hsec_decimation", True):
+            return
+        factors = self._decimation_factors(pixels)
+        if factors == (1, 1):
+            return
+        logging.debug("averaging data over blocks of %s grid points", factors)
+        for key in self.data:
+            self.data[key] = block_average(self.data[key], factors)
+        self.lats = block_average(self.lats, factors[:1]).data
+        self.lons = block_average(self.lons, factors[1:]).data
+        self.resolution = self.lats[1] - self.lats[0] if len(self.lats) > 1 else 0
+
+    def _set_grid(self, map_key):
+        """
+        Looks up the shifted longitudes, the longitude permutation, the mask and
+        the projected mesh of the data grid for the current map in the grid cache
+        or computes them. <map_key> identifies projection, bbox and figure layout.
+        """
+        grid_cache_size = getattr(mss_wms_settings, "grid_cache_size", 20)
+        key = (hashlib.sha1(np.asarray(self.lons).tobytes() + np.asarray(self.lats).tobytes()).hexdigest(),
+               len(self.lons), len(self.lats), map_key)
+        with CACHE_LOCK:
+            METRICS.cache_access("grid", key in GRID_CACHE)
+            grid = GRID_CACHE.get(key)
+            if grid is not None:
+                GRID_CACHE.move_to_end(key)
+        if grid is None:
+            grid = self._compute_grid()
+            with CACHE_LOCK:
+                GRID_CACHE[key] = grid
+                while len(GRID_CACHE) > grid_cache_size:
+                    GRID_CACHE.popitem(last=False)
+        self.lons, self.lon_indices, self._mask, self.lonmesh, self.latmesh = grid
+
+    def _compute_grid(self):
+        """
+        Computes the data grid transformation for the current map, see _set_grid.
+
+        The longitudes are shifted such that they are in the range
         left_longitude .. left_longitude+360, where left_longitude is the
         leftmost longitude appearing in the plot.
 
@@ -436,30 +552,9 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
         map covers a domain that crosses the data longitude boundaries
         (e.g. data is stored on a -180..180 grid, but a map in the range
         -200..-100 is requested).
-        """
-        # Shifting makes the grid irregular for stereographic and other projections
-        # in case the data is not global (i.e. covers 360 degrees).
-        if self.bm.projection in ['npstere', 'spstere', 'stere', 'lcc']:
-            return
-        # Determine the leftmost longitude in the plot.
-        axis = self.bm.ax.axis()
-        ulcrnrlon, ulcrnrlat = self.bm(axis[0], axis[3], inverse=True)
-        left_longitude = min(self.bm.llcrnrlon, ulcrnrlon)
-        logging.debug("shifting data grid to leftmost longitude in map %2.f..", left_longitude)
-
-        # Shift the longitude field such that the data is in the range
-        # left_longitude .. left_longitude+360.
-        self.lons = ((self.lons - left_longitude) % 360) + left_longitude
-        self.lon_indices = self.lons.argsort()
-        self.lons = self.lons[self.lon_indices]
-
-        # Shift data fields correspondingly.
-        for key in self.data:
-            self.data[key] = self.data[key][:, self.lon_indices]
 
-    def mask_data(self):
-        """Mask data arrays so that all values outside the map domain
-           are masked. This is required for clabel to work correctly.
+        The mask excludes all grid points outside the map domain. This is
+        required for clabel to work correctly.
 
         See:
         http://www.mail-archive.com/matplotlib-users@lists.sourceforge.net/msg02892.html
@@ -467,19 +562,55 @@ class MPLBasemapHorizontalSectionStyle(AbstractHorizontalSectionStyle):
 
         (mr, 2011-01-18)
         """
+        lons, lon_indices = self.lons, None
+        # Shifting makes the grid irregular for stereographic and other projections
+        # in case the data is not global (i.e. covers 360 degrees).
+        if self.bm.projection not in ['npstere', 'spstere', 'stere', 'lcc']:
+            # Determine the leftmost longitude in the plot.
+            axis = self.bm.ax.axis()
+            ulcrnrlon, ulcrnrlat = self.bm(axis[0], axis[3], inverse=True)
+            left_longitude = min(self.bm.llcrnrlon, ulcrnrlon)
+            logging.debug("shifting data grid to leftmost longitude in map %2.f..", left_longitude)
+
+            # Shift the longitude field such that the data is in the range
+            # left_longitude .. left_longitude+360.
+            lons = ((lons - left_longitude) % 360) + left_longitude
+            lon_indices = lons.argsort()
+            lons = lons[lon_indices]
+
         # compute native map projection coordinates of lat/lon grid.
-        lonmesh_, latmesh_ = np.meshgrid(self.lons, self.lats)
-        x, y = self.bm(lonmesh_, latmesh_)
+        lonmesh, latmesh = self.bm(*np.meshgrid(lons, self.lats))
         # test which coordinates are outside the map domain.
-
         add_x = (self.bm.xmax - self.bm.xmin) / 10
         add_y = (self.bm.ymax - self.bm.ymin) / 10
 
-        mask1 = x < self.bm.xmin - add_x
-        mask2 = x > self.bm.xmax + add_x
-        mask3 = y > self.bm.ymax + add_y
-        mask4 = y < self.bm.ymin - add_y
+        mask1 = lonmesh < self.bm.xmin - add_x
+        mask2 = lonmesh > self.bm.xmax + add_x
+        mask3 = latmesh > self.bm.ymax + add_y
+        mask4 = latmesh < self.bm.ymin - add_y
         mask = mask1 & mask2 & mask3 & mask4
-        # mask data arrays.
+
+        # the arrays are shared between requests
+        for array in (lons, lon_indices, lonmesh, latmesh):
+            if array is not None:
+                array.setflags(write=False)
+        return lons, lon_indices, mask, lonmesh, latmesh
+
+    def shift_data(self):
+        """
+        Shift the data fields according to the longitude permutation of the
+        current grid, see _set_grid.
+        """
+        if self.lon_indices is None:
+            return
+        for key in self.data:
+            self.data[key] = self.data[key][:, self.lon_indices]
+
+    def mask_data(self):
+        """
+        Mask data arrays so that all values outside the map domain
+        are masked, see _set_grid.
+        """
+        mask = self._mask.copy()
         for key in self.data:
             self.data[key] = np.ma.masked_array(self.data[key], mask=mask)
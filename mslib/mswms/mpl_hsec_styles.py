@@ -444,7 +444,7 @@ class HS_GenericStyle(MPLBasemapHorizontalSectionStyle):
                 ax, width="3%", height="40%", loc=cbar_location)
             self.fig.colorbar(tc, cax=axins1, orientation="vertical", format=cbar_format, ticks=ticks)
             axins1.yaxis.set_ticks_position(tick_pos)
-            make_cbar_labels_readable(self.fig, axins1)
+            make_cbar_labels_readable(self.fig, axins1, height=self.fig_height)
 
 
 def make_generic_class(name, entity, vert, add_data=None, add_contours=None,
@@ -1297,6 +1297,8 @@ class HS_LagrantoTrajStyle_PL_01(MPLBasemapHorizontalSectionStyle):
     """
     name = "PLLagrantoTraj"
     title = "Cirrus density, insitu red, mix blue, wcb colour (1E-6/km^2/hPa)"
+    # thin filaments of trajectory densities vanish when averaged
+    _decimate = False
 
     # Variables with the highest number of dimensions first (otherwise
     # MFDatasetCommonDims will throw an exception)!
@@ -32,6 +32,7 @@ import matplotlib as mpl
 from pint import Quantity
 
 from mslib.mswms import mss_2D_sections
+from mslib.mswms.metrics import span
 from mslib.utils import convert_to
 
 mpl.rcParams['xtick.direction'] = 'out'
@@ -88,7 +89,8 @@ class AbstractLinearSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
         self.init_time = init_time
 
         # Derive additional data fields and make the plot.
-        self._prepare_datafields()
+        with span("prepare"):
+            self._prepare_datafields()
 
         impl = getDOMImplementation()
         xmldoc = impl.createDocument(None, "MSS_LinearSection_Data", None)
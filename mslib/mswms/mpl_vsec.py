@@ -35,12 +35,12 @@ import numpy as np
 from abc import abstractmethod
 from xml.dom.minidom import getDOMImplementation
 import matplotlib as mpl
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 import mpl_toolkits.axes_grid1
 
 from mslib.mswms import mss_2D_sections
+from mslib.mswms.metrics import span
 from mslib.utils import convert_to, UR
-from mslib.mswms.utils import make_cbar_labels_readable
+from mslib.mswms.utils import make_cbar_labels_readable, FIGURE_POOL
 
 mpl.rcParams['xtick.direction'] = 'out'
 mpl.rcParams['ytick.direction'] = 'out'
@@ -194,7 +194,8 @@ class AbstractVerticalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
                     len(self.lats), axis=1)
 
         # Derive additional data fields and make the plot.
-        self._prepare_datafields()
+        with span("prepare"):
+            self._prepare_datafields()
         if "air_pressure" not in self.data:
             raise KeyError(
                 "'air_pressure' need to be available for VSEC plots."
@@ -208,7 +209,7 @@ class AbstractVerticalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
             dpi = 80
             figsize = (figsize[0] / dpi), (figsize[1] / dpi)
             facecolor = "white"
-            self.fig = mpl.figure.Figure(figsize=figsize, dpi=dpi, facecolor=facecolor)
+            self.fig = FIGURE_POOL.acquire(figsize, dpi=dpi, facecolor=facecolor)
             logging.debug("\twith frame and legends" if not noframe else
                           "\twithout frame")
             if noframe:
@@ -220,20 +221,23 @@ class AbstractVerticalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
             self.horizontal_coordinate = self.lat_inds[np.newaxis, :].repeat(
                 self.data["air_pressure"].shape[0], axis=0)
 
-            self._plot_style()
+            with span("contour"):
+                self._plot_style()
 
             # Set transparency for the output image.
             if transparent:
                 self.fig.patch.set_alpha(0.)
 
             # Return the image as png embedded in a StringIO stream.
-            canvas = FigureCanvas(self.fig)
+            canvas = self.fig.canvas
             output = io.BytesIO()
-            canvas.print_png(output)
+            with span("render"):
+                canvas.print_png(output)
 
             if show:
                 logging.debug("saving figure to mpl_vsec.png ..")
                 canvas.print_png("mpl_vsec.png")
+            FIGURE_POOL.release(self.fig)
 
             # Convert the image to an 8bit palette image with a significantly
             # smaller file size (~factor 4, from RGBA to one 8bit value, plus the
@@ -243,37 +247,38 @@ class AbstractVerticalSectionStyle(mss_2D_sections.Abstract2DSectionStyle):
             # requested, the figure face colour is stored as the "transparent"
             # colour in the image. This works in most cases, but might lead to
             # visible artefacts in some cases.
-            logging.debug("converting image to indexed palette.")
-            # Read the above stored png into a PIL image and create an adaptive
-            # colour palette.
-            output.seek(0)  # necessary for PIL.Image.open()
-            palette_img = PIL.Image.open(output).convert(
-                mode="RGB").convert("P", palette=PIL.Image.ADAPTIVE)
-            output = io.BytesIO()
-            if not transparent:
-                logging.debug("saving figure as non-transparent PNG.")
-                palette_img.save(output, format="PNG")  # using optimize=True doesn't change much
-            else:
-                # If the image has a transparent background, we need to find the
-                # index of the background colour in the palette. See the
-                # documentation for PIL's ImagePalette module
-                # (http://www.pythonware.com/library/pil/handbook/imagepalette.htm). The
-                # idea is to create a 256 pixel image with the same colour palette
-                # as the original image and use it as a lookup-table. Converting the
-                # lut image back to RGB gives us a list of all colours in the
-                # palette. (Why doesn't PIL provide a method to directly access the
-                # colours in a palette??)
-                lut = palette_img.resize((256, 1))
-                lut.putdata(list(range(256)))
-                lut = [c[1] for c in lut.convert("RGB").getcolors()]
-                facecolor_rgb = list(mpl.colors.hex2color(mpl.colors.cnames[facecolor]))
-                for i in [0, 1, 2]:
-                    facecolor_rgb[i] = int(facecolor_rgb[i] * 255)
-                facecolor_index = lut.index(tuple(facecolor_rgb))
-
-                logging.debug("saving figure as transparent PNG with transparency index %i.",
-                              facecolor_index)
-                palette_img.save(output, format="PNG", transparency=facecolor_index)
+            with span("encode"):
+                logging.debug("converting image to indexed palette.")
+                # Read the above stored png into a PIL image and create an adaptive
+                # colour palette.
+                output.seek(0)  # necessary for PIL.Image.open()
+                palette_img = PIL.Image.open(output).convert(
+                    mode="RGB").convert("P", palette=PIL.Image.ADAPTIVE)
+                output = io.BytesIO()
+                if not transparent:
+                    logging.debug("saving figure as non-transparent PNG.")
+                    palette_img.save(output, format="PNG")  # using optimize=True doesn't change much
+                else:
+                    # If the image has a transparent background, we need to find the
+                    # index of the background colour in the palette. See the
+                    # documentation for PIL's ImagePalette module
+                    # (http://www.pythonware.com/library/pil/handbook/imagepalette.htm). The
+                    # idea is to create a 256 pixel image with the same colour palette
+                    # as the original image and use it as a lookup-table. Converting the
+                    # lut image back to RGB gives us a list of all colours in the
+                    # palette. (Why doesn't PIL provide a method to directly access the
+                    # colours in a palette??)
+                    lut = palette_img.resize((256, 1))
+                    lut.putdata(list(range(256)))
+                    lut = [c[1] for c in lut.convert("RGB").getcolors()]
+                    facecolor_rgb = list(mpl.colors.hex2color(mpl.colors.cnames[facecolor]))
+                    for i in [0, 1, 2]:
+                        facecolor_rgb[i] = int(facecolor_rgb[i] * 255)
+                    facecolor_index = lut.index(tuple(facecolor_rgb))
+
+                    logging.debug("saving figure as transparent PNG with transparency index %i.",
+                                  facecolor_index)
+                    palette_img.save(output, format="PNG", transparency=facecolor_index)
 
             logging.debug("returning figure..")
             return output.getvalue()
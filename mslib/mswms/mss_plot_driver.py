@@ -29,13 +29,57 @@
 from datetime import datetime
 
 import logging
+import multiprocessing
 import os
+import threading
 from abc import ABCMeta, abstractmethod
 
 import numpy as np
 
 from mslib import netCDF4tools
 from mslib import utils
+from mslib.mswms.metrics import METRICS, span
+from mslib.mswms.sharedcache import SharedFieldCache
+
+try:
+    import mss_wms_settings
+except ImportError as ex:
+    logging.warning("Couldn't import mss_wms_settings (ImportError:'%s'), using default settings.", ex)
+
+    class mss_wms_settings(object):
+        pass
+
+# fields read by the drivers, shared by the worker processes of a host
+FIELD_CACHE = SharedFieldCache(getattr(mss_wms_settings, "shared_field_cache_size", 0),
+                               getattr(mss_wms_settings, "shared_field_cache_directory", None))
+
+# plot object, data and arguments of the plot whose tiles are drawn by forked processes
+_TILE_JOB = None
+_TILE_LOCK = threading.Lock()
+# pixels by which tiles overlap, so that lines and labels crossing a seam are drawn alike
+_TILE_MARGIN = 16
+
+
+def _init_tile_worker():
+    """
+    Initializes a process forked for drawing tiles. Locks that other threads
+    of the parent held while forking are never released, so they are replaced.
+    """
+    from mslib.mswms import mpl_hsec, utils as mswms_utils
+    METRICS.after_fork()
+    mswms_utils.FIGURE_POOL.after_fork()
+    mpl_hsec.after_fork()
+
+
+def _plot_tile(tile):
+    """
+    Draws the window of the plot prepared by HorizontalSectionDriver.plot_tiles
+    and returns the <rows> of it beginning at <start>.
+    """
+    window, start, rows = tile
+    plot_object, data, arguments = _TILE_JOB
+    image = plot_object.plot_hsection(dict(data), window=window, **arguments)
+    return image[start:start + rows]
 
 
 class MSSPlotDriver(metaclass=ABCMeta):
@@ -67,6 +111,8 @@ class MSSPlotDriver(metaclass=ABCMeta):
         self.dataset = None
         self.plot_object = None
         self.filenames = []
+        self.files_key = None
+        self.file_versions = None
 
     def __del__(self):
         """
@@ -113,13 +159,13 @@ class MSSPlotDriver(metaclass=ABCMeta):
         logging.debug("\trequested initialisation time %s", init_time)
         logging.debug("\trequested forecast valid time %s (step %s hrs)", fc_time, fc_step)
 
-        # Check if a dataset is open and if it contains the requested times.
-        # (a dataset will only be open if the used layer has not changed,
-        # i.e. the required variables have not changed as well).
-        if (self.dataset is not None) and (self.init_time == init_time) and (fc_time in self.times):
-            logging.debug("\tinit time correct and forecast valid time contained (%s).", fc_time)
-            if not self.data_access.is_reload_required(self.filenames):
-                return
+        # Check whether the files of an open dataset were modified before the
+        # filenames are determined, as this may update the data access already.
+        # Another driver sharing the data access may have caused the update, so
+        # compare the versions of the files, too.
+        if self.dataset is not None and (
+                self.data_access.is_reload_required(self.filenames) or
+                self.data_access.get_file_versions(self.filenames) != self.file_versions):
             logging.debug("need to re-open input files.")
             self.dataset.close()
             self.dataset = None
@@ -128,19 +174,39 @@ class MSSPlotDriver(metaclass=ABCMeta):
         # requested time:
 
         # Create the names of the files containing the required parameters.
-        self.filenames = []
+        filenames = []
         for vartype, var, _ in self.plot_object.required_datafields:
             filename = self.data_access.get_filename(
                 var, vartype, init_time, fc_time, fullpath=True)
-            if filename not in self.filenames:
-                self.filenames.append(filename)
+            if filename not in filenames:
+                filenames.append(filename)
             logging.debug("\tvariable '%s' requires input file '%s'",
                           var, os.path.basename(filename))
 
-        if len(self.filenames) == 0:
+        if len(filenames) == 0:
             raise ValueError("no files found that correspond to the specified "
                              "datafields. Aborting..")
 
+        grid_spacing = self._get_overview_grid_spacing()
+        if grid_spacing is not None:
+            filenames = self.data_access.get_overview_filenames(filenames, grid_spacing)
+
+        # Check if a dataset is open and if it contains the requested times.
+        # (a dataset will only be open if the used layer has not changed,
+        # i.e. the required variables have not changed as well).
+        if ((self.dataset is not None) and (self.init_time == init_time) and (fc_time in self.times) and
+                (self.filenames == filenames)):
+            logging.debug("\tinit time correct and forecast valid time contained (%s).", fc_time)
+            METRICS.cache_access("dataset", True)
+            return
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+        METRICS.cache_access("dataset", False)
+        self.filenames = filenames
+        self.file_versions = self.data_access.get_file_versions(self.filenames)
+
         self.init_time = init_time
 
         # Open NetCDF files as one dataset with common dimensions.
@@ -178,6 +244,8 @@ class MSSPlotDriver(metaclass=ABCMeta):
         self.vert_units = vert_units
 
         self.dataset = dataset
+        if FIELD_CACHE.enabled:
+            self.files_key = [(_x, os.stat(_x).st_mtime_ns) for _x in self.filenames]
         self.times = times
         self.lat_data = lat_data
         self.lon_data = lon_data
@@ -187,6 +255,13 @@ class MSSPlotDriver(metaclass=ABCMeta):
         # to the data fields required by the plot object.
         self._find_data_vars()
 
+    def _get_overview_grid_spacing(self):
+        """
+        Returns the coarsest grid spacing in degree that is sufficient for the
+        requested plot or None if the native grid shall be used.
+        """
+        return None
+
     def _find_data_vars(self):
         """
         Find NetCDF variables of required data fields.
@@ -205,6 +280,13 @@ class MSSPlotDriver(metaclass=ABCMeta):
             self.data_vars[df_name] = var
             self.data_units[df_name] = getattr(var, "units", None)
 
+    def _read_field(self, name, index, load):
+        """
+        Returns the data field <name> at <index> as read by <load>(). Fields are
+        shared with the other processes of the host by the FIELD_CACHE, if enabled.
+        """
+        return FIELD_CACHE.get((self.files_key, name, index), load)
+
     def have_data(self, plot_object, init_time, valid_time):
         """
         Checks if this driver has the required data to do the plot
@@ -251,7 +333,8 @@ class MSSPlotDriver(metaclass=ABCMeta):
         self.transparent = transparent
         self.return_format = return_format
 
-        self._set_time(init_time, valid_time)
+        with span("open"):
+            self._set_time(init_time, valid_time)
 
     @abstractmethod
     def update_plot_parameters(self, plot_object=None, figsize=None, style=None,
@@ -468,19 +551,25 @@ class VerticalSectionDriver(MSSPlotDriver):
         lon_data = lon_data[lon_indices]
 
         for name, var in self.data_vars.items():
-            if len(var.shape) == 4:
-                var_data = var[timestep, ::-self.vert_order, ::self.lat_order, :]
-            else:
-                var_data = var[:][timestep, np.newaxis, ::self.lat_order, :]
+            with span("read"):
+                if len(var.shape) == 4:
+                    var_data = self._read_field(
+                        name, (int(timestep), -self.vert_order, self.lat_order),
+                        lambda: var[timestep, ::-self.vert_order, ::self.lat_order, :])
+                else:
+                    var_data = self._read_field(
+                        name, (int(timestep), self.lat_order),
+                        lambda: var[:][timestep, np.newaxis, ::self.lat_order, :])
             logging.debug("\tLoaded %.2f Mbytes from data field <%s> at timestep %s.",
                           var_data.nbytes / 1048576., name, timestep)
             logging.debug("\tVertical dimension direction is %s.",
                           "up" if self.vert_order == 1 else "down")
             logging.debug("\tInterpolating to cross-section path.")
-            # Re-arange longitude dimension in the data field.
-            var_data = var_data[:, :, lon_indices]
-            data[name] = utils.interpolate_vertsec(var_data, self.lat_data, lon_data,
-                                                   self.lats, self.lons)
+            with span("interpolate"):
+                # Re-arange longitude dimension in the data field.
+                var_data = var_data[:, :, lon_indices]
+                data[name] = utils.interpolate_vertsec(var_data, self.lat_data, lon_data,
+                                                       self.lats, self.lons)
             # Free memory.
             del var_data
 
@@ -570,6 +659,8 @@ class HorizontalSectionDriver(MSSPlotDriver):
                             return_format="image/png"):
         """
         """
+        # the projection is required to select the overviews when opening the data
+        self.crs = crs
         MSSPlotDriver.set_plot_parameters(self, plot_object,
                                           init_time=init_time,
                                           valid_time=valid_time,
@@ -580,7 +671,6 @@ class HorizontalSectionDriver(MSSPlotDriver):
                                           return_format=return_format)
         self.level = level
         self.actual_level = None
-        self.crs = crs
         self.show = show
 
     def update_plot_parameters(self, plot_object=None, bbox=None, level=None, crs=None, init_time=None, valid_time=None,
@@ -603,6 +693,32 @@ class HorizontalSectionDriver(MSSPlotDriver):
                                  valid_time=valid_time, style=style, figsize=figsize, noframe=noframe, show=show,
                                  transparent=transparent, return_format=return_format)
 
+    def _get_overview_grid_spacing(self):
+        """
+        Returns half the size of a pixel of the requested map in degree, so
+        that about two grid points per pixel remain, see
+        MPLBasemapHorizontalSectionStyle._decimate_data. Sizes in meters are
+        converted using the size of a degree of latitude.
+        """
+        if (self.crs is None or self.bbox is None or not getattr(self.plot_object, "_decimate", True) or
+                not getattr(mss_wms_settings, "hsec_decimation", True)):
+            return None
+        try:
+            proj_params, bbox_units = [utils.get_projection_params(self.crs)[_x] for _x in ("basemap", "bbox")]
+        except ValueError:
+            return None
+        width = abs(self.bbox[2] - self.bbox[0]) / self.figsize[0]
+        height = abs(self.bbox[3] - self.bbox[1]) / self.figsize[1]
+        if bbox_units == "degree":
+            if proj_params.get("projection", "cyl") != "cyl":
+                # the corner longitudes do not determine the extent of the map
+                width = height
+        elif bbox_units.startswith("meter"):
+            width, height = width / 111195., height / 111195.
+        else:
+            return None
+        return min(width, height) / 2
+
     def _load_timestep(self):
         """
         Load the data fields as required by the horizontal section style
@@ -624,10 +740,12 @@ class HorizontalSectionDriver(MSSPlotDriver):
         for name, var in self.data_vars.items():
             if level is None or len(var.shape) == 3:
                 # 2D fields: time, lat, lon.
-                var_data = var[timestep, ::self.lat_order, :]
+                var_data = self._read_field(name, (int(timestep), None, self.lat_order),
+                                            lambda: var[timestep, ::self.lat_order, :])
             else:
                 # 3D fields: time, level, lat, lon.
-                var_data = var[timestep, level, ::self.lat_order, :]
+                var_data = self._read_field(name, (int(timestep), int(level), self.lat_order),
+                                            lambda: var[timestep, level, ::self.lat_order, :])
             logging.debug("\tLoaded %.2f Mbytes from data field <%s>.",
                           var_data.nbytes / 1048576., name)
             data[name] = var_data
@@ -645,32 +763,19 @@ class HorizontalSectionDriver(MSSPlotDriver):
         # section style instance. <data> is a dictionary containing the
         # horizontal sections of the variables identified through CF
         # standard names as specified by <self.hsec_style_instance>.
-        data = self._load_timestep()
+        with span("read"):
+            data = self._load_timestep()
 
         d2 = datetime.now()
         logging.debug("Loaded data (required time %s).", (d2 - d1))
         logging.debug("Plotting horizontal section.")
 
-        if len(self.lat_data) > 1:
-            resolution = (self.lat_data[1] - self.lat_data[0])
-        else:
-            resolution = 0
-
         # Call the plotting method of the horizontal section style instance.
-        image = self.plot_object.plot_hsection(data,
-                                               self.lat_data,
-                                               self.lon_data,
-                                               self.bbox,
-                                               level=self.actual_level,
-                                               valid_time=self.fc_time,
-                                               init_time=self.init_time,
-                                               resolution=resolution,
-                                               show=self.show,
-                                               crs=self.crs,
-                                               style=self.style,
-                                               noframe=self.noframe,
-                                               figsize=self.figsize,
-                                               transparent=self.transparent)
+        windows = self._tile_windows()
+        if windows is None:
+            image = self.plot_object.plot_hsection(data, **self._plot_hsection_arguments())
+        else:
+            image = self.plot_tiles(data, windows)
         # Free memory.
         del data
 
@@ -680,6 +785,89 @@ class HorizontalSectionDriver(MSSPlotDriver):
 
         return image
 
+    def _plot_hsection_arguments(self):
+        """
+        Returns the arguments of plot_hsection() besides the data for the
+        current time step.
+        """
+        if len(self.lat_data) > 1:
+            resolution = (self.lat_data[1] - self.lat_data[0])
+        else:
+            resolution = 0
+        return {"lats": self.lat_data, "lons": self.lon_data, "bbox": self.bbox, "level": self.actual_level,
+                "valid_time": self.fc_time, "init_time": self.init_time, "resolution": resolution,
+                "show": self.show, "crs": self.crs, "style": self.style, "noframe": self.noframe,
+                "figsize": self.figsize, "transparent": self.transparent}
+
+    def _tile_windows(self):
+        """
+        Returns the horizontal strips in which a large frameless plot is drawn by
+        separate processes as windows (left, top, width, height), extended by a
+        margin, together with the first row and number of rows of the strip in
+        the window. Returns None if the current plot is drawn at once.
+        """
+        min_pixels = getattr(mss_wms_settings, "tile_render_min_pixels", 0)
+        workers = getattr(mss_wms_settings, "tile_render_workers", 4)
+        width, height = [int(round(_x)) for _x in self.figsize]
+        if (min_pixels <= 0 or width * height < min_pixels or workers < 2 or not self.noframe or self.show or
+                self.return_format != "image/png" or "fork" not in multiprocessing.get_all_start_methods()):
+            return None
+        bounds = np.linspace(0, height, min(workers, height) + 1).round().astype(int)
+        windows = []
+        for top, bottom in zip(bounds[:-1], bounds[1:]):
+            window_top, window_bottom = max(0, top - _TILE_MARGIN), min(height, bottom + _TILE_MARGIN)
+            windows.append(((0, int(window_top), width, int(window_bottom - window_top)),
+                            int(top - window_top), int(bottom - top)))
+        return windows
+
+    def plot_tiles(self, data, windows):
+        """
+        Draws the plot of <data> in <windows> of the figure, see _tile_windows,
+        and returns the image stitched together from these tiles.
+
+        The tiles are drawn by processes forked after reading the data, so that
+        the data is shared instead of being read again or sent to the processes.
+        Each tile shows its part of the axes of the whole figure, so that the
+        stitched image equals the plot drawn at once. If the processes fail or
+        take longer than tile_render_timeout seconds, they are terminated and
+        the plot is drawn at once.
+        """
+        global _TILE_JOB
+        logging.debug("drawing %s tiles of %sx%s pixels", len(windows), *self.figsize)
+        timeout = getattr(mss_wms_settings, "tile_render_timeout", 60)
+        arguments = self._plot_hsection_arguments()
+        tiles = None
+        with _TILE_LOCK:
+            _TILE_JOB = (self.plot_object, data, arguments)
+            try:
+                # the pool terminates its processes on leaving the context
+                with span("render"), multiprocessing.get_context("fork").Pool(
+                        len(windows), initializer=_init_tile_worker) as pool:
+                    tiles = pool.map_async(_plot_tile, windows).get(timeout)
+            except Exception as ex:
+                logging.error("Drawing %s tiles failed, drawing the plot at once: %s %s", len(windows), type(ex), ex)
+            finally:
+                _TILE_JOB = None
+        if tiles is None:
+            with span("render"):
+                return self.plot_object.plot_hsection(data, **arguments)
+        return self.plot_object.encode_image(np.concatenate(tiles, axis=0), arguments["transparent"])
+
+    def plot_frames(self, valid_times):
+        """
+        Plots the section specified by the current plot parameters for each of
+        <valid_times> and returns the list of images.
+
+        The frames are read and drawn one after the other, reusing the open
+        dataset, as matplotlib is not thread-safe. Large frames are drawn in
+        tiles, see plot_tiles.
+        """
+        images = []
+        for valid_time in valid_times:
+            self.update_plot_parameters(valid_time=valid_time)
+            images.append(self.plot())
+        return images
+
 
 class LinearSectionDriver(VerticalSectionDriver):
     """
@@ -781,19 +969,24 @@ class LinearSectionDriver(VerticalSectionDriver):
         for name in variables:
             var = self.data_vars[name]
             data[name] = []
-            if len(var.shape) == 4:
-                var_data = var[timestep, ::-self.vert_order, ::self.lat_order, :]
-            else:
-                var_data = var[:][timestep, np.newaxis, ::self.lat_order, :]
+            with span("read"):
+                if len(var.shape) == 4:
+                    var_data = self._read_field(
+                        name, (int(timestep), -self.vert_order, self.lat_order),
+                        lambda: var[timestep, ::-self.vert_order, ::self.lat_order, :])
+                else:
+                    var_data = self._read_field(
+                        name, (int(timestep), self.lat_order),
+                        lambda: var[:][timestep, np.newaxis, ::self.lat_order, :])
             logging.debug("\tLoaded %.2f Mbytes from data field <%s> at timestep %s.",
                           var_data.nbytes / 1048576., name, timestep)
             logging.debug("\tVertical dimension direction is %s.",
                           "up" if self.vert_order == 1 else "down")
             logging.debug("\tInterpolating to cross-section path.")
-            # Re-arange longitude dimension in the data field.
-            var_data = var_data[:, :, lon_indices]
-
-            cross_section = utils.interpolate_vertsec(var_data, self.lat_data, lon_data, self.lats, self.lons)
+            with span("interpolate"):
+                # Re-arange longitude dimension in the data field.
+                var_data = var_data[:, :, lon_indices]
+                cross_section = utils.interpolate_vertsec(var_data, self.lat_data, lon_data, self.lats, self.lons)
             # Create vertical interpolation factors and indices for subsequent variables
             # TODO: Improve performance for this interpolation in general
             if len(factors) == 0:
@@ -30,6 +30,8 @@ import logging
 import sys
 
 from mslib import __version__
+from mslib.mswms.optimize import optimize_files
+from mslib.mswms.overviews import FACTORS, create_overviews
 from mslib.mswms.wms import mss_wms_settings, server
 from mslib.mswms.wms import app as application
 from mslib.utils import setup_logging, Updater, Worker
@@ -50,7 +52,7 @@ def main():
     subparsers = parser.add_subparsers(help='Available actions', dest='action')
     gallery = subparsers.add_parser("gallery", help="Subcommands surrounding the gallery")
     gallery.add_argument("--create", action="store_true", default=False,
-                         help="Generates plots of all layers not already present")
+                         help="Generates plots of all layers not already present or outdated")
     gallery.add_argument("--clear", action="store_true", default=False,
                          help="Deletes all plots and corresponding code")
     gallery.add_argument("--refresh", action="store_true", default=False,
@@ -62,6 +64,27 @@ def main():
                          help="Normally the plot images should appear at the relative url /static/plots/*.png.\n"
                               "In case they are prefixed by something, e.g. /demo/static/plots/*.png,"
                               " please provide the prefix /demo here.")
+    gallery.add_argument("--workers", type=int, default=None,
+                         help="number of processes drawing the plots, by default the number of CPUs")
+
+    overviews = subparsers.add_parser("overviews", help="Creates block-averaged overviews of the data files")
+    overviews.add_argument("--factors", type=int, nargs="+", default=list(FACTORS),
+                           help="averaging factors of the overviews, e.g. 2 4 8")
+    overviews.add_argument("--force", action="store_true", default=False,
+                           help="Regenerates overviews that are up to date")
+
+    optimize = subparsers.add_parser("optimize", help="Rewrites data files with a chunking optimised for MSS")
+    optimize.add_argument("path", help="directory containing the data files")
+    optimize.add_argument("--domain-id", default="", help="only rewrite files whose name contains this string")
+    optimize.add_argument("--output", default=None,
+                          help="write the rewritten files to this directory instead of replacing the originals")
+    optimize.add_argument("--layout", choices=["hsec", "vsec"], default="hsec",
+                          help="chunk one level of the full field (hsec) or all levels of lat/lon tiles (vsec)")
+    optimize.add_argument("--tile", type=int, default=32, help="size of the lat/lon tiles of the vsec layout")
+    optimize.add_argument("--zlib", action="store_true", default=False, help="compress the data fields")
+    optimize.add_argument("--complevel", type=int, default=4, help="zlib compression level")
+    optimize.add_argument("--float32", action="store_true", default=False,
+                          help="store double precision data fields as single precision")
 
     args = parser.parse_args()
 
@@ -88,10 +111,23 @@ def main():
     if args.action == "gallery":
         create = args.create or args.refresh
         clear = args.clear or args.refresh
-        server.generate_gallery(create, clear, args.show_code, url_prefix=args.url_prefix)
+        server.generate_gallery(create, clear, args.show_code, url_prefix=args.url_prefix, workers=args.workers)
         logging.info("Gallery generation done.")
         sys.exit()
 
+    if args.action == "overviews":
+        for name, data_access in mss_wms_settings.data.items():
+            logging.info("Creating overviews of dataset '%s'", name)
+            create_overviews(data_access, args.factors, force=args.force)
+        logging.info("Overview generation done.")
+        sys.exit()
+
+    if args.action == "optimize":
+        optimize_files(args.path, domain_id=args.domain_id, output=args.output, layout=args.layout,
+                       tile=args.tile, zlib=args.zlib, complevel=args.complevel, float32=args.float32)
+        logging.info("Optimization done.")
+        sys.exit()
+
     updater.on_update_available.connect(lambda old, new: logging.info(f"MSS can be updated from {old} to {new}.\nRun"
                                                                       " the --update argument to update the server."))
     updater.run()
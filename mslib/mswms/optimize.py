@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.optimize
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Rewrites data files into a layout that is fast to read for the MSS WMS.
+
+    The plot drivers read one time step of a field at a time, either a single
+    level for horizontal sections or all levels for vertical and linear
+    sections. Files are rewritten as NETCDF4_CLASSIC with chunks of one time step
+    and one level of the full horizontal field ("hsec" layout) or of all levels
+    of lat/lon tiles ("vsec" layout). Optionally, fields are compressed with zlib
+    and double precision fields are stored as single precision:
+
+        mswms optimize /data/ecmwf --domain-id EUR_LL015 --zlib --float32
+
+    Each rewritten file is checked to yield the same entries in the file tree of
+    the DefaultDataAccess as the original before it replaces it.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+import netCDF4
+import numpy as np
+
+from mslib import netCDF4tools
+from mslib.mswms.dataaccess import DefaultDataAccess
+from mslib.mswms.overviews import parse_overview_filename
+
+
+def file_entry(path):
+    """
+    Returns the description of the file <path> as used by the DefaultDataAccess
+    to build its file tree.
+    """
+    return DefaultDataAccess(os.path.dirname(path), "")._parse_file(os.path.basename(path))
+
+
+def compare_entries(entry, reference):
+    """
+    Returns a list of differences between two results of file_entry.
+    """
+    differences = []
+    for key in ("vert_type", "init_time", "valid_times"):
+        if list(np.atleast_1d(entry[key])) != list(np.atleast_1d(reference[key])):
+            differences.append(key)
+    if sorted(entry["standard_names"]) != sorted(reference["standard_names"]):
+        differences.append("standard_names")
+    levels, reference_levels = entry["elevations"]["levels"], reference["elevations"]["levels"]
+    if (entry["elevations"]["units"] != reference["elevations"]["units"] or
+            len(levels) != len(reference_levels) or not np.allclose(levels, reference_levels)):
+        differences.append("elevations")
+    if not np.isclose(entry["grid_spacing"], reference["grid_spacing"]):
+        differences.append("grid_spacing")
+    return differences
+
+
+def chunk_sizes(var, lat_name, lon_name, layout="hsec", tile=32):
+    """
+    Returns the chunk shape of a (time, [level,] lat, lon) variable or None for
+    other variables.
+    """
+    if len(var.dimensions) < 3 or var.dimensions[-2:] != (lat_name, lon_name):
+        return None
+    shape = list(var.shape)
+    chunks = [1] * (len(shape) - 2) + shape[-2:]
+    if layout == "vsec":
+        chunks[1:-2] = shape[1:-2]
+        chunks[-2:] = [min(tile, _x) for _x in shape[-2:]]
+    return [max(1, _x) for _x in chunks]
+
+
+def rewrite_file(source, target, layout="hsec", tile=32, zlib=False, complevel=4, float32=False):
+    """
+    Copies the NetCDF file <source> to <target> using the chunking of <layout>.
+    Fields are copied one chunk row at a time to limit the memory usage.
+    """
+    with netCDF4.Dataset(source) as src, netCDF4.Dataset(target, "w", format="NETCDF4_CLASSIC") as dst:
+        lat_name, _, lon_name, _ = netCDF4tools.identify_CF_lonlat(src)
+        dst.setncatts({_x: src.getncattr(_x) for _x in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            chunks = chunk_sizes(var, lat_name, lon_name, layout=layout, tile=tile)
+            dtype = var.dtype
+            if float32 and chunks is not None and dtype == np.float64:
+                dtype = np.dtype(np.float32)
+            fill_value = getattr(var, "_FillValue", None)
+            if fill_value is not None:
+                fill_value = np.array(fill_value).astype(dtype)
+            kwargs = {"fill_value": fill_value}
+            if chunks is not None:
+                kwargs.update({"chunksizes": chunks, "zlib": zlib, "complevel": complevel, "shuffle": zlib})
+            out = dst.createVariable(name, dtype, var.dimensions, **kwargs)
+            out.setncatts({_x: var.getncattr(_x) for _x in var.ncattrs() if _x != "_FillValue"})
+            if chunks is None:
+                out[:] = var[:]
+            else:
+                for index in np.ndindex(var.shape[:-2] if layout == "hsec" else var.shape[:1]):
+                    out[index] = var[index]
+
+
+def optimize_files(path, domain_id="", output=None, verify=True, **kwargs):
+    """
+    Rewrites all data files in <path> whose name contains <domain_id>. The
+    files are replaced unless an <output> directory is given. Returns a list of
+    (filename, original size, new size) tuples. Files whose file tree entries
+    change are left untouched and reported as error.
+    """
+    output = output or path
+    os.makedirs(output, exist_ok=True)
+    results = []
+    for filename in sorted(os.listdir(path)):
+        source = os.path.join(path, filename)
+        if (domain_id not in filename or not os.path.isfile(source) or
+                parse_overview_filename(filename) is not None):
+            continue
+        try:
+            reference = file_entry(source)
+        except (IOError, OSError) as ex:
+            logging.error("Skipping file '%s' (%s: %s)", filename, type(ex), ex)
+            continue
+        size = os.path.getsize(source)
+        handle, temporary = tempfile.mkstemp(dir=output, prefix=".mss_optimize_", suffix=".nc")
+        os.close(handle)
+        try:
+            logging.info("Rewriting '%s'", filename)
+            try:
+                rewrite_file(source, temporary, **kwargs)
+                differences = compare_entries(file_entry(temporary), reference) if verify else []
+            except (IOError, OSError, RuntimeError, TypeError, ValueError) as ex:
+                logging.error("Skipping file '%s' (%s: %s)", filename, type(ex), ex)
+                continue
+            if differences:
+                logging.error("Skipping file '%s': rewritten file differs in %s", filename, differences)
+                continue
+            shutil.move(temporary, os.path.join(output, filename))
+            new_size = os.path.getsize(os.path.join(output, filename))
+            logging.info("Rewrote '%s' (%.1f MB -> %.1f MB)", filename, size / 1048576., new_size / 1048576.)
+            results.append((filename, size, new_size))
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    return results
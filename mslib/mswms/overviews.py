@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.overviews
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Precomputed overviews of the horizontal data fields.
+
+    An overview of a data file is a copy in which all fields are block-averaged
+    over factor x factor grid points in latitude and longitude; all other
+    dimensions and variables are kept. Overviews are stored next to the
+    original file, e.g. "<name>.ovr4.nc" for "<name>.nc", and are used by the
+    DefaultDataAccess to serve maps that do not need the full grid resolution:
+
+        mswms overviews --factors 2 4 8
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import logging
+import os
+import re
+
+import netCDF4
+import numpy as np
+
+from mslib import netCDF4tools
+from mslib.mswms.utils import block_average
+
+
+FACTORS = (2, 4, 8)
+
+_OVERVIEW_PATTERN = re.compile(r"^(?P<stem>.+)\.ovr(?P<factor>\d+)(?P<ext>\.[^.]+)?$")
+
+
+def overview_filename(filename, factor):
+    """
+    Returns the name of the overview of <filename> for <factor>.
+    """
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.ovr{factor:d}{ext}"
+
+
+def parse_overview_filename(filename):
+    """
+    Returns the name of the original file and the factor if <filename> is an
+    overview, otherwise None.
+    """
+    match = _OVERVIEW_PATTERN.match(filename)
+    if match is None:
+        return None
+    return match.group("stem") + (match.group("ext") or ""), int(match.group("factor"))
+
+
+def overview_source(filename):
+    """
+    Returns the name of the original file of an overview or <filename> itself.
+    """
+    parsed = parse_overview_filename(filename)
+    return filename if parsed is None else parsed[0]
+
+
+def write_overview(source, target, factor):
+    """
+    Writes the overview of the NetCDF file <source> for <factor> to <target>.
+    Fields are processed one horizontal slab at a time, so that large files
+    do not need to fit into memory.
+    """
+    temporary = target + ".tmp"
+    with netCDF4.Dataset(source) as src, netCDF4.Dataset(temporary, "w", format=src.data_model) as dst:
+        lat_name, _, lon_name, _ = netCDF4tools.identify_CF_lonlat(src)
+        dst.setncatts(src.__dict__)
+        dst.mss_overview_factor = factor
+        for name, dim in src.dimensions.items():
+            size = len(dim)
+            if name in (lat_name, lon_name):
+                size = -(-size // factor)
+            dst.createDimension(name, None if dim.isunlimited() else size)
+
+        for name, var in src.variables.items():
+            horizontal = var.dimensions[-2:] == (lat_name, lon_name)
+            if not horizontal and var.dimensions not in ((), (lat_name,), (lon_name,)) and \
+                    (lat_name in var.dimensions or lon_name in var.dimensions):
+                logging.warning("Skipping variable '%s' in '%s': unsupported dimensions %s",
+                                name, source, var.dimensions)
+                continue
+            attributes = {_x: var.getncattr(_x) for _x in var.ncattrs() if _x != "_FillValue"}
+            out = dst.createVariable(name, var.dtype, var.dimensions, zlib=True,
+                                     fill_value=getattr(var, "_FillValue", None))
+            out.setncatts(attributes)
+            if var.dimensions in ((lat_name,), (lon_name,)):
+                out[:] = block_average(var[:], (factor,)).data
+            elif horizontal:
+                for index in np.ndindex(var.shape[:-2]):
+                    out[index] = block_average(var[index], (factor, factor))
+            else:
+                out[:] = var[:]
+    os.replace(temporary, target)
+
+
+def create_overviews(data_access, factors=FACTORS, force=False):
+    """
+    Creates the overviews of all files of <data_access> that are missing or
+    older than the file itself. Returns the names of the written files.
+    """
+    data_access.setup()
+    root_path = data_access.get_datapath()
+    written = []
+    for filename in data_access.get_all_datafiles():
+        source = os.path.join(root_path, filename)
+        for factor in factors:
+            target = os.path.join(root_path, overview_filename(filename, factor))
+            if (not force and os.path.exists(target) and
+                    os.path.getmtime(target) >= os.path.getmtime(source)):
+                logging.debug("Overview '%s' is up to date", target)
+                continue
+            logging.info("Writing overview '%s'", target)
+            write_overview(source, target, factor)
+            written.append(target)
+    return written
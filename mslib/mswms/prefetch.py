@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.prefetch
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Speculative rendering of the plots a client is likely to request next.
+
+    After a GetMap request for a valid time and level, the next request of the
+    same client is mostly for a neighbouring time step or level. The
+    Prefetcher renders such neighbours in a background thread while the server
+    is idle and keeps the responses in a memory limited cache, from which the
+    following requests are answered.
+
+    Which neighbours are worth rendering is learned from the request sequences:
+    if a request matches one of the neighbours of the previous request of the
+    same client, the count of this direction (e.g. "time+1") is increased. The
+    most frequent directions are prefetched.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from mslib.mswms.metrics import METRICS
+from mslib.mswms.singleflight import SingleFlight
+
+DIRECTIONS = ["time+1", "time-1", "level+1", "level-1"]
+
+
+class Prefetcher(object):
+    """
+    Renders likely next requests in a background thread while no request is
+    being processed and caches the responses. The render function must not
+    share state with the requests, which are not held back by a running
+    prefetch render.
+    """
+
+    def __init__(self, render, neighbours, enabled=False, directions=None, count=2, max_bytes=64 * 1024 ** 2,
+                 interval=0.5, max_age=300., idle_delay=0.2, decay=0.98, max_clients=1000, version=None):
+        """
+        render: function rendering (query, mode) to (data, format)
+        neighbours: function returning the neighbouring queries of (query, mode) by direction
+        enabled: prefetch at all
+        directions: directions to consider, by default time and level steps
+        count: maximum number of neighbours prefetched after a request
+        max_bytes: memory budget of the cached responses
+        interval: minimum seconds between two prefetch renders
+        max_age: seconds after which cached responses and pending renders are discarded
+        idle_delay: seconds without requests before rendering
+        decay: factor by which older observations are weighted less per request
+        max_clients: number of clients whose last request is remembered
+        version: function returning a value identifying the data and configuration a
+                 response of (query, mode) depends on, e.g. its ETag, or None if unknown;
+                 cached responses are only returned while it is unchanged
+        """
+        self.render = render
+        self.neighbours = neighbours
+        self.enabled = enabled
+        self.directions = list(directions if directions is not None else DIRECTIONS)
+        self.count = count
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.max_age = max_age
+        self.idle_delay = idle_delay
+        self.decay = decay
+        self.max_clients = max_clients
+        self.version = version
+        self.scores = {_x: 0. for _x in self.directions}
+        self._last = OrderedDict()
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._jobs = deque()
+        self._active = 0
+        self._rendering = False
+        self._last_request = 0.
+        self._last_render = 0.
+        self._thread = None
+        self._stopped = False
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def request(self):
+        """
+        Context of a request being processed. Holds back further prefetch
+        renders until the server is idle again; a running one is not waited for.
+        """
+        if not self.enabled:
+            yield
+            return
+        with self._condition:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._last_request = time.monotonic()
+                self._condition.notify_all()
+
+    def get(self, key, query=None, mode=None):
+        """
+        Returns the prefetched response of <key> or None. The request <query>
+        and <mode> of <key> are required to check the version of the response.
+        """
+        if not self.enabled:
+            return None
+        with self._condition:
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.max_age:
+                self._remove(key)
+                entry = None
+        if entry is not None and self.version is not None and self.version(query, mode) != entry[3]:
+            # the data changed since the response was rendered
+            with self._condition:
+                if self._cache.get(key) is entry:
+                    self._remove(key)
+            entry = None
+        if entry is not None:
+            with self._condition:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+        METRICS.cache_access("prefetch", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def observe(self, client, query, mode):
+        """
+        Learns from the request <query> of <client> and schedules the renders of
+        its most likely successors, replacing the pending renders of <client>.
+        """
+        if not self.enabled:
+            return
+        key = SingleFlight.key(query, mode)
+        try:
+            neighbours = self.neighbours(query, mode)
+        except Exception as ex:
+            logging.debug("no neighbours for prefetching: %s %s", type(ex), ex)
+            neighbours = {}
+        neighbours = OrderedDict(
+            (_x, neighbours[_x]) for _x in self.directions if _x in neighbours)
+        with self._condition:
+            previous = self._last.pop(client, {})
+            if previous:
+                for direction in self.scores:
+                    self.scores[direction] *= self.decay
+                if key in previous:
+                    self.scores[previous[key]] += 1
+            self._last[client] = OrderedDict(
+                (SingleFlight.key(_query, mode), _direction) for _direction, _query in neighbours.items())
+            while len(self._last) > self.max_clients:
+                self._last.popitem(last=False)
+
+            self._jobs = deque(_x for _x in self._jobs if _x[1] != client)
+            now = time.monotonic()
+            for direction in [_x for _x in self.ranking() if _x in neighbours][:self.count]:
+                neighbour = neighbours[direction]
+                neighbour_key = SingleFlight.key(neighbour, mode)
+                if neighbour_key not in self._cache and neighbour_key != key:
+                    self._jobs.append((now, client, neighbour_key, neighbour, mode))
+            if self._jobs:
+                self._start()
+                self._condition.notify_all()
+
+    def ranking(self):
+        """
+        Returns the directions ordered by how often clients moved this way
+        recently. Once any direction was taken, rarely taken ones are left out.
+        """
+        ranking = sorted(self.directions, key=lambda _x: -self.scores[_x])
+        best = max(self.scores.values(), default=0)
+        if best > 0:
+            ranking = [_x for _x in ranking if self.scores[_x] >= 0.1 * best]
+        return ranking
+
+    def cancel(self):
+        """
+        Discards all pending renders.
+        """
+        with self._condition:
+            self._jobs.clear()
+
+    def join(self, timeout=None):
+        """
+        Waits until all pending renders are done. Returns False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._jobs and not self._rendering, timeout)
+
+    def stop(self):
+        """
+        Discards all pending renders and stops the background thread.
+        """
+        with self._condition:
+            self._jobs.clear()
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        # threads do not survive forking, so check for a running thread
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="mswms-prefetch", daemon=True)
+            self._thread.start()
+
+    def _next_job(self):
+        """
+        Waits until a render is due and the server is idle and returns it,
+        or returns None if stopped.
+        """
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                now = time.monotonic()
+                while self._jobs and now - self._jobs[0][0] > self.max_age:
+                    self._jobs.popleft()
+                if not self._jobs:
+                    self._condition.wait()
+                    continue
+                wait = max(self._last_request + self.idle_delay, self._last_render + self.interval) - now
+                if self._active > 0 or wait > 0:
+                    self._condition.wait(wait if wait > 0 else None)
+                    continue
+                self._rendering = True
+                return self._jobs.popleft()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            _, _, key, query, mode = job
+            result = version = None
+            try:
+                if key not in self._cache:
+                    # determined before rendering, so that changes during it invalidate the response
+                    if self.version is not None:
+                        version = self.version(query, mode)
+                    result = self.render(query, mode)
+            except Exception as ex:
+                logging.debug("prefetching failed: %s %s", type(ex), ex)
+            finally:
+                with self._condition:
+                    self._rendering = False
+                    self._last_render = time.monotonic()
+                    if result is not None:
+                        self._store(key, result, version)
+                    self._condition.notify_all()
+
+    def _store(self, key, result, version=None):
+        data, _ = result
+        head = data[:512]
+        if isinstance(head, str):
+            head = head.encode("utf-8")
+        size = len(data)
+        if (size > self.max_bytes or b"<ServiceExceptionReport" in head or
+                (self.version is not None and version is None)):
+            return
+        METRICS.inc("mswms_prefetched_total")
+        self._remove(key)
+        self._cache[key] = (time.monotonic(), result, size, version)
+        self._cache_bytes += size
+        while self._cache_bytes > self.max_bytes:
+            self._remove(next(iter(self._cache)))
+
+    def _remove(self, key):
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self._cache_bytes -= entry[2]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.profiling
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Runs selected WMS requests under cProfile.
+
+    A request is profiled either if an administrator adds PROFILE=true to the
+    query or if it is picked by the sampling mode, which profiles every N-th
+    request of a layer. The statistics are stored as pstats files in the
+    configured directory and can be inspected with pstats, snakeviz or
+    converted into flame graphs with e.g. flameprof.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import contextlib
+import cProfile
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+
+class RequestProfiler(object):
+    """
+    Decides which requests are profiled and writes the collected statistics.
+
+    Only a single request is profiled at a time, as the interpreter supports
+    only one active profiler; requests arriving meanwhile are served normally.
+    """
+
+    def __init__(self, directory=None, sample_rate=0, admin_users=None):
+        """
+        directory: location for the pstats files, profiling is disabled if None
+        sample_rate: profile every sample_rate-th request, 0 disables sampling
+        admin_users: user names that may request profiling by PROFILE=true
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.admin_users = admin_users or []
+        self._count = 0
+        self._count_lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def is_selected(self, query, username=None):
+        """
+        Returns whether the request described by <query> shall be profiled.
+        """
+        if not self.directory:
+            return False
+        if query.get("PROFILE", "false").lower() == "true":
+            if username is not None and username in self.admin_users:
+                return True
+            logging.warning("PROFILE requested by unauthorized user '%s', ignoring it.", username)
+        if self.sample_rate > 0:
+            with self._count_lock:
+                self._count += 1
+                return self._count % self.sample_rate == 0
+        return False
+
+    @staticmethod
+    def request_key(query, mode):
+        """
+        Returns a file name stem identifying the request.
+        """
+        normalized = sorted((key.upper(), value) for key, value in query.items() if key.upper() != "PROFILE")
+        digest = hashlib.sha1(repr(normalized).encode("utf-8")).hexdigest()[:12]
+        layers = re.sub(r"[^\w.,-]", "_", query.get("LAYERS", ""))[:100]
+        return f"{datetime.utcnow():%Y%m%dT%H%M%S%f}_{mode}_{layers}_{digest}"
+
+    @contextlib.contextmanager
+    def profile(self, query, mode, username=None):
+        """
+        Profiles the enclosed block if the request is selected. Yields the
+        file name of the statistics or None.
+        """
+        if not self.is_selected(query, username) or not self._active.acquire(blocking=False):
+            yield None
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = self.request_key(query, mode)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield name + ".pstats"
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.directory, name + ".pstats"))
+                with open(os.path.join(self.directory, name + ".json"), "w") as fid:
+                    json.dump({"mode": mode, "user": username, "query": dict(query.items())}, fid, indent=1)
+                logging.info("stored profile of %s request in '%s'.", mode, name)
+        finally:
+            self._active.release()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.sharedcache
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cache of data fields in shared memory for the worker processes of a host.
+
+    The fields read by the plot drivers are stored in POSIX shared memory
+    segments. An index file, guarded by a file lock, maps the keys of the fields
+    to their segments. It is only rewritten when fields are added or removed;
+    lookups share the lock and record the use of a field in the modification
+    time of a file per field. If the total size exceeds the limit, the least
+    recently used fields are removed. Processes
+    reading a field that is already cached attach to its segment and use the
+    array without copying instead of reading and decoding the NetCDF file again.
+
+    Cached arrays are read-only, as they are shared by all processes.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from mslib.mswms.metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+# segments attached by this process and weak references to the arrays using them
+_SEGMENTS = {}
+_SEGMENTS_LOCK = threading.Lock()
+
+
+def _untrack(segment):
+    """
+    Stops the resource tracker of this process from removing <segment> when
+    the process exits, as the segment is shared with other processes.
+    """
+    resource_tracker.unregister(segment._name, "shared_memory")
+
+
+class SharedFieldCache(object):
+    """
+    LRU cache of numpy (masked) arrays in shared memory segments.
+    """
+
+    def __init__(self, max_bytes=0, directory=None):
+        """
+        max_bytes: maximum total size of the cached fields, 0 disables the cache
+        directory: directory of the index and lock files
+        """
+        self.max_bytes = max_bytes
+        if directory is None:
+            user = os.getuid() if hasattr(os, "getuid") else ""
+            directory = os.path.join(tempfile.gettempdir(), f"mss_field_cache_{user}")
+        self.directory = directory
+        self.enabled = max_bytes > 0
+        # version of the index file and the index last read by lookups of this process
+        self._loaded = (None, {})
+        if self.enabled and (shared_memory is None or fcntl is None):
+            logging.warning("Shared memory or file locking is not available, the shared field cache is disabled.")
+            self.enabled = False
+
+    @contextlib.contextmanager
+    def _index(self, shared=False):
+        """
+        Yields the index of the cached fields while holding the lock. If
+        <shared>, the index must not be modified; otherwise the lock is
+        exclusive and the index is stored afterwards.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "index.json")
+        with open(os.path.join(self.directory, "index.lock"), "a+b") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                index = self._read_index(path, shared)
+                yield index
+                if not shared:
+                    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(temporary, "w") as fid:
+                        json.dump(index, fid)
+                    os.replace(temporary, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self, path, shared):
+        """
+        Returns the index stored at <path>. For lookups, the index read before
+        is reused as long as the file was not replaced.
+        """
+        try:
+            stat = os.stat(path)
+            version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            version = None
+        if shared and version is not None and self._loaded[0] == version:
+            return self._loaded[1]
+        try:
+            with open(path) as fid:
+                index = json.load(fid)
+        except (OSError, ValueError):
+            index = {}
+        if shared:
+            self._loaded = (version, index)
+            self._release(index)
+        return index
+
+    def _used_path(self, key):
+        return os.path.join(self.directory, key + ".used")
+
+    def _touch(self, key):
+        """
+        Records the use of the field of <key>.
+        """
+        path = self._used_path(key)
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            with open(path, "a"):
+                pass
+            os.utime(path, (now, now))
+
+    def _last_used(self, key, entry):
+        try:
+            return os.stat(self._used_path(key)).st_mtime
+        except OSError:
+            return entry["used"]
+
+    def _remove_used(self, key):
+        try:
+            os.remove(self._used_path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, load):
+        """
+        Returns the field of <key> from the cache, or loads it by calling
+        <load>() and stores it in the cache.
+        """
+        if not self.enabled:
+            return load()
+        key = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        with self._index(shared=True) as index:
+            entry = index.get(key)
+        if entry is not None:
+            self._touch(key)
+            try:
+                result = self._attach(entry)
+                METRICS.cache_access("shared_field", True)
+                return result
+            except FileNotFoundError:
+                logging.debug("shared field segment '%s' vanished", entry["name"])
+        METRICS.cache_access("shared_field", False)
+        return self._store(key, load())
+
+    def _store(self, key, value):
+        """
+        Copies <value> into a new segment and adds it to the index. Returns
+        the shared copy of <value> or <value> itself if it cannot be cached.
+        """
+        data = np.ma.getdata(value)
+        mask = np.ma.getmask(value)
+        has_mask = isinstance(value, np.ma.MaskedArray) and mask is not np.ma.nomask
+        size = data.nbytes + (data.size if has_mask else 0)
+        if size > self.max_bytes or size == 0 or data.dtype.hasobject:
+            return value
+        entry = {"name": f"mss_{key[:16]}_{secrets.token_hex(4)}", "shape": list(data.shape),
+                 "dtype": data.dtype.str, "masked": isinstance(value, np.ma.MaskedArray),
+                 "has_mask": bool(has_mask), "size": size, "used": time.time()}
+        segment = shared_memory.SharedMemory(name=entry["name"], create=True, size=size)
+        _untrack(segment)
+        buffer = np.ndarray(size, dtype=np.uint8, buffer=segment.buf)
+        buffer[:data.nbytes] = np.ascontiguousarray(data).view(np.uint8).ravel()
+        if has_mask:
+            buffer[data.nbytes:] = np.ascontiguousarray(mask, dtype=bool).view(np.uint8).ravel()
+        del buffer
+        with self._index() as index:
+            if key in index:
+                # stored by another process in the meantime
+                segment.close()
+                self._unlink(entry["name"])
+                return value
+            index[key] = entry
+            self._touch(key)
+            total = sum(_x["size"] for _x in index.values())
+            if total > self.max_bytes:
+                used = {_x: self._last_used(_x, index[_x]) for _x in index}
+                for old_key in sorted(index, key=used.get):
+                    if total <= self.max_bytes:
+                        break
+                    if old_key != key:
+                        total -= index[old_key]["size"]
+                        self._unlink(index.pop(old_key)["name"])
+                        self._remove_used(old_key)
+            self._release(index)
+        with _SEGMENTS_LOCK:
+            _SEGMENTS[entry["name"]] = (segment, [])
+            return self._view(entry)
+
+    def _attach(self, entry):
+        with _SEGMENTS_LOCK:
+            if entry["name"] not in _SEGMENTS:
+                segment = shared_memory.SharedMemory(name=entry["name"])
+                _untrack(segment)
+                _SEGMENTS[entry["name"]] = (segment, [])
+            return self._view(entry)
+
+    @staticmethod
+    def _view(entry):
+        """
+        Returns the array stored in the segment of <entry>. The array is
+        registered, so that the segment is not closed while it is in use.
+        """
+        segment, users = _SEGMENTS[entry["name"]]
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        data = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        data.flags.writeable = False
+        users.append(weakref.ref(data))
+        if not entry["masked"]:
+            return data
+        mask = np.ma.nomask
+        if entry["has_mask"]:
+            mask = np.ndarray(shape, dtype=bool, buffer=segment.buf, offset=count * dtype.itemsize)
+            mask.flags.writeable = False
+            users.append(weakref.ref(mask))
+        return np.ma.MaskedArray(data, mask=mask, copy=False)
+
+    @staticmethod
+    def _unlink(name):
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+    @staticmethod
+    def _release(index):
+        """
+        Detaches from segments that were removed from <index> and are no
+        longer used by arrays of this process.
+        """
+        names = {_x["name"] for _x in index.values()}
+        with _SEGMENTS_LOCK:
+            for name in [_x for _x in _SEGMENTS if _x not in names]:
+                segment, users = _SEGMENTS[name]
+                if all(_x() is None for _x in users):
+                    segment.close()
+                    del _SEGMENTS[name]
+
+    def clear(self):
+        """
+        Removes all cached fields.
+        """
+        if not self.enabled:
+            return
+        with self._index() as index:
+            for key, entry in index.items():
+                self._unlink(entry["name"])
+                self._remove_used(key)
+            index.clear()
+            self._release(index)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.singleflight
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Coalescing of identical concurrent WMS requests.
+
+    Requests with the same normalized query that arrive while an identical one
+    is being rendered wait for that render and share its result instead of
+    rendering again. Within one process threads wait on an event; if a lock
+    directory is configured, worker processes on the same host coordinate
+    through file locks and exchange the result through files in that directory.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from mslib.mswms.metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Executes a function only once for concurrent calls with the same key.
+    """
+
+    def __init__(self, enabled=True, lock_directory=None, timeout=300., max_age=60.):
+        """
+        enabled: coalesce requests at all
+        lock_directory: directory for the lock and result files shared by worker processes, or None
+        timeout: seconds to wait for a render in another process before rendering anyway
+        max_age: seconds after which result files are removed, the directory is cleaned
+                 up at most once in this period
+        """
+        self.enabled = enabled
+        self.lock_directory = lock_directory
+        self.timeout = timeout
+        self.max_age = max_age
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.
+        if lock_directory is not None and fcntl is None:
+            logging.warning("File locking is not available, requests are only coalesced within a process.")
+            self.lock_directory = None
+
+    @staticmethod
+    def key(query, mode):
+        """
+        Returns a key identifying the request independent of the case and order
+        of the query parameters.
+        """
+        normalized = sorted((key.upper(), value) for key, value in query.items() if key.upper() != "PROFILE")
+        return hashlib.sha1(repr((mode, normalized)).encode("utf-8")).hexdigest()
+
+    def do(self, key, func):
+        """
+        Returns the result of func(). If a call with the same key is already
+        in progress, waits for it and returns its result (or raises its
+        exception) instead.
+        """
+        if not self.enabled:
+            return func()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            METRICS.inc("mswms_coalesced_requests_total", scope="thread")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            if self.lock_directory is not None:
+                call.result = self._do_shared(key, func)
+            else:
+                call.result = func()
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _do_shared(self, key, func):
+        """
+        Coordinates with other processes using the lock file of <key>. The
+        process holding the lock renders and stores the result, processes
+        waiting for the lock read it afterwards. The lock file is removed by
+        the process holding it after storing the result, so processes that
+        locked a removed file either read the result or lock the current file.
+        """
+        os.makedirs(self.lock_directory, exist_ok=True)
+        result_path = os.path.join(self.lock_directory, key + ".result")
+        lock_path = os.path.join(self.lock_directory, key + ".lock")
+        start = time.time()
+        waited = False
+        while True:
+            with open(lock_path, "a+b") as lock_file:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        waited = True
+                        if time.time() - start > self.timeout:
+                            logging.warning("Timeout while waiting for the render of another process.")
+                            return func()
+                        time.sleep(0.05)
+                try:
+                    if waited:
+                        result = self._read_result(result_path, start)
+                        if result is not None:
+                            METRICS.inc("mswms_coalesced_requests_total", scope="process")
+                            return result
+                    if not self._is_locked_file(lock_file, lock_path):
+                        continue
+                    try:
+                        result = func()
+                        self._write_result(result_path, result)
+                        return result
+                    finally:
+                        self._remove(lock_path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    self._cleanup()
+
+    @staticmethod
+    def _is_locked_file(lock_file, path):
+        """
+        Returns whether the opened <lock_file> is still the file at <path>.
+        """
+        try:
+            return os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino
+        except OSError:
+            return False
+
+    @staticmethod
+    def _read_result(path, start):
+        try:
+            # allow for file systems with a coarse time resolution
+            if os.path.getmtime(path) < start - 1:
+                return None
+            with open(path, "rb") as fid:
+                return_format, kind, data = fid.read().split(b"\n", 2)
+        except (OSError, ValueError):
+            return None
+        return data.decode("utf-8") if kind == b"str" else data, return_format.decode("utf-8")
+
+    @staticmethod
+    def _write_result(path, result):
+        data, return_format = result
+        kind = "str" if isinstance(data, str) else "bytes"
+        if kind == "str":
+            data = data.encode("utf-8")
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as fid:
+            fid.write(f"{return_format}\n{kind}\n".encode("utf-8") + data)
+        os.replace(temporary, path)
+
+    def _cleanup(self):
+        """
+        Removes result files that were not used for a while and files left
+        behind by terminated processes, at most once every max_age seconds.
+        """
+        now = time.time()
+        if now - self._last_cleanup < self.max_age:
+            return
+        self._last_cleanup = now
+        limit, stale_limit = now - self.max_age, now - max(self.max_age, self.timeout)
+        try:
+            with os.scandir(self.lock_directory) as entries:
+                for entry in entries:
+                    if ((entry.name.endswith(".result") and entry.stat().st_mtime < limit) or
+                            (entry.name.endswith((".lock", ".tmp")) and entry.stat().st_mtime < stale_limit)):
+                        self._remove(entry.path)
+        except OSError as ex:
+            logging.debug("cleanup of '%s' failed: %s %s", self.lock_directory, type(ex), ex)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -25,10 +25,16 @@
     limitations under the License.
 """
 
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import pint
 
+from mslib.mswms.metrics import METRICS
+
 UR = pint.UnitRegistry()
 N_LEVELS = 16
 
@@ -479,12 +485,117 @@ def get_cbar_label_format(style, maxvalue):
     return format
 
 
-def make_cbar_labels_readable(fig, axs):
+def make_cbar_labels_readable(fig, axs, height=None):
     """
     Adjust font size of the colorbar labels and put a white background behind them
-    such that they are readable in front of any background.
+    such that they are readable in front of any background. The font size scales
+    with <height>, by default the height of <fig> in pixels.
     """
-    fontsize = fig.bbox.height * 0.024
+    fontsize = (height if height is not None else fig.bbox.height) * 0.024
     for x in axs.yaxis.majorTicks:
         x.label1.set_path_effects([matplotlib.patheffects.withStroke(linewidth=4, foreground='w')])
         x.label1.set_fontsize(fontsize)
+
+
+def block_average(data, factors):
+    """
+    Averages an n-dimensional field over blocks of <factors> grid points, one
+    factor per axis. Masked and invalid values are ignored; incomplete blocks at
+    the upper boundaries are averaged over the available points. Blocks without
+    any valid value are masked.
+    """
+    data = np.ma.masked_invalid(data)
+    dtype = np.result_type(data.dtype, np.float32)
+    sums = data.filled(0).astype(dtype)
+    counts = (~np.ma.getmaskarray(data)).astype(dtype)
+    for axis, factor in enumerate(factors):
+        indices = np.arange(0, data.shape[axis], factor)
+        sums = np.add.reduceat(sums, indices, axis=axis)
+        counts = np.add.reduceat(counts, indices, axis=axis)
+    return np.ma.masked_where(counts == 0, sums / np.maximum(counts, 1))
+
+
+class FigurePool(object):
+    """
+    Per-process pool of matplotlib figures with attached Agg canvas.
+
+    Figures are keyed by pixel size, dpi and face colour. A released figure is
+    cleared before it is put back, so styles start with an empty figure and add
+    their axes as usual; the Figure, canvas and, in particular, the Agg
+    renderer with its pixel buffer are reused across requests. Figures that are
+    not released (e.g. because plotting raised an exception) are simply
+    garbage collected. As the image sizes are chosen by the clients, the total
+    number of idle figures is bounded, too, evicting the least recently used.
+    """
+
+    def __init__(self, size=4, max_figures=16):
+        """
+        size: maximum number of idle figures kept per key, 0 disables pooling
+        max_figures: maximum number of idle figures kept in total
+        """
+        self.size = size
+        self.max_figures = max_figures
+        self._figures = OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, figsize, dpi=80, facecolor="white"):
+        """
+        Returns an empty figure of <figsize> inches with an Agg canvas.
+        """
+        key = (tuple(figsize), dpi, facecolor)
+        fig = None
+        if self.size > 0:
+            with self._lock:
+                figures = self._figures.get(key)
+                if figures:
+                    fig = figures.pop()
+                    self._count -= 1
+                    if not figures:
+                        del self._figures[key]
+            METRICS.cache_access("figure", fig is not None)
+        if fig is None:
+            fig = matplotlib.figure.Figure(figsize=figsize, dpi=dpi, facecolor=facecolor)
+            FigureCanvasAgg(fig)
+            fig._mss_pool_key = key
+        return fig
+
+    def release(self, fig):
+        """
+        Clears <fig> and keeps it for later use. The figure must not be used
+        by the caller afterwards.
+        """
+        key = getattr(fig, "_mss_pool_key", None)
+        if self.size <= 0 or key is None:
+            return
+        fig.clf()
+        fig.patch.set_alpha(None)
+        fig.subplots_adjust(**{_x: matplotlib.rcParams[f"figure.subplot.{_x}"] for _x in (
+            "left", "right", "bottom", "top", "wspace", "hspace")})
+        with self._lock:
+            figures = self._figures.setdefault(key, [])
+            self._figures.move_to_end(key)
+            if len(figures) < self.size:
+                figures.append(fig)
+                self._count += 1
+            while self._count > self.max_figures:
+                oldest = next(iter(self._figures.values()))
+                oldest.pop(0)
+                self._count -= 1
+                if not oldest:
+                    self._figures.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self._count = 0
+
+    def after_fork(self):
+        """
+        Replaces the lock in a forked process, as another thread of the parent
+        may have held it while forking.
+        """
+        self._lock = threading.Lock()
+
+
+FIGURE_POOL = FigurePool()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+
+    mslib.mswms.watcher
+    ~~~~~~~~~~~~~~~~~~~
+
+    Background detection of modified files in a data directory.
+
+    A watcher collects the names of files that were created, modified, moved
+    or deleted together with a sequence number of the change. Each consumer
+    remembers the sequence number up to which it considered the changes, so
+    that the data access classes can answer at request time
+    whether a file changed by a lookup in memory instead of stat calls. On
+    Linux, inotify is used; elsewhere, and for network file systems, where
+    inotify does not see changes made by other hosts, a thread polls the
+    modification times of the directory entries. Watchers started before
+    preloading a pre-forking server are restarted in its workers, see
+    restart_watchers.
+
+    This file is part of mss.
+
+    :copyright: Copyright 2021 by the mss team, see AUTHORS.
+    :license: APACHE-2.0, see LICENSE for details.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import weakref
+from abc import ABCMeta, abstractmethod
+
+
+# all files are to be considered changed, e.g. after an overflow of the event queue
+ALL = "*"
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE |
+            _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+# started watchers, which need to be restarted in forked processes
+_WATCHERS = weakref.WeakSet()
+# file systems on which inotify does not see changes made by other hosts
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "ceph", "fuse.ceph", "glusterfs",
+                       "fuse.glusterfs", "fuse.sshfs", "lustre", "gpfs", "beegfs", "9p", "ocfs2", "gfs2"}
+
+
+class FileWatcher(metaclass=ABCMeta):
+    """
+    Super class collecting the names of changed files of a directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sequence = 0
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}({self.path})",
+                                            daemon=True)
+            self._thread.start()
+            _WATCHERS.add(self)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            _WATCHERS.discard(self)
+
+    def _after_fork(self):
+        """
+        Restarts the watcher in a forked process, which inherits no threads.
+        Changes until then are not known, so all files are considered changed.
+        """
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._add([ALL])
+        self.start()
+
+    @abstractmethod
+    def _run(self):
+        """
+        Collects the changes until the watcher is stopped.
+        """
+        pass
+
+    def _add(self, names):
+        with self._lock:
+            self._sequence += 1
+            for name in names:
+                self._changes[name] = self._sequence
+
+    @property
+    def sequence(self):
+        """
+        The sequence number of the latest change.
+        """
+        with self._lock:
+            return self._sequence
+
+    def changed(self, filenames, since=0):
+        """
+        Returns whether any of <filenames> changed after the change with the
+        sequence number <since>.
+        """
+        with self._lock:
+            return any(self._changes.get(_x, 0) > since for _x in [ALL] + list(filenames))
+
+    def changes_since(self, since):
+        """
+        Returns the names of the files changed after the change with the sequence
+        number <since> and the sequence number of the latest change. The name ALL
+        indicates that any file may have changed.
+        """
+        with self._lock:
+            return {_x for _x, _sequence in self._changes.items() if _sequence > since}, self._sequence
+
+
+class PollingWatcher(FileWatcher):
+    """
+    Detects changes by comparing the modification time and size of all
+    directory entries every <interval> seconds.
+    """
+
+    def __init__(self, path, interval=5.):
+        super().__init__(path)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        result = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    result[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as ex:
+            logging.error("Could not scan '%s': %s %s", self.path, type(ex), ex)
+            return self._snapshot
+        return result
+
+    def poll(self):
+        """
+        Compares the directory with the last scan and records the differences.
+        """
+        snapshot = self._scan()
+        changes = {_x for _x in set(snapshot) | set(self._snapshot)
+                   if snapshot.get(_x) != self._snapshot.get(_x)}
+        self._snapshot = snapshot
+        if changes:
+            logging.debug("Detected changed files %s", sorted(changes))
+            self._add(changes)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+class InotifyWatcher(FileWatcher):
+    """
+    Receives changes from the Linux inotify interface.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._open()
+
+    def _open(self):
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(self.path), _IN_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            self._fd = -1
+            raise OSError(errno, f"inotify_add_watch failed for '{self.path}'")
+
+    def _read(self):
+        try:
+            buffer = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        changes, offset = set(), 0
+        while offset < len(buffer):
+            _, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & (_IN_Q_OVERFLOW | _IN_DELETE_SELF | _IN_MOVE_SELF):
+                changes.add(ALL)
+            elif name:
+                changes.add(os.fsdecode(name))
+        if changes:
+            logging.debug("Detected changed files %s", sorted(changes))
+            self._add(changes)
+
+    def _run(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 1.)
+            if readable:
+                self._read()
+
+    def stop(self):
+        super().stop()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _after_fork(self):
+        # the inherited descriptor shares its events with the parent process
+        os.close(self._fd)
+        self._open()
+        super()._after_fork()
+
+
+def restart_watchers():
+    """
+    Restarts the started watchers in a forked process, which inherits no
+    threads. This is meant for the worker processes of a server only, see
+    mslib.mswms.wms.preload; other forked processes do not watch files.
+    """
+    for watcher in list(_WATCHERS):
+        try:
+            watcher._after_fork()
+        except OSError as ex:
+            logging.error("Could not restart watcher of '%s' after fork: %s %s", watcher.path, type(ex), ex)
+
+
+def filesystem_type(path, mounts="/proc/mounts"):
+    """
+    Returns the type of the file system containing <path> according to the
+    table of mounted file systems <mounts>, or None if it is not known.
+    """
+    path = os.path.realpath(path)
+    result, length = None, -1
+    try:
+        with open(mounts) as fid:
+            for line in fid:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # spaces and other special characters are escaped as octal numbers
+                mount_point = re.sub(r"\\([0-7]{3})", lambda _x: chr(int(_x.group(1), 8)), fields[1])
+                if ((path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and
+                        len(mount_point) > length):
+                    result, length = fields[2], len(mount_point)
+    except OSError:
+        return None
+    return result
+
+
+def create_watcher(path, mode="auto", interval=5.):
+    """
+    Returns a started watcher for <path>. <mode> may be "inotify", "poll" or
+    "auto", which uses inotify where available and polling otherwise, in
+    particular on network file systems.
+    """
+    if mode not in ("auto", "inotify", "poll"):
+        raise ValueError(f"unknown watch mode '{mode}'")
+    watcher = None
+    if mode == "auto" and sys.platform.startswith("linux") and filesystem_type(path) in NETWORK_FILESYSTEMS:
+        logging.info("'%s' is on a network file system, polling it for changes", path)
+        mode = "poll"
+    if mode in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(path)
+        except (OSError, AttributeError) as ex:
+            if mode == "inotify":
+                raise
+            logging.warning("inotify not available for '%s', falling back to polling (%s)", path, ex)
+    elif mode == "inotify":
+        raise OSError("inotify is only available on Linux")
+    if watcher is None:
+        watcher = PollingWatcher(path, interval=interval)
+    watcher.start()
+    return watcher
@@ -47,23 +47,40 @@ standard_library.install_aliases()
 
 import os
 import io
+import sys
+import calendar
+import datetime
+import gc
+import hashlib
+import importlib
+import json
 import logging
+import multiprocessing
+import concurrent.futures
+import threading
+import time
 import traceback
 import urllib.parse
+import zipfile
 import inspect
 from xml.etree import ElementTree
-from chameleon import PageTemplateLoader
 from owslib.crs import axisorder_yx
-from PIL import Image
 import shutil
 
 from flask import request, make_response, render_template
 from flask_httpauth import HTTPBasicAuth
 from multidict import CIMultiDict
+from mslib import __version__
 from mslib.utils import conditional_decorator
-from mslib.utils import parse_iso_datetime
+from mslib.utils import parse_iso_datetime, parse_iso_duration
 from mslib.index import app_loader
-from mslib.mswms.gallery_builder import add_image, write_html, write_doc_index, STATIC_LOCATION, DOCS_LOCATION
+from mslib.mswms.metrics import METRICS
+from mslib.mswms.prefetch import Prefetcher
+from mslib.mswms.profiling import RequestProfiler
+from mslib.mswms.singleflight import SingleFlight
+from mslib.mswms.watcher import restart_watchers
+from mslib.mswms.gallery_builder import add_image, write_html, write_doc_index, STATIC_LOCATION, DOCS_LOCATION, \
+    load_manifest, save_manifest, plot_key
 
 # Flask basic auth's documentation
 # https://flask-basicauth.readthedocs.io/en/latest/#flask.ext.basicauth.BasicAuth.check_credentials
@@ -115,7 +132,6 @@ except ImportError as ex:
 if mss_wms_settings.__dict__.get('enable_basic_http_authentication', False):
     logging.debug("Enabling basic HTTP authentication. Username and "
                   "password required to access the service.")
-    import hashlib
 
     def authfunc(username, password):
         for u, p in mss_wms_auth.allowed_users:
@@ -132,6 +148,7 @@ if mss_wms_settings.__dict__.get('enable_basic_http_authentication', False):
         return authfunc(username, password)
 
 from mslib.mswms import mss_plot_driver
+from mslib.mswms.featureinfo import get_feature_info
 from mslib.utils import get_projection_params
 
 # Logging the Standard Output, which will be added to the Apache Log Files
@@ -142,10 +159,23 @@ logging.basicConfig(level=logging.DEBUG,
 # Chameleon XMl template
 base_dir = os.path.abspath(os.path.dirname(__file__))
 xml_template_location = os.path.join(base_dir, "xml_templates")
-templates = PageTemplateLoader(mss_wms_settings.__dict__.get("xml_template_location", xml_template_location))
+templates = None
+
+
+def get_template(name):
+    """
+    Returns the XML template <name>. Chameleon is only imported when the first
+    template is needed.
+    """
+    global templates
+    if templates is None:
+        from chameleon import PageTemplateLoader
+        templates = PageTemplateLoader(mss_wms_settings.__dict__.get("xml_template_location", xml_template_location))
+    return templates[name]
 
 
 def squash_multiple_images(imgs):
+    from PIL import Image
     with Image.open(io.BytesIO(imgs[0])) as background:
         background = background.convert("RGBA")
         if len(imgs) > 1:
@@ -166,12 +196,160 @@ def squash_multiple_xml(xml_strings):
     return ElementTree.tostring(base)
 
 
+_gallery_server = None
+
+
+def _init_gallery_worker(wms_server):
+    """
+    Initializes a (forked) process drawing gallery plots of <wms_server>.
+    """
+    global _gallery_server
+    _gallery_server = wms_server
+    # datasets opened before the fork are not shared with the parent process
+    wms_server.close_datasets()
+
+
+def _render_gallery_plot(kind, dataset, plot, parameters, wms_server=None):
+    """
+    Returns the gallery plot of a layer and the seconds it took to draw it.
+    """
+    start = time.perf_counter()
+    image = (wms_server or _gallery_server)._plot_gallery_layer(kind, dataset, plot, parameters)
+    return image, time.perf_counter() - start
+
+
+def parse_time_values(value, available=()):
+    """
+    Parses a TIME value holding a comma-separated list of times and intervals
+    "start/end/period". Intervals without period comprise the times of
+    <available> within them. Returns the sorted list of times.
+    """
+    result = set()
+    for item in value.split(","):
+        parts = item.split("/")
+        if len(parts) == 1:
+            result.add(parse_iso_datetime(parts[0]))
+        elif len(parts) in (2, 3):
+            start, end = parse_iso_datetime(parts[0]), parse_iso_datetime(parts[1])
+            if len(parts) == 2:
+                result.update(_x for _x in available if start <= _x <= end)
+                continue
+            period = parse_iso_duration(parts[2])
+            if start + period <= start:
+                raise ValueError(f"invalid period '{parts[2]}'")
+            while start <= end:
+                result.add(start)
+                start += period
+        else:
+            raise ValueError(f"invalid time interval '{item}'")
+    return sorted(result)
+
+
+def format_time_extent(times, compact=True):
+    """
+    Returns the comma-separated list of <times> of a capabilities document. If
+    <compact>, runs of at least three equally spaced times are given as
+    intervals "start/end/period".
+    """
+    import isodate
+    times = sorted(set(times))
+    items = []
+    index = 0
+    while index < len(times):
+        end = index
+        if compact and index + 2 < len(times):
+            period = times[index + 1] - times[index]
+            while end + 1 < len(times) and times[end + 1] - times[end] == period:
+                end += 1
+        if end - index >= 2:
+            items.append(f"{times[index]:%Y-%m-%dT%H:%M:%SZ}/{times[end]:%Y-%m-%dT%H:%M:%SZ}/"
+                         f"{isodate.duration_isoformat(period)}")
+            index = end + 1
+        else:
+            items.append(f"{times[index]:%Y-%m-%dT%H:%M:%SZ}")
+            index += 1
+    return ",".join(items)
+
+
+def encode_animation(imgs, times, return_format, duration=500):
+    """
+    Combines the PNG images <imgs> of <times> into an animated PNG or WebP
+    with <duration> milliseconds per frame, or into a zip archive of the frames.
+    """
+    from PIL import Image
+    output = io.BytesIO()
+    if return_format == "application/zip":
+        with zipfile.ZipFile(output, "w") as archive:
+            for index, (img, valid_time) in enumerate(zip(imgs, times)):
+                archive.writestr(f"{index:03d}_{valid_time:%Y%m%dT%H%M%SZ}.png", img)
+        return output.getvalue()
+    frames = []
+    for img in imgs:
+        with Image.open(io.BytesIO(img)) as frame:
+            frames.append(frame.convert("RGBA"))
+    if return_format == "image/png" and all(_x.getextrema()[3][0] == 255 for _x in frames):
+        # opaque frames share one adaptive palette, which keeps the file small
+        frames = [_x.convert("RGB") for _x in frames]
+        strip = Image.new("RGB", (frames[0].width, frames[0].height * len(frames)))
+        for index, frame in enumerate(frames):
+            strip.paste(frame, (0, index * frame.height))
+        palette = strip.convert("P", palette=Image.ADAPTIVE)
+        frames = [_x.quantize(palette=palette, dither=0) for _x in frames]
+    frames[0].save(output, format="PNG" if return_format == "image/png" else "WEBP", save_all=True,
+                   append_images=frames[1:], duration=duration, loop=0)
+    return output.getvalue()
+
+
+def resolve_layer_class(layer_class):
+    """
+    Returns the style class <layer_class>, which may also be given by its import
+    path, e.g. "mslib.mswms.mpl_hsec_styles.HS_CloudsStyle_01".
+    """
+    if isinstance(layer_class, str):
+        module, _, name = layer_class.rpartition(".")
+        layer_class = getattr(importlib.import_module(module), name)
+    return layer_class
+
+
 class WMSServer(object):
+    # attributes created by setup() on first use
+    _lazy_attributes = ("hsec_drivers", "vsec_drivers", "lsec_drivers",
+                        "hsec_layer_registry", "vsec_layer_registry", "lsec_layer_registry")
 
     def __init__(self):
         """
         init method for wms server
+
+        The data sets are scanned and the layers are registered by setup(),
+        which is called on the first access to the drivers or layer registries,
+        so that the server can be created at import time without delay.
         """
+        self._setup_lock = threading.RLock()
+        for name in self._lazy_attributes:
+            self.__dict__.pop(name, None)
+
+    def __getattr__(self, name):
+        if name in type(self)._lazy_attributes:
+            self.setup()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def setup(self):
+        """
+        Scans the data sets and registers the layers, if not done before.
+        """
+        with self._setup_lock:
+            if "lsec_layer_registry" not in self.__dict__:
+                start = time.perf_counter()
+                self._setup()
+                logging.info("WMS server set up in %.2f s", time.perf_counter() - start)
+
+    def _setup(self):
+        # Import here as matplotlib is slow to import and only needed for plotting
+        from mslib.mswms.utils import FIGURE_POOL
+        FIGURE_POOL.size = mss_wms_settings.__dict__.get("figure_pool_size", FIGURE_POOL.size)
+        FIGURE_POOL.max_figures = mss_wms_settings.__dict__.get("figure_pool_max_figures", FIGURE_POOL.max_figures)
+
         data_access_dict = mss_wms_settings.data
 
         for key in data_access_dict:
@@ -214,10 +392,24 @@ class WMSServer(object):
             else:
                 self.register_lsec_layer(layer[1], layer_class=layer[0])
 
+    def close_datasets(self):
+        """
+        Closes the NetCDF datasets held open by the plot drivers.
+        """
+        for drivers in (self.hsec_drivers, self.vsec_drivers, self.lsec_drivers):
+            for driver in drivers.values():
+                if driver.dataset is not None:
+                    driver.dataset.close()
+                    driver.dataset = None
+
     def generate_gallery(self, create=False, clear=False, generate_code=False, sphinx=False, plot_list=None,
-                         all_plots=False, url_prefix=""):
+                         all_plots=False, url_prefix="", workers=None):
         """
         Iterates through all registered layers, draws their plots and puts them in the gallery
+
+        Only plots whose style source code, data files or render parameters changed since
+        they were drawn are regenerated, see plot_key. These are drawn by <workers> processes
+        (default: the setting gallery_workers or the number of CPUs).
         """
         if mss_wms_settings.__file__:
             if all_plots:
@@ -254,75 +446,140 @@ class WMSServer(object):
                              [self.vsec_drivers, self.vsec_layer_registry],
                              [self.hsec_drivers, self.hsec_layer_registry]]
 
+            manifest = load_manifest(location)
+            jobs = []
             for driver, registry in plot_list:
                 multiple_datasets = len(driver) > 1
+                kind = "lsec" if driver == self.lsec_drivers else "vsec" if driver == self.vsec_drivers else "hsec"
                 for dataset in driver:
-                    plot_driver = driver[dataset]
                     if dataset not in registry:
                         continue
                     for plot in registry[dataset]:
                         plot_object = registry[dataset][plot]
-                        l_type = "Linear" if driver == self.lsec_drivers else \
-                            "Side" if driver == self.vsec_drivers else "Top"
-
+                        l_type = {"lsec": "Linear", "vsec": "Side", "hsec": "Top"}[kind]
+                        filename = f"{l_type}_{dataset if multiple_datasets else ''}{plot_object.name}.png"
                         try:
-                            if not os.path.exists(os.path.join(location, "plots",
-                                                               f"{l_type}_{dataset if multiple_datasets else ''}"
-                                                               f"{plot_object.name}.png")):
-                                # Plot doesn't already exist, generate it
-                                file_types = [field[0] for field in plot_object.required_datafields
-                                              if field[0] != "sfc"]
-                                file_type = file_types[0] if file_types else "sfc"
-                                init_time = plot_driver.get_init_times()[-1]
-                                valid_time = plot_driver.get_valid_times(plot_object.required_datafields[0][1],
-                                                                         file_type, init_time)[-1]
-                                style = plot_object.styles[0][0] if plot_object.styles else None
-                                kwargs = {"plot_object": plot_object,
-                                          "init_time": init_time,
-                                          "valid_time": valid_time}
-                                if driver == self.lsec_drivers:
-                                    plot_driver.set_plot_parameters(**kwargs, lsec_path=[[0, 0, 20000], [1, 1, 20000]],
-                                                                    lsec_numpoints=201, lsec_path_connection="linear")
-                                    path = [[min(plot_driver.lat_data), min(plot_driver.lon_data), 20000],
-                                            [max(plot_driver.lat_data), max(plot_driver.lon_data), 20000]]
-                                    plot_driver.update_plot_parameters(lsec_path=path)
-                                elif driver == self.vsec_drivers:
-                                    plot_driver.set_plot_parameters(**kwargs, vsec_path=[[0, 0], [1, 1]],
-                                                                    vsec_numpoints=201, figsize=[800, 600],
-                                                                    vsec_path_connection="linear", style=style,
-                                                                    noframe=False, bbox=[101, 1050, 10, 180])
-                                    path = [[min(plot_driver.lat_data), min(plot_driver.lon_data)],
-                                            [max(plot_driver.lat_data), max(plot_driver.lon_data)]]
-                                    plot_driver.update_plot_parameters(vsec_path=path)
-                                elif driver == self.hsec_drivers:
-                                    elevations = plot_object.get_elevations()
-                                    elevation = float(elevations[len(elevations) // 2]) if len(elevations) > 0 else None
-                                    plot_driver.set_plot_parameters(**kwargs, noframe=False, figsize=[800, 600],
-                                                                    crs="EPSG:4326", style=style,
-                                                                    bbox=[-15, 35, 30, 65],
-                                                                    level=elevation)
-                                    bbox = [min(plot_driver.lon_data), min(plot_driver.lat_data),
-                                            max(plot_driver.lon_data), max(plot_driver.lat_data)]
-                                    # Create square bbox for better images
-                                    # if abs(bbox[0] - bbox[2]) > abs(bbox[1] - bbox[3]):
-                                    #     bbox[2] = bbox[0] + abs(bbox[1] - bbox[3])
-                                    # else:
-                                    #     bbox[3] = bbox[1] + abs(bbox[0] - bbox[2])
-                                    plot_driver.update_plot_parameters(bbox=bbox)
-                                add_image(plot_driver.plot(), plot_object, generate_code, sphinx, url_prefix=url_prefix,
-                                          dataset=dataset if multiple_datasets else "")
-                            else:
-                                # Plot already exists, skip generation
-                                add_image(None, plot_object, generate_code, sphinx, url_prefix=url_prefix,
-                                          dataset=dataset if multiple_datasets else "")
-
+                            parameters = self._get_gallery_parameters(kind, driver[dataset], plot_object)
+                            filenames = [driver[dataset].data_access.get_filename(
+                                variable, vartype, parameters["init_time"], parameters["valid_time"], fullpath=True)
+                                for vartype, variable, _ in plot_object.required_datafields]
+                            key = plot_key(plot_object, filenames, {"kind": kind, **parameters})
                         except Exception as e:
                             traceback.print_exc()
                             logging.error("%s %s %s", plot_object.name, type(e), e)
+                            continue
+                        outdated = (not os.path.exists(os.path.join(location, "plots", filename)) or
+                                    manifest.get(filename, {}).get("key") != key)
+                        jobs.append((kind, dataset, plot, filename, key, parameters,
+                                     dataset if multiple_datasets else "", outdated))
+
+            outdated_jobs = [_x for _x in jobs if _x[-1]]
+            logging.info("Rendering %d of %d gallery plots", len(outdated_jobs), len(jobs))
+            results = {}
+            workers = min(len(outdated_jobs), workers or mss_wms_settings.__dict__.get(
+                "gallery_workers", os.cpu_count() or 1))
+            if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+                # the worker processes inherit the server and its layers, see _init_gallery_worker
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_gallery_worker, initargs=(self,))
+            else:
+                executor = None
+            try:
+                futures = {}
+                for job in outdated_jobs:
+                    kind, dataset, plot, filename, _, parameters = job[:6]
+                    if executor is not None:
+                        futures[filename] = executor.submit(_render_gallery_plot, kind, dataset, plot, parameters)
+                    else:
+                        futures[filename] = concurrent.futures.Future()
+                        try:
+                            futures[filename].set_result(_render_gallery_plot(kind, dataset, plot, parameters, self))
+                        except Exception as e:
+                            futures[filename].set_exception(e)
+                for index, job in enumerate(outdated_jobs):
+                    filename, key = job[3:5]
+                    try:
+                        results[filename], seconds = futures[filename].result()
+                    except Exception as e:
+                        logging.error("%s %s %s", filename, type(e), e)
+                        continue
+                    manifest[filename] = {"key": key, "seconds": round(seconds, 3),
+                                          "created": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+                    logging.info("[%d/%d] rendered %s in %.2f s", index + 1, len(outdated_jobs), filename, seconds)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            for kind, dataset, plot, filename, _, _, dataset_prefix, outdated in jobs:
+                registry = {"lsec": self.lsec_layer_registry, "vsec": self.vsec_layer_registry,
+                            "hsec": self.hsec_layer_registry}[kind]
+                if outdated and filename not in results:
+                    continue
+                add_image(results.get(filename), registry[dataset][plot], generate_code, sphinx,
+                          url_prefix=url_prefix, dataset=dataset_prefix)
+            save_manifest(location, manifest)
             write_html(sphinx)
             if sphinx and generate_code:
                 write_doc_index()
 
+    def _get_gallery_parameters(self, kind, plot_driver, plot_object):
+        """
+        Returns the init time, valid time, style and elevation of the gallery plot of <plot_object>.
+        """
+        file_types = [field[0] for field in plot_object.required_datafields if field[0] != "sfc"]
+        file_type = file_types[0] if file_types else "sfc"
+        init_time = plot_driver.get_init_times()[-1]
+        valid_time = plot_driver.get_valid_times(plot_object.required_datafields[0][1], file_type, init_time)[-1]
+        style = plot_object.styles[0][0] if plot_object.styles else None
+        elevation = None
+        if kind == "hsec":
+            elevations = plot_object.get_elevations()
+            elevation = float(elevations[len(elevations) // 2]) if len(elevations) > 0 else None
+        return {"init_time": init_time, "valid_time": valid_time, "style": style, "elevation": elevation}
+
+    def _plot_gallery_layer(self, kind, dataset, plot, parameters):
+        """
+        Draws the gallery plot of layer <plot> of <dataset> with <parameters>.
+        """
+        plot_driver, plot_object = {
+            "lsec": (self.lsec_drivers, self.lsec_layer_registry),
+            "vsec": (self.vsec_drivers, self.vsec_layer_registry),
+            "hsec": (self.hsec_drivers, self.hsec_layer_registry)}[kind]
+        plot_driver, plot_object = plot_driver[dataset], plot_object[dataset][plot]
+        style = parameters["style"]
+        kwargs = {"plot_object": plot_object,
+                  "init_time": parameters["init_time"],
+                  "valid_time": parameters["valid_time"]}
+        if kind == "lsec":
+            plot_driver.set_plot_parameters(**kwargs, lsec_path=[[0, 0, 20000], [1, 1, 20000]],
+                                            lsec_numpoints=201, lsec_path_connection="linear")
+            path = [[min(plot_driver.lat_data), min(plot_driver.lon_data), 20000],
+                    [max(plot_driver.lat_data), max(plot_driver.lon_data), 20000]]
+            plot_driver.update_plot_parameters(lsec_path=path)
+        elif kind == "vsec":
+            plot_driver.set_plot_parameters(**kwargs, vsec_path=[[0, 0], [1, 1]],
+                                            vsec_numpoints=201, figsize=[800, 600],
+                                            vsec_path_connection="linear", style=style,
+                                            noframe=False, bbox=[101, 1050, 10, 180])
+            path = [[min(plot_driver.lat_data), min(plot_driver.lon_data)],
+                    [max(plot_driver.lat_data), max(plot_driver.lon_data)]]
+            plot_driver.update_plot_parameters(vsec_path=path)
+        else:
+            plot_driver.set_plot_parameters(**kwargs, noframe=False, figsize=[800, 600],
+                                            crs="EPSG:4326", style=style,
+                                            bbox=[-15, 35, 30, 65],
+                                            level=parameters["elevation"])
+            bbox = [min(plot_driver.lon_data), min(plot_driver.lat_data),
+                    max(plot_driver.lon_data), max(plot_driver.lat_data)]
+            # Create square bbox for better images
+            # if abs(bbox[0] - bbox[2]) > abs(bbox[1] - bbox[3]):
+            #     bbox[2] = bbox[0] + abs(bbox[1] - bbox[3])
+            # else:
+            #     bbox[3] = bbox[1] + abs(bbox[0] - bbox[2])
+            plot_driver.update_plot_parameters(bbox=bbox)
+        return plot_driver.plot()
+
     def register_hsec_layer(self, datasets, layer_class):
         """
         Register horizontal section layer in internal dict of layers.
@@ -330,14 +587,15 @@ class WMSServer(object):
         Arguments:
         datasets -- list of strings describing the datasets with which the
                     layer shall be registered.
-        layer_class -- class of which the layer instances shall be created.
+        layer_class -- class of which the layer instances shall be created,
+                       or its import path.
         """
         # Loop over all provided dataset names. Create an instance of the
         # provided layer class for all datasets and register the layer
         # instances with the datasets.
         for dataset in datasets:
             try:
-                layer = layer_class(self.hsec_drivers[dataset])
+                layer = resolve_layer_class(layer_class)(self.hsec_drivers[dataset])
             except KeyError as ex:
                 logging.debug("ERROR: %s %s", type(ex), ex)
                 continue
@@ -362,7 +620,7 @@ class WMSServer(object):
         # instances with the datasets.
         for dataset in datasets:
             try:
-                layer = layer_class(self.vsec_drivers[dataset])
+                layer = resolve_layer_class(layer_class)(self.vsec_drivers[dataset])
             except KeyError as ex:
                 logging.debug("ERROR: %s %s", type(ex), ex)
                 continue
@@ -388,9 +646,9 @@ class WMSServer(object):
         for dataset in datasets:
             try:
                 if variable:
-                    layer = layer_class(self.lsec_drivers[dataset], variable, filetype)
+                    layer = resolve_layer_class(layer_class)(self.lsec_drivers[dataset], variable, filetype)
                 else:
-                    layer = layer_class(self.lsec_drivers[dataset])
+                    layer = resolve_layer_class(layer_class)(self.lsec_drivers[dataset])
             except KeyError as ex:
                 logging.debug("ERROR: %s %s", type(ex), ex)
                 continue
@@ -418,7 +676,7 @@ class WMSServer(object):
         if code is not None and code == "InvalidSRS" and version == "1.3.0":
             code = "InvalidCRS"
         logging.error("creating service exception code='%s' text='%s'.", code, text)
-        template = templates['service_exception.pt' if version == "1.1.1" else "service_exception130.pt"]
+        template = get_template('service_exception.pt' if version == "1.1.1" else "service_exception130.pt")
         return template(code=code, text=text).encode("utf-8"), "text/xml"
 
     def get_capabilities(self, query, server_url=None):
@@ -444,7 +702,7 @@ class WMSServer(object):
                 text="Requested update sequence is higher than current",
                 version=version)
 
-        template = templates['get_capabilities130.pt' if version == "1.3.0" else 'get_capabilities.pt']
+        template = get_template('get_capabilities130.pt' if version == "1.3.0" else 'get_capabilities.pt')
         logging.debug("server-url '%s'", server_url)
 
         # Horizontal Layers
@@ -484,8 +742,10 @@ class WMSServer(object):
                 lsec_layers.append((dataset, layer))
 
         settings = mss_wms_settings.__dict__
+        compact = settings.get("compact_time_extents", True)
         return_data = template(hsec_layers=hsec_layers, vsec_layers=vsec_layers, lsec_layers=lsec_layers,
                                server_url=server_url,
+                               time_extent=lambda _times: format_time_extent(_times, compact),
                                service_name=settings.get("service_name", "OGC:WMS"),
                                service_title=settings.get("service_title", "Mission Support System Web Map Service"),
                                service_abstract=settings.get("service_abstract", ""),
@@ -551,15 +811,17 @@ class WMSServer(object):
                         version=version)
             logging.debug("  requested initialisation time = '%s'", init_time)
 
-            # Forecast valid time.
+            # Forecast valid time. A list of times or an interval requests an animation.
             valid_time = query.get('TIME')
+            animated = valid_time is not None and ("," in valid_time or "/" in valid_time)
             if valid_time is not None:
                 try:
-                    valid_time = parse_iso_datetime(valid_time)
+                    valid_time = parse_iso_datetime(valid_time.replace("/", ",").split(",")[0])
                 except ValueError:
                     return self.create_service_exception(
                         code="InvalidDimensionValue",
-                        text="TIME has wrong format (needs to be 2005-08-29T13:00:00Z)",
+                        text="TIME has wrong format (needs to be 2005-08-29T13:00:00Z, "
+                             "a list of such times or an interval start/end[/period])",
                         version=version)
             logging.debug("  requested (valid) time = '%s'", valid_time)
 
@@ -595,11 +857,17 @@ class WMSServer(object):
             # Return format (image/png, text/xml, etc.).
             return_format = query.get('FORMAT', 'image/png').lower()
             logging.debug("  requested return format = '%s'", return_format)
-            if return_format not in ["image/png", "text/xml"]:
+            if return_format not in ["image/png", "text/xml"] + (
+                    ["image/webp", "application/zip"] if animated else []):
                 return self.create_service_exception(
                     code="InvalidFORMAT",
                     text=f"unsupported FORMAT: '{return_format}'",
                     version=version)
+            if animated and (mode != "getmap" or len(layers) > 1 or return_format == "text/xml"):
+                return self.create_service_exception(
+                    code="InvalidDimensionValue",
+                    text="Multiple times are only supported for GetMap requests of a single layer",
+                    version=version)
 
             # 3) Check GetMap/GetVSec-specific parameters and produce
             #    the image with the corresponding section driver.
@@ -658,11 +926,28 @@ class WMSServer(object):
 
                 plot_driver = self.hsec_drivers[dataset]
                 try:
-                    plot_driver.set_plot_parameters(self.hsec_layer_registry[dataset][layer], bbox=bbox, level=level,
-                                                    crs=crs, init_time=init_time, valid_time=valid_time, style=style,
-                                                    figsize=figsize, noframe=noframe, transparent=transparent,
-                                                    return_format=return_format)
-                    images.append(plot_driver.plot())
+                    if animated:
+                        valid_times = self._get_animation_times(
+                            query["TIME"], self.hsec_layer_registry[dataset][layer], init_time)
+                        if not 0 < len(valid_times) <= mss_wms_settings.__dict__.get("animation_max_frames", 48):
+                            return self.create_service_exception(
+                                code="InvalidDimensionValue",
+                                text=f"TIME selects {len(valid_times)} valid times, an animation needs 1 to "
+                                     f"{mss_wms_settings.__dict__.get('animation_max_frames', 48)}",
+                                version=version)
+                    with METRICS.request_scope(mode, f"{dataset}.{layer}", style):
+                        plot_driver.set_plot_parameters(self.hsec_layer_registry[dataset][layer], bbox=bbox,
+                                                        level=level, crs=crs, init_time=init_time,
+                                                        valid_time=valid_time, style=style, figsize=figsize,
+                                                        noframe=noframe, transparent=transparent,
+                                                        return_format=return_format)
+                        if animated:
+                            frames = plot_driver.plot_frames(valid_times)
+                            return encode_animation(
+                                frames, valid_times, return_format,
+                                duration=mss_wms_settings.__dict__.get("animation_frame_duration", 500)), \
+                                return_format
+                        images.append(plot_driver.plot())
                 except (IOError, ValueError) as ex:
                     logging.error("ERROR: %s %s", type(ex), ex)
                     logging.debug("%s", traceback.format_exc())
@@ -712,21 +997,22 @@ class WMSServer(object):
 
                 plot_driver = self.vsec_drivers[dataset]
                 try:
-                    plot_driver.set_plot_parameters(plot_object=self.vsec_layer_registry[dataset][layer],
-                                                    vsec_path=path,
-                                                    vsec_numpoints=bbox[0],
-                                                    vsec_path_connection="greatcircle",
-                                                    vsec_numlabels=bbox[2],
-                                                    init_time=init_time,
-                                                    valid_time=valid_time,
-                                                    style=style,
-                                                    bbox=bbox,
-                                                    figsize=figsize,
-                                                    noframe=noframe,
-                                                    draw_verticals=draw_verticals,
-                                                    transparent=transparent,
-                                                    return_format=return_format)
-                    images.append(plot_driver.plot())
+                    with METRICS.request_scope(mode, f"{dataset}.{layer}", style):
+                        plot_driver.set_plot_parameters(plot_object=self.vsec_layer_registry[dataset][layer],
+                                                        vsec_path=path,
+                                                        vsec_numpoints=bbox[0],
+                                                        vsec_path_connection="greatcircle",
+                                                        vsec_numlabels=bbox[2],
+                                                        init_time=init_time,
+                                                        valid_time=valid_time,
+                                                        style=style,
+                                                        bbox=bbox,
+                                                        figsize=figsize,
+                                                        noframe=noframe,
+                                                        draw_verticals=draw_verticals,
+                                                        transparent=transparent,
+                                                        return_format=return_format)
+                        images.append(plot_driver.plot())
                 except (IOError, ValueError) as ex:
                     logging.error("ERROR: %s %s", type(ex), ex)
                     msg = "The data corresponding to your request is not available. Please check the " \
@@ -780,14 +1066,15 @@ class WMSServer(object):
 
                 plot_driver = self.lsec_drivers[dataset]
                 try:
-                    plot_driver.set_plot_parameters(plot_object=self.lsec_layer_registry[dataset][layer],
-                                                    lsec_path=path,
-                                                    lsec_numpoints=bbox,
-                                                    lsec_path_connection="greatcircle",
-                                                    init_time=init_time,
-                                                    valid_time=valid_time,
-                                                    bbox=bbox)
-                    images.append(plot_driver.plot())
+                    with METRICS.request_scope(mode, f"{dataset}.{layer}", style):
+                        plot_driver.set_plot_parameters(plot_object=self.lsec_layer_registry[dataset][layer],
+                                                        lsec_path=path,
+                                                        lsec_numpoints=bbox,
+                                                        lsec_path_connection="greatcircle",
+                                                        init_time=init_time,
+                                                        valid_time=valid_time,
+                                                        bbox=bbox)
+                        images.append(plot_driver.plot())
                 except (IOError, ValueError) as ex:
                     logging.error("ERROR: %s %s", type(ex), ex)
                     msg = "The data corresponding to your request is not available. Please check the " \
@@ -808,8 +1095,354 @@ class WMSServer(object):
         else:
             return images[0], return_format
 
+    def _get_animation_times(self, value, plot_object, init_time):
+        """
+        Returns the valid times selected by the TIME value <value> for
+        <plot_object>. Intervals without period select the available times.
+        """
+        if not plot_object.required_datafields:
+            return parse_time_values(value)
+        vartype, variable, _ = plot_object.required_datafields[0]
+        available = plot_object.driver.get_valid_times(variable, vartype, init_time)
+        result = parse_time_values(value, available)
+        missing = [_x.isoformat() for _x in result if _x not in available]
+        if missing:
+            raise ValueError(f"Valid times {', '.join(missing)} are not available.")
+        return result
+
+    def get_feature_info(self, query):
+        """
+        Handler for GetFeatureInfo requests. Returns the values of the data
+        fields required by the requested horizontal section layers at a point
+        as JSON document.
+
+        The point is given by the MSS specific LAT and LON parameters or, for
+        EPSG:4326, by the pixel position I/J (X/Y for WMS 1.1.1) in a map
+        specified by BBOX, WIDTH and HEIGHT. ELEVATION selects a level; without
+        it, the whole column is returned. TIME may be a single time, an interval
+        "start/end" or be omitted to obtain a time series over all valid times
+        of DIM_INIT_TIME.
+        """
+        version = query.get("VERSION", "1.1.1")
+
+        info_format = query.get("INFO_FORMAT", "application/json").lower()
+        if info_format != "application/json":
+            return self.create_service_exception(
+                code="InvalidFormat", text=f"unsupported INFO_FORMAT: '{info_format}'", version=version)
+
+        try:
+            if "LAT" in query and "LON" in query:
+                lat, lon = float(query["LAT"]), float(query["LON"])
+            else:
+                crs = query.get("CRS" if version == "1.3.0" else "SRS", "EPSG:4326").lower()
+                if crs != "epsg:4326":
+                    return self.create_service_exception(
+                        code="InvalidSRS",
+                        text=f"The requested CRS '{crs}' is not supported for GetFeatureInfo, use LAT and LON.",
+                        version=version)
+                bbox = [float(v) for v in query.get("BBOX", "").split(",")]
+                if version == "1.3.0":
+                    bbox = (bbox[1], bbox[0], bbox[3], bbox[2])
+                width, height = float(query["WIDTH"]), float(query["HEIGHT"])
+                i = float(query["I" if version == "1.3.0" else "X"])
+                j = float(query["J" if version == "1.3.0" else "Y"])
+                lon = bbox[0] + (i + 0.5) / width * (bbox[2] - bbox[0])
+                lat = bbox[3] - (j + 0.5) / height * (bbox[3] - bbox[1])
+        except (KeyError, IndexError, ValueError):
+            return self.create_service_exception(
+                text="Invalid position, specify LAT and LON or BBOX, WIDTH, HEIGHT and I/J (X/Y).",
+                version=version)
+
+        try:
+            level = query.get("ELEVATION")
+            level = float(level) if level is not None else None
+            init_time = query.get("DIM_INIT_TIME")
+            init_time = parse_iso_datetime(init_time) if init_time is not None else None
+            valid_times = [parse_iso_datetime(_x) for _x in query.get("TIME", "").split("/") if _x]
+        except ValueError:
+            return self.create_service_exception(
+                code="InvalidDimensionValue",
+                text="ELEVATION, DIM_INIT_TIME or TIME have a wrong format (times need to be 2005-08-29T13:00:00Z)",
+                version=version)
+
+        layers = [layer for layer in query.get("QUERY_LAYERS", query.get("LAYERS", "")).split(",") if layer]
+        if not layers:
+            return self.create_service_exception(text="QUERY_LAYERS not specified", version=version)
+        result = {}
+        for name in layers:
+            dataset, _, layer = name.rpartition(".")
+            if (dataset not in self.hsec_layer_registry) or (layer not in self.hsec_layer_registry[dataset]):
+                return self.create_service_exception(
+                    code="LayerNotDefined", text=f"Invalid QUERY_LAYERS '{name}' requested", version=version)
+            plot_object = self.hsec_layer_registry[dataset][layer]
+            if init_time is None and plot_object.uses_inittime_dimension():
+                return self.create_service_exception(
+                    code="MissingDimensionValue",
+                    text="INIT_TIME not specified (use the DIM_INIT_TIME keyword)",
+                    version=version)
+            data_access = self.hsec_drivers[dataset].data_access
+            times = valid_times
+            if len(valid_times) != 1 and plot_object.required_datafields:
+                vartype, variable, _ = plot_object.required_datafields[0]
+                times = [_x for _x in data_access.get_valid_times(variable, vartype, init_time)
+                         if len(valid_times) == 0 or valid_times[0] <= _x <= valid_times[-1]]
+            try:
+                with METRICS.request_scope("getfeatureinfo", name, ""):
+                    result[name] = get_feature_info(data_access, plot_object, lat, lon, init_time, times, level=level)
+            except (IOError, KeyError, ValueError) as ex:
+                logging.error("ERROR: %s %s", type(ex), ex)
+                msg = "The data corresponding to your request is not available. Please check the " \
+                      "times and/or levels you have specified.\n\n" \
+                      f"Error message: '{ex}'"
+                return self.create_service_exception(text=msg, version=version)
+        return json.dumps(result).encode("utf-8"), "application/json"
+
+    def get_cache_validators(self, query, mode):
+        """
+        Returns the ETag, the last modification time (seconds since the epoch)
+        and the layer type ("hsec", "vsec" or "lsec") of a GetMap/GetVSec/GetLSec
+        request, or None if the request cannot be validated, e.g. because it is
+        invalid or the data is not available.
+
+        The ETag is derived from the normalized request, the modification time
+        of the server configuration and the modification times of the data
+        files and of the style modules used by the requested layers, so that it
+        changes whenever the produced plot may change.
+        """
+        version = query.get("VERSION", "1.1.1")
+        crs = query.get("CRS" if version == "1.3.0" else "SRS", "EPSG:4326").lower()
+        if crs.startswith("vert:logp"):
+            mode = "getvsec"
+        elif crs.startswith("line:1"):
+            mode = "getlsec"
+        layer_type, registry, drivers = {
+            "getmap": ("hsec", self.hsec_layer_registry, self.hsec_drivers),
+            "getvsec": ("vsec", self.vsec_layer_registry, self.vsec_drivers),
+            "getlsec": ("lsec", self.lsec_layer_registry, self.lsec_drivers)}[mode]
+
+        validator = hashlib.sha1(f"{SingleFlight.key(query, mode)} {__version__}".encode("utf-8"))
+        last_modified = 0
+        try:
+            init_time, valid_time = [
+                parse_iso_datetime(query[_x]) if _x in query else None for _x in ("DIM_INIT_TIME", "TIME")]
+            layers = [layer for layer in query.get("LAYERS", "").strip().split(",") if layer]
+            if not layers:
+                return None
+            settings_file = getattr(mss_wms_settings, "__file__", None)
+            if settings_file is not None:
+                stat = os.stat(settings_file)
+                validator.update(f"{settings_file} {stat.st_mtime_ns} {stat.st_size}".encode("utf-8"))
+            for name in layers:
+                dataset, layer = name.split(".")
+                plot_object = registry[dataset][layer]
+                module = sys.modules[type(plot_object).__module__]
+                paths = [module.__file__]
+                validator.update(f"{type(plot_object).__qualname__} {getattr(module, '__version__', '')}".encode(
+                    "utf-8"))
+                for vartype, variable, _ in plot_object.required_datafields:
+                    paths.append(drivers[dataset].data_access.get_filename(
+                        variable, vartype, init_time, valid_time, fullpath=True))
+                for path in paths:
+                    stat = os.stat(path)
+                    validator.update(f"{path} {stat.st_mtime_ns} {stat.st_size}".encode("utf-8"))
+                    last_modified = max(last_modified, stat.st_mtime)
+        except Exception as ex:
+            logging.debug("no cache validators for request: %s %s", type(ex), ex)
+            return None
+        return validator.hexdigest(), last_modified, layer_type
+
+    def get_neighbour_queries(self, query, mode):
+        """
+        Returns the queries of the neighbouring valid times ("time+1", "time-1")
+        and, for horizontal sections, levels ("level+1", "level-1") of a
+        GetMap/GetVSec request of a single layer and valid time by direction.
+        """
+        version = query.get("VERSION", "1.1.1")
+        crs = query.get("CRS" if version == "1.3.0" else "SRS", "EPSG:4326").lower()
+        if crs.startswith("vert:logp"):
+            mode = "getvsec"
+        registry = {"getmap": self.hsec_layer_registry, "getvsec": self.vsec_layer_registry}.get(mode)
+        layers = [layer for layer in query.get("LAYERS", "").strip().split(",") if layer]
+        value = query.get("TIME")
+        if registry is None or len(layers) != 1 or value is None or "," in value or "/" in value:
+            return {}
+        dataset, layer = layers[0].split(".")
+        plot_object = registry[dataset][layer]
+        init_time = query.get("DIM_INIT_TIME")
+        init_time = parse_iso_datetime(init_time) if init_time is not None else None
+        valid_time = parse_iso_datetime(value)
+
+        result = {}
+        if plot_object.required_datafields:
+            vartype, variable, _ = plot_object.required_datafields[0]
+            valid_times = sorted(plot_object.driver.get_valid_times(variable, vartype, init_time))
+            if valid_time in valid_times:
+                index = valid_times.index(valid_time)
+                for direction, step in (("time+1", 1), ("time-1", -1)):
+                    if 0 <= index + step < len(valid_times):
+                        neighbour = CIMultiDict(query)
+                        neighbour["TIME"] = valid_times[index + step].strftime("%Y-%m-%dT%H:%M:%SZ")
+                        result[direction] = neighbour
+        level = query.get("ELEVATION")
+        if mode == "getmap" and level is not None and plot_object.uses_elevation_dimension():
+            levels = sorted(plot_object.get_elevations(), key=float)
+            index = min(range(len(levels)), key=lambda _x: abs(float(levels[_x]) - float(level)))
+            for direction, step in (("level+1", 1), ("level-1", -1)):
+                if 0 <= index + step < len(levels):
+                    neighbour = CIMultiDict(query)
+                    neighbour["ELEVATION"] = levels[index + step]
+                    result[direction] = neighbour
+        return result
+
+
+# process id of the master process that called preload
+_PRELOAD_PID = None
+
+
+def _after_fork_of_preloaded():
+    """
+    Restarts the file watchers in a worker forked by the preloaded master
+    process. Processes forked by the workers, e.g. drawing tiles, are left alone.
+    """
+    if os.getppid() == _PRELOAD_PID:
+        restart_watchers()
+
+
+def preload(requests=None):
+    """
+    Prepares the server in the master process of a pre-forking WSGI server, so
+    that the workers share the data index, the layers and the caches instead of
+    building their own:
+
+    - scans the data sets and registers the layers (WMSServer.setup),
+    - imports the plotting libraries,
+    - answers the query strings <requests> (default: setting preload_requests) of
+      GetCapabilities and GetMap requests, which fills the template, grid and
+      basemap caches for the maps given,
+    - closes the NetCDF datasets opened by this, as file handles must not be shared,
+    - moves all objects to the permanent generation of the garbage collector, so
+      that collections in the workers do not write to the shared memory pages,
+    - installs a hook restarting the file watchers in the forked workers.
+    """
+    global _PRELOAD_PID
+    start = time.perf_counter()
+    server.setup()
+    # Import here as matplotlib is slow to import and only needed for plotting
+    from mslib.mswms import mpl_hsec, mpl_vsec, mpl_lsec  # noqa: F401
+
+    if requests is None:
+        requests = mss_wms_settings.__dict__.get("preload_requests", [])
+    for query_string in requests:
+        query = CIMultiDict(urllib.parse.parse_qsl(query_string.lstrip("?")))
+        request_type = query.get("request", "").lower()
+        try:
+            if request_type in ("getcapabilities", "capabilities"):
+                return_data, _ = server.get_capabilities(query, "http://localhost/")
+            else:
+                return_data, _ = server.produce_plot(query, request_type)
+            if is_service_exception(return_data):
+                logging.error("Preloading '%s' failed: %s", query_string, return_data)
+        except Exception as ex:
+            logging.error("Preloading '%s' failed: %s %s", query_string, type(ex), ex)
+    server.close_datasets()
+
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    if _PRELOAD_PID is None and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_of_preloaded)
+    _PRELOAD_PID = os.getpid()
+    logging.info("Preloaded WMS server in %.2f s", time.perf_counter() - start)
+
+
+def is_service_exception(data):
+    """
+    Returns whether <data> returned by the WMSServer is a service exception.
+    """
+    head = data[:512]
+    if isinstance(head, str):
+        head = head.encode("utf-8")
+    return b"<ServiceExceptionReport" in head
+
+
+def is_not_modified(etag, last_modified):
+    """
+    Returns whether the current request is conditional and the client's copy
+    is still valid. If-None-Match takes precedence over If-Modified-Since.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None:
+        return calendar.timegm(request.if_modified_since.utctimetuple()) >= int(last_modified)
+    return False
+
+
+def set_cache_headers(response, etag, last_modified, layer_type):
+    """
+    Adds the ETag, Last-Modified and Cache-Control headers to <response>.
+    """
+    response.set_etag(etag)
+    response.last_modified = datetime.datetime.fromtimestamp(int(last_modified), tz=datetime.timezone.utc)
+    max_age = mss_wms_settings.__dict__.get("cache_control_max_age", {}).get(layer_type, 0)
+    response.cache_control.max_age = max_age
+
 
 server = WMSServer()
+profiler = RequestProfiler(directory=mss_wms_settings.__dict__.get("profiling_directory", None),
+                           sample_rate=mss_wms_settings.__dict__.get("profiling_sample_rate", 0),
+                           admin_users=mss_wms_settings.__dict__.get("profiling_admin_users", []))
+coalescer = SingleFlight(enabled=mss_wms_settings.__dict__.get("coalesce_requests", True),
+                         lock_directory=mss_wms_settings.__dict__.get("coalesce_lock_directory", None))
+
+
+def _prefetch_version(query, mode):
+    """
+    Returns the ETag of a request, which changes with the data files, the
+    configuration and the styles, for validating prefetched responses.
+    """
+    validators = server.get_cache_validators(query, mode)
+    return validators[0] if validators is not None else None
+
+
+# server of the prefetch renders, which must not share drivers and plot objects with the requests
+prefetch_server = None
+
+
+def _prefetch_render(query, mode):
+    """
+    Renders a response for the prefetcher with a server of its own, so that
+    requests can be processed meanwhile. It is set up on the first render.
+    """
+    global prefetch_server
+    if prefetch_server is None:
+        prefetch_server = WMSServer()
+    return prefetch_server.produce_plot(query, mode)
+
+
+prefetcher = Prefetcher(_prefetch_render, server.get_neighbour_queries,
+                        enabled=mss_wms_settings.__dict__.get("enable_prefetch", False),
+                        directions=mss_wms_settings.__dict__.get("prefetch_directions", None),
+                        count=mss_wms_settings.__dict__.get("prefetch_count", 2),
+                        max_bytes=mss_wms_settings.__dict__.get("prefetch_max_bytes", 64 * 1024 ** 2),
+                        interval=mss_wms_settings.__dict__.get("prefetch_interval", 0.5),
+                        max_age=mss_wms_settings.__dict__.get("prefetch_max_age", 300),
+                        version=_prefetch_version)
+
+
+def _open_datasets():
+    """
+    Returns the number of NetCDF datasets held open by the plot drivers, or 0
+    before the server is set up, as scraping the metrics must not set it up.
+    """
+    if "lsec_layer_registry" not in server.__dict__:
+        return 0
+    return sum(driver.dataset is not None
+               for drivers in (server.hsec_drivers, server.vsec_drivers, server.lsec_drivers)
+               for driver in drivers.values())
+
+
+METRICS.register_gauge(
+    "mswms_open_datasets", _open_datasets, "Number of NetCDF datasets currently held open by the plot drivers.")
 
 
 @app.route('/')
@@ -828,22 +1461,56 @@ def application():
         request_service = request_service.lower()
         request_version = query.get('version', '')
 
+        profile_name = None
+        validators = None
         url = request.url
         server_url = urllib.parse.urljoin(url, urllib.parse.urlparse(url).path)
 
         if (request_type in ('getcapabilities', 'capabilities') and
                 request_service == 'wms' and request_version in ('1.1.1', '1.3.0', '')):
-            return_data, return_format = server.get_capabilities(query, server_url)
+            with METRICS.request_scope("getcapabilities", "", ""):
+                return_data, return_format = server.get_capabilities(query, server_url)
+        elif request_type == 'getfeatureinfo' and request_version in ('1.1.1', '1.3.0', ''):
+            return_data, return_format = server.get_feature_info(query)
         elif request_type in ('getmap', 'getvsec', 'getlsec') and request_version in ('1.1.1', '1.3.0', ''):
-            return_data, return_format = server.produce_plot(query, request_type)
+            validators = None
+            if mss_wms_settings.__dict__.get("enable_conditional_requests", True):
+                validators = server.get_cache_validators(query, request_type)
+            if validators is not None and is_not_modified(*validators[:2]):
+                METRICS.inc("mswms_not_modified_total", layer_type=validators[2])
+                res = make_response("", 304)
+                set_cache_headers(res, *validators)
+                return res
+            username = None
+            if mss_wms_settings.__dict__.get('enable_basic_http_authentication', False) and request.authorization:
+                username = request.authorization.username
+
+            def render():
+                # only requests actually rendered are profiled
+                nonlocal profile_name
+                with profiler.profile(query, request_type, username) as profile_name:
+                    return server.produce_plot(query, request_type)
+
+            with prefetcher.request():
+                key = coalescer.key(query, request_type)
+                result = prefetcher.get(key, query, request_type)
+                if result is None:
+                    result = coalescer.do(key, render)
+                return_data, return_format = result
+            if not is_service_exception(return_data):
+                prefetcher.observe(request.remote_addr, query, request_type)
         else:
             logging.debug("Request type '%s' is not valid.", request)
             raise RuntimeError("Request type is not valid.")
 
         res = make_response(return_data, 200)
         response_headers = [('Content-type', return_format), ('Content-Length', str(len(return_data)))]
+        if profile_name is not None:
+            response_headers.append(('X-MSS-Profile', profile_name))
         for response_header in response_headers:
             res.headers[response_header[0]] = response_header[1]
+        if validators is not None and not is_service_exception(return_data):
+            set_cache_headers(res, *validators)
 
         return res
 
@@ -862,3 +1529,20 @@ def application():
         for response_header in response_headers:
             res.headers[response_header[0]] = response_header[1]
         return res
+
+
+@app.route('/metrics')
+@conditional_decorator(auth.login_required, mss_wms_settings.__dict__.get('enable_basic_http_authentication', False))
+def metrics():
+    """
+    Returns timing histograms per request type, layer, style and phase, cache
+    hit counts and the number of open datasets in the Prometheus text format.
+    """
+    if not mss_wms_settings.__dict__.get('enable_metrics', True):
+        error_message = "Metrics are disabled.\n"
+        res = make_response(error_message, 404)
+        res.headers['Content-type'] = 'text/plain'
+        return res
+    res = make_response(METRICS.render(), 200)
+    res.headers['Content-type'] = 'text/plain; version=0.0.4'
+    return res
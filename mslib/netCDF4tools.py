@@ -26,7 +26,11 @@
     limitations under the License.
 """
 
+import collections
 import glob
+import os
+import threading
+import weakref
 import numpy as np
 import netCDF4
 
@@ -39,9 +43,40 @@ VERTICAL_AXIS = {
     "tl": "atmosphere_potential_temperature_coordinate",
 }
 
+_STANDARD_NAME_INDEX = weakref.WeakKeyDictionary()
+
+# file sets (with modification times and arguments) that passed the checks of MFDatasetCommonDims
+_COMPATIBLE_FILE_SETS = collections.OrderedDict()
+_COMPATIBLE_FILE_SETS_LOCK = threading.Lock()
+COMPATIBLE_FILE_SETS_SIZE = 1000
+
 # NETCDF FILE TOOLS
 
 
+def standard_name_index(ncfile):
+    """
+    Returns a dictionary mapping the standard_name attributes of the variables
+    in ncfile to the first (position, name) tuple carrying it.
+
+    The index is built once per open dataset, variables added afterwards are
+    not contained. It holds no variables, as these refer to their dataset,
+    which would then never be released.
+    """
+    try:
+        return _STANDARD_NAME_INDEX[ncfile]
+    except (KeyError, TypeError):
+        pass
+    index = {}
+    for position, (var_name, variable) in enumerate(ncfile.variables.items()):
+        if "standard_name" in variable.ncattrs() and variable.standard_name not in index:
+            index[variable.standard_name] = (position, var_name)
+    try:
+        _STANDARD_NAME_INDEX[ncfile] = index
+    except TypeError:  # objects that cannot be weakly referenced are not cached
+        pass
+    return index
+
+
 def identify_variable(ncfile, standard_names, check=False):
     """
     Identify the variable in ncfile that is described by specified rules.
@@ -56,9 +91,11 @@ def identify_variable(ncfile, standard_names, check=False):
     if not isinstance(standard_names, list):
         standard_names = [standard_names]
 
-    for var_name, variable in ncfile.variables.items():
-        if "standard_name" in variable.ncattrs() and variable.standard_name in standard_names:
-            return var_name, variable
+    index = standard_name_index(ncfile)
+    candidates = [index[_x] for _x in standard_names if _x in index]
+    if candidates:
+        _, var_name = min(candidates)
+        return var_name, ncfile.variables[var_name]
     if check:
         raise IOError("cannot identify NetCDF variable "
                       f"specified by {standard_names}")
@@ -244,6 +281,16 @@ class MFDatasetCommonDims(netCDF4.MFDataset):
 
         master = files[0]
 
+        # The dimension checks below read all coordinate arrays. They are
+        # skipped for file sets that passed them before and did not change.
+        stats = [os.stat(_x) for _x in files]
+        key = (tuple(files), tuple((_x.st_mtime_ns, _x.st_size) for _x in stats),
+               tuple(exclude), tuple(skip_dim_check), require_dim_num)
+        with _COMPATIBLE_FILE_SETS_LOCK:
+            checked = key in _COMPATIBLE_FILE_SETS
+            if checked:
+                _COMPATIBLE_FILE_SETS.move_to_end(key)
+
         # Open the master again, this time as a classic CDF instance. This will avoid
         # calling methods of the CDFMF subclass when querying the master file.
         cdfm = netCDF4.Dataset(master)
@@ -254,7 +301,7 @@ class MFDatasetCommonDims(netCDF4.MFDataset):
         masterDims = list(cdfm.dimensions.keys())
         # Check that each dimension has a coordinate dimension
         for dimName in masterDims:
-            if dimName not in cdfm.variables and dimName not in skip_dim_check:
+            if not checked and dimName not in cdfm.variables and dimName not in skip_dim_check:
                 raise IOError(f"dimension '{dimName}' has no coordinate variable in master '{master}'")
 
         # Create the following:
@@ -280,7 +327,7 @@ class MFDatasetCommonDims(netCDF4.MFDataset):
             # Make sure dimension of new dataset are contained in the master.
             for dimName in part.dimensions:
                 # (..except those that shall not be tested..)
-                if dimName not in skip_dim_check:
+                if not checked and dimName not in skip_dim_check:
                     if dimName not in masterDims:
                         raise IOError(f"dimension '{dimName}' not defined in master '{master}'")
                     if dimName not in part.variables:
@@ -290,7 +337,7 @@ class MFDatasetCommonDims(netCDF4.MFDataset):
                         raise IOError(f"dimension '{dimName}' differs in master '{master}' and "
                                       f"file '{f}'")
 
-            if require_dim_num:
+            if require_dim_num and not checked:
                 if len(part.dimensions) != len(masterDims):
                     raise IOError("number of dimensions not consistent in master "
                                   f"'{master}' and '{f}'")
@@ -319,6 +366,12 @@ class MFDatasetCommonDims(netCDF4.MFDataset):
                                  "formatted files, not NETCDF4")
             self._file_format.append(dset.file_format)
 
+        if not checked:
+            with _COMPATIBLE_FILE_SETS_LOCK:
+                _COMPATIBLE_FILE_SETS[key] = True
+                while len(_COMPATIBLE_FILE_SETS) > COMPATIBLE_FILE_SETS_SIZE:
+                    _COMPATIBLE_FILE_SETS.popitem(last=False)
+
     def getOriginFile(self, varname):
         """Returns filename and NetCDF4.Dataset-instance of the file that
            contains <varname>.
@@ -47,6 +47,8 @@
 #   -- renamed to ogcwms (2017-04-28)
 #   -- PEP8 review
 #   -- adopted it to the recent 0.14 version https://pypi.python.org/pypi/OWSLib/0.14.0
+#   -- added getfeatureinfo for the JSON point queries of the MSS WMS
+#   -- layer metadata is parsed on first access
 # ******************************************************************************
 #
 # =============================================================================
@@ -60,7 +62,9 @@ Currently supports only versions 1.1.1/1.3.0 of the WMS protocol.
 from future import standard_library
 standard_library.install_aliases()
 
+import copy
 import defusedxml.ElementTree as etree
+import json
 import requests
 import logging
 
@@ -252,9 +256,12 @@ class WebMapService(wms111.WebMapService_1_1_1):
                 if cm.id:
                     if cm.id in self.contents:
                         logging.debug('Content metadata for layer "%s" already exists. Using child layer' % cm.id)
-                    layers.append(cm)
                     self.contents[cm.id] = cm
-                cm.children = gather_layers(elem, cm)
+                layers.append(cm)
+                children = gather_layers(elem, cm)
+                cm.children = [_x for _x in children if _x.id]
+                # (mss) as before, child layers are only listed for WMS 1.1.1 documents
+                cm.layers = children if self.version == "1.1.1" else []
             return layers
         gather_layers(caps, None)
 
@@ -285,58 +292,121 @@ class WebMapService(wms111.WebMapService_1_1_1):
             raise ServiceException(err_message, se_xml)
         return u
 
-    def getfeatureinfo(self):
-        raise NotImplementedError
+    def getfeatureinfo(self, layers, lat, lon, time=None, init_time=None, level=None,
+                       info_format="application/json", timeout=None):
+        """
+        (mss) Request the values of the data fields of <layers> at a point from
+        an MSS WMS and return the decoded JSON document. <time> may be a single
+        time, an interval "start/end" or None to obtain a time series over all
+        valid times of <init_time>. Without <level>, whole columns are returned.
+        """
+        try:
+            base_url = next((m.get("url") for m in self.getOperationByName("GetFeatureInfo").methods
+                             if m.get("type").lower() == "get"), self.url)
+        except KeyError:
+            base_url = self.url
+        request = {"service": "WMS", "version": self.version, "request": "GetFeatureInfo",
+                   "query_layers": ",".join(layers), "info_format": info_format,
+                   "lat": str(lat), "lon": str(lon)}
+        if time is not None:
+            request["time"] = time
+        if init_time is not None:
+            request["dim_init_time"] = init_time
+        if level is not None:
+            request["elevation"] = str(level)
+        u = openURL(base_url, request, method="Get", timeout=timeout or self.timeout, auth=self.auth)
+        return json.loads(u.read())
 
 
 def ContentMetadata(elem, parent=None, children=None, index=0,
                     parse_remote_metadata=False,
                     timeout=config_loader(dataset="WMS_request_timeout"),
                     auth=None, version="1.3.0"):
-    WMS_NAMESPACE = "{http://www.opengis.net/wms}" if version == "1.3.0" else ""
+    return LayerMetadata(elem, parent=parent, children=children, index=index,
+                         parse_remote_metadata=parse_remote_metadata, timeout=timeout, auth=auth, version=version)
 
-    if version == "1.3.0":
-        metadata = wms130.ContentMetadata(elem, parent=parent, children=children, index=index,
-                                          parse_remote_metadata=parse_remote_metadata, timeout=timeout, auth=auth)
-    else:
-        metadata = wms111.ContentMetadata(elem, parent=parent, children=children, index=index,
-                                          parse_remote_metadata=parse_remote_metadata, timeout=timeout, auth=auth)
-
-    # (mss) Parse dimensions and their extents.
-    metadata.dimensions = {}
-    metadata.extents = {}
-    for dim in elem.findall(f'{WMS_NAMESPACE}Dimension'):
-        dimname = dim.attrib.get("name").lower()
-        metadata.dimensions[dimname] = dim.attrib
-        if version == "1.3.0":
-            metadata.extents[dimname] = dim.attrib
-            metadata.extents[dimname]["values"] = dim.text.strip().split(",")
-    if version == "1.1.1":
-        for extent in elem.findall(f'{WMS_NAMESPACE}Extent'):
-            extname = extent.attrib.get("name").lower()
-            metadata.extents[extname] = extent.attrib
-            if extent.text:
-                metadata.extents[extname]["values"] = extent.text.strip().split(",")
-            else:
-                metadata.extents[extname]["values"] = []
-    # (mss)
-
-    # (mss) Added "Abstract".
-    for key in ('Name', 'Title', 'Abstract'):
-        val = elem.find(WMS_NAMESPACE + key)
-        # (mss) Added " and val.text is not None".
-        if val is not None and val.text is not None:
-            setattr(metadata, key.lower(), val.text.strip())
-        else:
-            setattr(metadata, key.lower(), None)
-        metadata.id = metadata.name  # conform to new interface
 
-    # (mss) Replace owslib ContentMetadata children with ogcwms ContentMetadata
-    metadata.layers = []
-    for child in elem.findall('Layer'):
-        metadata.layers.append(ContentMetadata(child, metadata, version=version))
+class LayerMetadata(object):
+    """
+    (mss) Metadata of a layer of the capabilities document.
 
-    return metadata
+    Name, title, abstract, queryable, CRS and the child layers are read when
+    the document is loaded. All other metadata of owslib's ContentMetadata as
+    well as the dimensions and extents are parsed from the element when one
+    of them is accessed first, as servers may offer thousands of layers of
+    which only a few are used.
+    """
+
+    def __init__(self, elem, parent=None, children=None, index=0, parse_remote_metadata=False,
+                 timeout=config_loader(dataset="WMS_request_timeout"), auth=None, version="1.3.0"):
+        namespace = "{http://www.opengis.net/wms}" if version == "1.3.0" else ""
+        self.elem = elem
+        self.parent = parent
+        self.children = children or []
+        self.layers = []
+        self._index = index
+        self._options = {"parse_remote_metadata": parse_remote_metadata, "timeout": timeout, "auth": auth}
+        self._version = version
+        self._parsed = False
+        self.index = f"{parent.index}.{index}" if parent else str(index)
+        # (mss) Added "Abstract".
+        for key in ('Name', 'Title', 'Abstract'):
+            val = elem.find(namespace + key)
+            # (mss) Added " and val.text is not None".
+            if val is not None and val.text is not None:
+                setattr(self, key.lower(), val.text.strip())
+            else:
+                setattr(self, key.lower(), None)
+        self.id = self.name  # conform to new interface
+        self.queryable = int(elem.attrib.get('queryable', 0))
+        # CRS options are inherited, as in owslib
+        crs = list(parent.crsOptions) if parent else []
+        for crs_list in elem.findall(namespace + ("CRS" if version == "1.3.0" else "SRS")):
+            if crs_list.text:
+                crs.extend(crs_list.text.split())
+        self.crsOptions = list(set(crs))
+
+    def __getattr__(self, name):
+        # only called for attributes not set yet
+        if name.startswith("__") or self.__dict__.get("_parsed", True):
+            raise AttributeError(name)
+        self._parse()
+        return getattr(self, name)
+
+    def _parse(self):
+        """
+        Parses all metadata of the layer element.
+        """
+        self._parsed = True
+        namespace = "{http://www.opengis.net/wms}" if self._version == "1.3.0" else ""
+        # owslib would parse all child layers again
+        elem = copy.copy(self.elem)
+        for child in elem.findall(f'{namespace}Layer'):
+            elem.remove(child)
+        metadata = (wms130 if self._version == "1.3.0" else wms111).ContentMetadata(
+            elem, parent=self.parent, index=self._index, **self._options)
+        for key, value in vars(metadata).items():
+            if key not in self.__dict__ and key not in ("_children", "layers"):
+                setattr(self, key, value)
+
+        # (mss) Parse dimensions and their extents.
+        self.dimensions = {}
+        self.extents = {}
+        for dim in elem.findall(f'{namespace}Dimension'):
+            dimname = dim.attrib.get("name").lower()
+            self.dimensions[dimname] = dim.attrib
+            if self._version == "1.3.0":
+                self.extents[dimname] = dim.attrib
+                self.extents[dimname]["values"] = dim.text.strip().split(",")
+        if self._version == "1.1.1":
+            for extent in elem.findall(f'{namespace}Extent'):
+                extname = extent.attrib.get("name").lower()
+                self.extents[extname] = extent.attrib
+                if extent.text:
+                    self.extents[extname]["values"] = extent.text.strip().split(",")
+                else:
+                    self.extents[extname]["values"] = []
+        # (mss)
 
 
 class WMSCapabilitiesReader(common.WMSCapabilitiesReader):
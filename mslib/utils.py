@@ -26,29 +26,25 @@
     limitations under the License.
 """
 
+import bisect
+import collections.abc
+import copy
 import datetime
-import isodate
 import json
 import logging
 import netCDF4 as nc
 import numpy as np
 import os
 import pint
-from fs import open_fs, errors
-from scipy.interpolate import interp1d
-from scipy.ndimage import map_coordinates
 import subprocess
 import sys
 
-try:
-    import mpl_toolkits.basemap.pyproj as pyproj
-except ImportError:
-    import pyproj
-
 from mslib.msui import constants, MissionSupportSystemDefaultConfig
-from mslib.thermolib import pressure2flightlevel
 from PyQt5 import QtCore, QtWidgets
 
+# fs, scipy, pyproj and mslib.thermolib (metpy) are imported by the functions using them, as
+# importing them takes seconds and this module is imported by every mss component at startup.
+
 UR = pint.UnitRegistry()
 UR.define("PVU = 10^-6 m^2 s^-1 K kg^-1")
 UR.define("degrees_north = degrees")
@@ -96,20 +92,126 @@ UR.define("pptv = 1e-12 fraction")
 
 def parse_iso_datetime(string):
     try:
-        result = isodate.parse_datetime(string)
-    except isodate.ISO8601Error:
-        result = isodate.parse_date(string)
-        result = datetime.datetime.fromordinal(result.toordinal())
-        logging.debug("ISO String Couldn't be Parsed.\n ISO8601Error Encountered.")
+        # fast path for the usual "2012-10-17T12:00:00Z"
+        result = datetime.datetime.fromisoformat(string[:-1] if string.endswith("Z") else string)
+    except ValueError:
+        import isodate
+        try:
+            result = isodate.parse_datetime(string)
+        except isodate.ISO8601Error:
+            result = isodate.parse_date(string)
+            result = datetime.datetime.fromordinal(result.toordinal())
+            logging.debug("ISO String Couldn't be Parsed.\n ISO8601Error Encountered.")
     if result.tzinfo is not None:
         result = result.astimezone(datetime.timezone.utc).replace(tzinfo=None)
     return result
 
 
 def parse_iso_duration(string):
+    import isodate
     return isodate.parse_duration(string)
 
 
+class TimeExtent(collections.abc.Sequence):
+    """
+    Sorted sequence of the distinct times of a WMS time extent.
+
+    The extent is made of runs of equally spaced times, given as (start, end,
+    period), or as (time, time, None) for single times. The times of a run
+    are computed when accessed, so that long intervals are neither expanded
+    nor parsed time by time. Periods of months or years, which are not fixed
+    time spans, as well as overlapping runs are expanded to single times.
+
+    With <isoformat>, the times are given as strings "2012-10-17T12:00:00Z".
+    """
+
+    def __init__(self, runs=(), isoformat=False):
+        singles = set()
+        regular = []
+        for start, end, period in runs:
+            if period is None:
+                singles.add(start)
+            elif isinstance(period, datetime.timedelta):
+                if period <= datetime.timedelta(0):
+                    raise ValueError(f"invalid period '{period}'")
+                if start <= end:
+                    regular.append((start, period, (end - start) // period + 1))
+            else:
+                if start + period <= start:
+                    raise ValueError(f"invalid period '{period}'")
+                while start <= end:
+                    singles.add(start)
+                    start += period
+        regular.extend((_x, None, 1) for _x in singles)
+        regular.sort(key=lambda _x: _x[0])
+        self._runs = regular
+        if any(self._last(_x) >= _y[0] for _x, _y in zip(regular, regular[1:])):
+            self._runs = [(_x, None, 1) for _x in sorted({_y for _x in regular for _y in self._expand(_x)})]
+        self._starts = [_x[0] for _x in self._runs]
+        self._offsets = [0]
+        for _, _, count in self._runs:
+            self._offsets.append(self._offsets[-1] + count)
+        self.isoformat = isoformat
+
+    @staticmethod
+    def _last(run):
+        start, period, count = run
+        return start + period * (count - 1) if period else start
+
+    @staticmethod
+    def _expand(run):
+        start, period, count = run
+        return (start + period * _i for _i in range(count)) if period else [start]
+
+    def strings(self):
+        """
+        Returns this extent with the times as strings.
+        """
+        result = copy.copy(self)
+        result.isoformat = True
+        return result
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_i] for _i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("time extent index out of range")
+        run = bisect.bisect_right(self._offsets, index) - 1
+        start, period, _ = self._runs[run]
+        result = start + period * (index - self._offsets[run]) if period else start
+        return result.isoformat() + "Z" if self.isoformat else result
+
+    def __iter__(self):
+        for run in self._runs:
+            for result in self._expand(run):
+                yield result.isoformat() + "Z" if self.isoformat else result
+
+    def index(self, value, start=0, stop=None):
+        if isinstance(value, str):
+            value = parse_iso_datetime(value)
+        run = bisect.bisect_right(self._starts, value) - 1
+        if run >= 0:
+            first, period, count = self._runs[run]
+            steps, remainder = divmod(value - first, period) if period else (0, value - first)
+            if not remainder and steps < count:
+                result = self._offsets[run] + steps
+                if start <= result and (stop is None or result < stop):
+                    return result
+        raise ValueError(f"{value} is not in time extent")
+
+    def __contains__(self, value):
+        try:
+            self.index(value)
+        except (ValueError, TypeError):
+            return False
+        return True
+
+
 class FatalUserError(Exception):
     def __init__(self, error_string):
         logging.debug("%s", error_string)
@@ -124,6 +226,8 @@ def read_config_file(config_file=None):
 
     Returns: a dictionary
     """
+    from fs import open_fs, errors
+
     user_config = {}
     if config_file is not None:
         _dirname, _name = os.path.split(config_file)
@@ -171,6 +275,17 @@ def config_loader(config_file=None, dataset=None):
         return default_config
 
 
+def get_geod():
+    """
+    Returns a pyproj.Geod of the WGS84 ellipsoid.
+    """
+    try:
+        import mpl_toolkits.basemap.pyproj as pyproj
+    except ImportError:
+        import pyproj
+    return pyproj.Geod(ellps="WGS84")
+
+
 def get_distance(coord0, coord1):
     """
     Computes the distance between two points on the Earth surface
@@ -181,7 +296,7 @@ def get_distance(coord0, coord1):
     Returns:
         length of distance in km
     """
-    pr = pyproj.Geod(ellps='WGS84')
+    pr = get_geod()
     return (pr.inv(coord0[1], coord0[0], coord1[1], coord1[0])[-1] / 1000.)
 
 
@@ -435,6 +550,9 @@ def interpolate_vertsec(data3D, data3D_lats, data3D_lons, lats, lons):
     data3D can be on an IRREGULAR lat/lon grid, coordinates given by lats, lons.
     The lats, lons arrays can have arbitrary order, they do not have to be uniform.
     """
+    from scipy.interpolate import interp1d
+    from scipy.ndimage import map_coordinates
+
     # Create an empty field to accommodate the curtain.
     curtain = np.zeros([data3D.shape[0], len(lats)])
 
@@ -479,7 +597,7 @@ def latlon_points(p1, p2, numpoints=100, connection='linear', contains_altitude=
         lons = np.linspace(p1[LON], p2[LON], numpoints)
     elif connection == 'greatcircle':
         if numpoints > 2:
-            gc = pyproj.Geod(ellps="WGS84")
+            gc = get_geod()
             pts = gc.npts(p1[LON], p1[LAT], p2[LON], p2[LAT], numpoints - 2)
             lats = np.asarray([p1[LAT]] + [_x[1] for _x in pts] + [p2[LAT]])
             lons = np.asarray([p1[LON]] + [_x[0] for _x in pts] + [p2[LON]])
@@ -595,6 +713,8 @@ def convert_pressure_to_vertical_axis_measure(vertical_axis, pressure):
     - flight level
     - pressure
     """
+    from mslib.thermolib import pressure2flightlevel
+
     if vertical_axis == "pressure":
         return float(pressure / 100)
     elif vertical_axis == "flight level":